@@ -12,4 +12,11 @@ if app == 'media_tree':
     FileNodeAdmin = getattr(admin_module, modeladmin)
 
     from django.contrib import admin
-    admin.site.register(FileNode, FileNodeAdmin)
\ No newline at end of file
+    admin.site.register(FileNode, FileNodeAdmin)
+
+    from media_tree.models import ThumbnailFailure
+    from media_tree.admin.thumbnailfailure import ThumbnailFailureAdmin
+    admin.site.register(ThumbnailFailure, ThumbnailFailureAdmin)
+    from media_tree.models import MaintenanceJob
+    from media_tree.admin.maintenancejob import MaintenanceJobAdmin
+    admin.site.register(MaintenanceJob, MaintenanceJobAdmin)
@@ -3,6 +3,8 @@ from media_tree.admin.actions.utils import get_actions_context
 from media_tree.admin.actions.forms import FileNodeActionsWithUserForm, MoveSelectedForm, CopySelectedForm, ChangeMetadataForSelectedForm
 from media_tree.forms import MetadataForm
 from media_tree.utils.filenode import get_nested_filenode_list
+from media_tree.utils.bulk import get_editable_fields, get_common_values
+from media_tree.utils.export import export_metadata, EXPORT_CONTENT_TYPES
 from django import forms
 from django.contrib import messages
 from django.utils.translation import ungettext, ugettext as _
@@ -10,7 +12,8 @@ from django.template import RequestContext
 from django.core.urlresolvers import reverse
 from django.shortcuts import render_to_response
 from django.contrib.admin import helpers
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, \
+    StreamingHttpResponse
 
 
 def get_current_node(form):
@@ -113,15 +116,7 @@ def change_metadata_for_selected(modeladmin, request, queryset):
     
     # Compare all nodes in queryset in order to display initial values
     # in form that have an identical value for all nodes 
-    initial = {}
-    for node in queryset:
-        for field in node._meta.fields:
-            if field.editable:
-                value = getattr(node, field.name)
-                if not field.name in initial:
-                    initial[field.name] = value
-                elif value != initial[field.name]:
-                    initial[field.name] = None
+    initial = get_common_values(queryset, get_editable_fields())
 
     success_messages = ['%(count)i %(verbose_name)s changed.', '%(count)i %(verbose_name_plural)s changed.']
     extra_context = ({
@@ -131,3 +126,18 @@ def change_metadata_for_selected(modeladmin, request, queryset):
     return filenode_admin_action(modeladmin, request, queryset, 
         ChangeMetadataForSelectedForm, extra_context, success_messages, form_initial=initial)
 change_metadata_for_selected.short_description = _('Change metadata for selected %(verbose_name_plural)s')
+
+def export_metadata_response(queryset, format):
+    response = StreamingHttpResponse(export_metadata(queryset, format),
+        content_type=EXPORT_CONTENT_TYPES[format])
+    response['Content-Disposition'] = \
+        'attachment; filename="media_tree_metadata.%s"' % format
+    return response
+
+def export_metadata_csv(modeladmin, request, queryset):
+    return export_metadata_response(queryset, 'csv')
+export_metadata_csv.short_description = _('Export metadata for selected %(verbose_name_plural)s as CSV')
+
+def export_metadata_jsonl(modeladmin, request, queryset):
+    return export_metadata_response(queryset, 'jsonl')
+export_metadata_jsonl.short_description = _('Export metadata for selected %(verbose_name_plural)s as JSON Lines')
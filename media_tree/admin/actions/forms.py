@@ -1,7 +1,7 @@
 from media_tree.models import FileNode
 from media_tree.fields import FileNodeChoiceField
 from media_tree.forms import MetadataForm
-from media_tree.utils import get_media_storage
+from media_tree.utils.bulk import get_bulk_fields, update_metadata
 from django import forms
 from django.utils.translation import ugettext as _
 from django.contrib.admin import helpers
@@ -173,54 +173,29 @@ class ChangeMetadataForSelectedForm(FileNodeActionsWithUserForm):
         node.save()
         return changed
 
-    def save_nodes_rec(self, nodes):
+    def save_nodes_rec(self, nodes, metadata):
         for node in nodes:
-            if self.update_node(node, self.confirmed_data):
+            if self.update_node(node, metadata):
                 self.success_count += 1
             if self.cleaned_data['recursive'] and node.is_folder():
-                self.save_nodes_rec(node.get_children())
-
-    def save(self):
-        self.success_count = 0
-        self.save_nodes_rec(self.get_selected_nodes())
-
-
-class StorageFilesForm(FileNodeActionsForm):
-
-    def __init__(self, queryset, orphaned_files_choices, *args, **kwargs):
-        self.success_files = []
-        self.error_files = []
-        super(StorageFilesForm, self).__init__(queryset, *args, **kwargs)
-        self.fields['selected_files'] = forms.MultipleChoiceField(label=self.selected_files_label, choices=orphaned_files_choices, widget=forms.widgets.CheckboxSelectMultiple)
-
-
-class DeleteStorageFilesForm(StorageFilesForm):
-
-    def __init__(self, *args, **kwargs):
-        super(DeleteStorageFilesForm, self).__init__(*args, **kwargs)
-        self.fields['confirm'] = confirm = forms.BooleanField(label=_('Yes, I am sure that I want to delete the selected files from storage:'))  
+                self.save_nodes_rec(node.get_children(), metadata)
 
     def save(self):
         """
-        Deletes the selected files from storage
+        Updates the confirmed fields of all selected nodes (and their
+        descendants, if requested) using set-based queries. Fields that
+        affect the tree structure are still saved node by node.
         """
-        storage = get_media_storage()
-        for storage_name in self.cleaned_data['selected_files']:
-            full_path = storage.path(storage_name)
-            try:
-                storage.delete(storage_name)
-                self.success_files.append(full_path)
-            except OSError:
-                self.error_files.append(full_path)
-
-
-class DeleteOrphanedFilesForm(DeleteStorageFilesForm):
-
-    action_name = 'delete_orphaned_files'
-    selected_files_label = _('The following files exist in storage, but are not found in the database')
-
-
-class DeleteCacheFilesForm(DeleteStorageFilesForm):
-
-    action_name = 'clear_cache'
-    selected_files_label = _('Cache files')
+        self.success_count = 0
+        bulk_fields = get_bulk_fields()
+        bulk_metadata = dict([(key, value) for key, value
+            in self.confirmed_data.items() if key in bulk_fields])
+        node_metadata = dict([(key, value) for key, value
+            in self.confirmed_data.items() if not key in bulk_fields])
+        if bulk_metadata:
+            self.success_count = update_metadata(self.get_selected_nodes(),
+                bulk_metadata, self.user, self.cleaned_data['recursive'])
+        if node_metadata:
+            bulk_count, self.success_count = self.success_count, 0
+            self.save_nodes_rec(self.get_selected_nodes(), node_metadata)
+            self.success_count = max(bulk_count, self.success_count)
@@ -20,6 +20,7 @@ from media_tree.admin.actions.utils import execute_empty_queryset_action
 from media_tree.admin.utils import (set_current_request,
                                     get_request_attr, set_request_attr)
 from media_tree.admin.views.change_list import SimpleFileNodeChangeList
+from media_tree.utils.search import search_nodes, tokenize
 
 from ..forms import SimpleFileForm
 from ..models import FileNode
@@ -114,6 +115,19 @@ class BaseFileNodeAdmin(ModelAdmin):
         """ Returns the ChangeList class for use on the changelist page. """
         return SimpleFileNodeChangeList
 
+    def get_search_results(self, request, queryset, search_term):
+        """ Answers searches from the search index if
+            ``MEDIA_TREE_SEARCH_INDEX`` is enabled, optionally restricted to
+            the descendants of the folder set by ``init_search_folder()``.
+            Searches without any indexable terms, such as punctuation, are
+            answered by the default search. """
+        if not app_settings.MEDIA_TREE_SEARCH_INDEX \
+                or not tokenize(search_term):
+            return super(BaseFileNodeAdmin, self).get_search_results(
+                request, queryset, search_term)
+        subtree = get_request_attr(request, 'search_folder', None)
+        return search_nodes(queryset, search_term, subtree), False
+
     def get_form(self, request, *args, **kwargs):
         self.fields = self.form.Meta.fields
         return super(BaseFileNodeAdmin, self).get_form(
@@ -271,6 +285,8 @@ class BaseFileNodeAdmin(ModelAdmin):
 
 
 BaseFileNodeAdmin.register_action(core_actions.copy_selected)
+BaseFileNodeAdmin.register_action(core_actions.export_metadata_csv)
+BaseFileNodeAdmin.register_action(core_actions.export_metadata_jsonl)
 BaseFileNodeAdmin.register_action(maintenance_actions.delete_orphaned_files,
                                   ('media_tree.manage_filenode',))
 BaseFileNodeAdmin.register_action(maintenance_actions.clear_cache,
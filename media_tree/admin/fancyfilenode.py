@@ -26,12 +26,14 @@ from django.contrib.admin.options import csrf_protect_m
 from django.contrib.admin.templatetags.admin_list import _boolean_icon
 from django.contrib.admin.util import unquote
 from django.contrib.admin.views.main import IS_POPUP_VAR
+from django.core.exceptions import PermissionDenied
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import UploadedFile
 from django.core.urlresolvers import reverse
 from django.db import models, transaction
 from django.http import Http404, HttpResponse, HttpResponseRedirect
-from django.shortcuts import get_object_or_404
+from django.shortcuts import get_object_or_404, render_to_response
+from django.template import RequestContext
 from django.template.defaultfilters import filesizeformat
 from django.template.loader import render_to_string
 from django.utils.text import capfirst
@@ -51,6 +53,8 @@ from media_tree.admin.utils import (get_current_request, set_current_request,
                                     is_search_request)
 from media_tree.admin.views.change_list import FileNodeChangeList
 from media_tree.media_backends import get_media_backend
+from media_tree.utils.analytics import get_usage, get_tables, GROUPING_NAMES
+from media_tree.utils.instrumentation import timed
 from media_tree.models import FileNode
 from media_tree.widgets import AdminThumbWidget
 from media_tree.fields import FileNodeChoiceField
@@ -67,6 +71,9 @@ from mptt.forms import TreeNodeChoiceField
 from .base import BaseFileNodeAdmin
 
 
+USAGE_TABLE_ROWS = 20
+
+
 class FileNodeAdmin(BaseFileNodeAdmin, MPTTModelAdmin):
     """ The FileNodeAdmin aims to let you manage your media files on
         the web like you are used to on your desktop computer.
@@ -199,7 +206,10 @@ class FileNodeAdmin(BaseFileNodeAdmin, MPTTModelAdmin):
                 name='%s_%s_open_root' % info),
             url(r'^(.+)/expand/$',
                 self.admin_site.admin_view(self.folder_expand_view),
-                name='%s_%s_folder_expand' % info))
+                name='%s_%s_folder_expand' % info),
+            url(r'^usage/$',
+                self.admin_site.admin_view(self.usage_view),
+                name='%s_%s_usage' % info))
         url_patterns.extend(urls)
         return url_patterns
 
@@ -248,6 +258,16 @@ class FileNodeAdmin(BaseFileNodeAdmin, MPTTModelAdmin):
     def get_parent_folder(self, request):
         return get_request_attr(request, 'parent_folder', None)
 
+    def init_search_folder(self, request):
+        """ Search requests display a flat list, but can be restricted to a
+            subtree by passing ``folder_id``. """
+        folder_id = request.GET.get('folder_id', None)
+        if folder_id:
+            request.GET = request.GET.copy()
+            del request.GET['folder_id']
+            set_request_attr(request, 'search_folder', get_object_or_404(
+                FileNode, pk=folder_id, node_type=media_types.FOLDER))
+
     def get_expanded_folders_pk(self, request):
         if not hasattr(request, 'expanded_folders_pk'):
             expanded_folders_pk = []
@@ -303,6 +323,7 @@ class FileNodeAdmin(BaseFileNodeAdmin, MPTTModelAdmin):
 
     # List display functions
 
+    @timed('admin_preview')
     def admin_preview(self, node, icons_only=False):
         request = get_current_request()
         template = 'admin/media_tree/filenode/includes/preview.html'
@@ -501,6 +522,7 @@ class FileNodeAdmin(BaseFileNodeAdmin, MPTTModelAdmin):
             self.init_parent_folder(request)
         else:
             self.reset_expanded_folders_pk(request)
+            self.init_search_folder(request)
         parent_folder = self.get_parent_folder(request)
         set_current_request(request)
 
@@ -544,6 +566,30 @@ class FileNodeAdmin(BaseFileNodeAdmin, MPTTModelAdmin):
             response, [expanded.pk for expanded in expand])
         return response
 
+    # Usage view
+
+    def usage_view(self, request):
+        """ Shows the storage usage of all files, or of the files in the
+            folder given by the ``folder_id`` parameter. """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        folder = None
+        if request.GET.get('folder_id'):
+            folder = get_object_or_404(FileNode.folders,
+                                       pk=request.GET['folder_id'])
+        report = get_usage(folder, refresh=bool(request.GET.get('refresh')))
+        context = {
+            'title': ugettext('Storage usage'),
+            'opts': self.model._meta,
+            'app_label': self.model._meta.app_label,
+            'folder': folder,
+            'report': report,
+            'tables': [(GROUPING_NAMES[name], name, rows) for name, rows
+                       in get_tables(report, USAGE_TABLE_ROWS).items()],
+        }
+        return render_to_response('admin/media_tree/filenode/usage.html',
+            context, context_instance=RequestContext(request))
+
     # Open path view
 
     def open_path_view(self, request, path=''):
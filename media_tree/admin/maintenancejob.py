@@ -0,0 +1,86 @@
+from media_tree.models import MaintenanceJob
+from media_tree.utils.maintenance_jobs import delete_selected_files, \
+    start_job
+from media_tree.utils import get_media_storage
+from django.contrib import admin, messages
+from django.core.paginator import Paginator, InvalidPage
+from django.http import Http404, HttpResponseRedirect
+from django.shortcuts import get_object_or_404, render_to_response
+from django.template import RequestContext
+from django.utils.translation import ungettext, ugettext as _
+
+
+ITEMS_PER_PAGE = 100
+
+
+class MaintenanceJobAdmin(admin.ModelAdmin):
+    """ Lists maintenance jobs started by admin actions. The change view of
+        a job shows its progress, and lets users delete the files it found
+        page by page or all at once. """
+
+    list_display = ('__unicode__', 'kind', 'phase', 'status', 'progress',
+                    'user', 'finished')
+    list_filter = ('kind', 'status')
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress(self, job):
+        if job.total is None:
+            return ''
+        return '%i / %i' % (job.processed, job.total)
+    progress.short_description = _('progress')
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        job = get_object_or_404(MaintenanceJob, pk=object_id)
+        if not self.has_change_permission(request, job):
+            raise Http404
+        if job.is_stale:
+            # The process running the job has been interrupted
+            start_job(job)
+        files = job.items.filter(node=None)
+        can_delete = not job.is_active and files.filter(deleted=False).exists()
+
+        if request.method == 'POST' and can_delete:
+            if not request.POST.get('confirm'):
+                messages.error(request, _('Please confirm that you want to '
+                                          'delete the selected files.'))
+            else:
+                if request.POST.get('select_all'):
+                    count = delete_selected_files(job)
+                else:
+                    count = delete_selected_files(job,
+                        request.POST.getlist('selected_items'))
+                if count:
+                    messages.success(request, ungettext(
+                        'Deleting %i file in the background.',
+                        'Deleting %i files in the background.',
+                        count) % count)
+                else:
+                    messages.warning(request, _('No files were selected.'))
+            return HttpResponseRedirect('')
+
+        paginator = Paginator(files, ITEMS_PER_PAGE)
+        try:
+            page = paginator.page(request.GET.get('p', 1))
+        except InvalidPage:
+            raise Http404
+        storage = get_media_storage()
+        for item in page.object_list:
+            item.url = storage.url(item.name)
+
+        context = {
+            'title': unicode(job),
+            'job': job,
+            'opts': self.model._meta,
+            'app_label': self.model._meta.app_label,
+            'broken_items': job.items.exclude(node=None).select_related(
+                'node')[:ITEMS_PER_PAGE],
+            'broken_count': job.items.exclude(node=None).count(),
+            'paginator': paginator,
+            'page': page,
+            'can_delete': can_delete,
+        }
+        context.update(extra_context or {})
+        return render_to_response('admin/media_tree/maintenancejob/job.html',
+            context, context_instance=RequestContext(request))
@@ -0,0 +1,40 @@
+from media_tree.models import ThumbnailFailure
+from media_tree.utils.thumbnail_failures import retry_failures
+from django.contrib import admin, messages
+from django.utils.html import format_html
+from django.utils.translation import ungettext, ugettext_lazy as _
+
+
+class ThumbnailFailureAdmin(admin.ModelAdmin):
+    """ Lists the sources for which thumbnails could not be created, most
+        recent failures first. """
+
+    list_display = ('name', 'node_link', 'options', 'count', 'first_failed',
+                    'last_failed', 'error')
+    list_filter = ('backend',)
+    search_fields = ('name', 'error')
+    date_hierarchy = 'last_failed'
+    readonly_fields = ('backend', 'name', 'node', 'options', 'error', 'count',
+                       'first_failed', 'last_failed')
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    def node_link(self, failure):
+        if failure.node:
+            return format_html(u'<a href="{0}">{1}</a>',
+                failure.node.get_admin_url(), failure.node.__unicode__())
+        return ''
+    node_link.short_description = _('media object')
+    node_link.allow_tags = True
+
+    def retry(self, request, queryset):
+        count = queryset.count()
+        retry_failures(queryset)
+        messages.success(request, message=ungettext(
+            'Thumbnails of %i source will be created again on the next '
+            'request.',
+            'Thumbnails of %i sources will be created again on the next '
+            'request.', count) % count)
+    retry.short_description = _('Retry')
@@ -2,6 +2,7 @@ import django
 from django.contrib.admin.views.main import ChangeList
 from django.db import models
 
+from media_tree import settings as app_settings
 from media_tree.admin.utils import (get_current_request, is_search_request,
                                     get_request_attr)
 from media_tree.models import FileNode
@@ -108,6 +109,8 @@ class FileNodeChangeList(MPTTChangeList):
                 qs = qs.filter(parent=self.parent_folder)
 
         if request is not None and self.is_filtered(request):
+            if self.query and app_settings.MEDIA_TREE_SEARCH_INDEX:
+                return qs.order_by('-search_rank', 'name')
             return qs.order_by('name')
         else:
             # always order by (tree_id, left)
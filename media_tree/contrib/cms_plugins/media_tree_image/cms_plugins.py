@@ -1,8 +1,7 @@
 from media_tree.contrib.cms_plugins.media_tree_image.models import MediaTreeImage
 from media_tree.contrib.cms_plugins.forms import MediaTreePluginFormBase
 from media_tree.contrib.views.detail.image import ImageNodeDetailMixin
-from media_tree import media_types
-from media_tree.media_backends import get_media_backend
+from media_tree.media_backends import get_source_backend
 from media_tree.contrib.cms_plugins.helpers import PluginLink
 from cms.plugin_base import CMSPluginBase
 from cms.plugin_pool import plugin_pool
@@ -49,8 +48,8 @@ class MediaTreeImagePlugin(CMSPluginBase, ImageNodeDetailMixin):
         return context
 
     def icon_src(self, instance):
-        media_backend = get_media_backend(fail_silently=False, handles_media_types=(
-            media_types.SUPPORTED_IMAGE,))
+        media_backend = get_source_backend(instance.node.file,
+                                           fail_silently=False)
         thumb = media_backend.get_thumbnail(instance.node.file, {'size': (200, 200)})
         return thumb.url
 
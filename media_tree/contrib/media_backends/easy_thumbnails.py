@@ -1,14 +1,24 @@
+from __future__ import absolute_import
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import get_storage_class
 from media_tree import media_types
 from media_tree import settings as app_settings
 from media_tree.media_backends import MediaBackend, ThumbnailError
 from media_tree.utils import get_media_storage
-from easy_thumbnails import utils
-from easy_thumbnails.files import get_thumbnailer
+from media_tree.utils.instrumentation import timed
+from media_tree.utils.storage_probe import stat_many
+from easy_thumbnails import engine, utils
+from easy_thumbnails.conf import settings as thumbnail_settings
+from easy_thumbnails.files import get_thumbnailer, ThumbnailFile
+from easy_thumbnails.models import Thumbnail
 import os
 
 
+# Number of thumbnail names per query when deleting thumbnail records
+RECORDS_PER_QUERY = 500
+
+
 class EasyThumbnailsBackend(MediaBackend):
     """ Media backend which generates thumbnails using easy_thumbnails. """
 
@@ -21,11 +31,52 @@ class EasyThumbnailsBackend(MediaBackend):
                                        'INSTALLED_APPS.')
 
     @staticmethod
+    def get_options(options):
+        opts = {}
+        opts.update(app_settings.MEDIA_TREE_GLOBAL_THUMBNAIL_OPTIONS or {})
+        opts.update(options)
+        return opts
+
+    @classmethod
+    def get_source_options(cls, source, options):
+        """ Converts the focal point of the source's node into an edge crop
+            argument for easy_thumbnails, which is computed from the image
+            dimensions stored in the node so that the crop is centered on
+            the focal point as far as possible. """
+        opts = super(EasyThumbnailsBackend, cls).get_source_options(
+            source, options)
+        focal_point = opts.get('focal_point')
+        instance = getattr(source, 'instance', None)
+        width = getattr(instance, 'width', None)
+        height = getattr(instance, 'height', None)
+        if not focal_point or not width or not height:
+            return opts
+        opts = dict(opts)
+        del opts['focal_point']
+        target_x, target_y = [float(value or 0) for value in opts['size']]
+        if not target_x and not target_y:
+            return opts
+        scale = max(target_x / width, target_y / height)
+        if not opts.get('upscale'):
+            scale = min(scale, 1.0)
+        crop = []
+        for source_length, target, focal in ((width, target_x,
+                focal_point[0]), (height, target_y, focal_point[1])):
+            scaled = source_length * scale
+            if not target or target >= scaled:
+                crop.append('')
+                continue
+            offset = max(0, min(focal * scaled - target / 2, scaled - target))
+            crop.append(str(int(round(offset * 100 / target))))
+        if any(crop):
+            opts['crop'] = ','.join(crop)
+        return opts
+
+    @staticmethod
+    @timed('thumbnail_generate')
     def get_thumbnail(source, options):
         try:
-            opts = {}
-            opts.update(app_settings.MEDIA_TREE_GLOBAL_THUMBNAIL_OPTIONS or {})
-            opts.update(options)
+            opts = EasyThumbnailsBackend.get_options(options)
             thumbnail = get_thumbnailer(source).get_thumbnail(opts)
         except Exception as inst:
             EasyThumbnailsBackend.check_conf()
@@ -35,6 +86,133 @@ class EasyThumbnailsBackend(MediaBackend):
                 return None
         return thumbnail
 
+    @classmethod
+    def thumbnail_exists(cls, source, options):
+        try:
+            opts = cls.get_options(options)
+            thumbnailer = get_thumbnailer(source)
+            for transparent in (False, True):
+                name = thumbnailer.get_thumbnail_name(opts,
+                                                      transparent=transparent)
+                if thumbnailer.thumbnail_exists(name):
+                    return True
+        except Exception:
+            pass
+        return False
+
+    @staticmethod
+    def is_current(source_stat, thumbnail_stat, modified, source_modified):
+        """ Returns whether a thumbnail exists and its source is not newer,
+            like easy_thumbnails does: the modification times of the files
+            are compared if the storages provide them, and those cached in
+            the database otherwise. """
+        if not thumbnail_stat:
+            return False
+        if thumbnail_stat[1] and source_stat and source_stat[1]:
+            return source_stat[1] <= thumbnail_stat[1]
+        return source_modified <= modified
+
+    @classmethod
+    def resolve_thumbnails(cls, sources, options):
+        """ Looks up the thumbnails of all sources in the easy_thumbnails
+            database with a single query, and only generates the ones that
+            do not exist yet, whose files are missing from storage, or whose
+            sources are newer. Files are checked in batches (see
+            :func:`stat_many`), and are not opened if the dimensions of the
+            thumbnails can be computed from those of their nodes. """
+        try:
+            opts = cls.get_options(options)
+            thumbnailers = [get_thumbnailer(source) for source in sources]
+            candidates = []
+            for thumbnailer in thumbnailers:
+                candidates.append(
+                    [thumbnailer.get_thumbnail_name(opts, transparent=False),
+                     thumbnailer.get_thumbnail_name(opts, transparent=True)])
+            storage = thumbnailers[0].thumbnail_storage
+            rows = Thumbnail.objects.filter(
+                storage_hash=utils.get_storage_hash(storage),
+                name__in=[name for names in candidates for name in names]) \
+                    .values_list('name', 'modified', 'source__modified')
+            thumbnail_stats = stat_many(storage, [row[0] for row in rows])
+            source_stats = stat_many(thumbnailers[0].source_storage,
+                set([thumbnailer.name for thumbnailer, names
+                     in zip(thumbnailers, candidates)
+                     if set(names) & set(thumbnail_stats)]))
+        except Exception:
+            return super(EasyThumbnailsBackend, cls).resolve_thumbnails(
+                sources, options)
+
+        existing = {}
+        for name, modified, source_modified in rows:
+            existing[name] = (thumbnail_stats[name], modified, source_modified)
+        thumbnails = []
+        missing = []
+        for index, (source, thumbnailer, names) in enumerate(
+                zip(sources, thumbnailers, candidates)):
+            source_stat = source_stats.get(thumbnailer.name)
+            found = [name for name in names if name in existing
+                     and cls.is_current(source_stat, *existing[name])]
+            if found:
+                thumbnail = ThumbnailFile(name=found[0],
+                    storage=thumbnailer.thumbnail_storage,
+                    thumbnail_options=opts)
+                size = cls.get_thumbnail_size(source, opts)
+                if size:
+                    # Used by the width and height of Django's ImageFile
+                    thumbnail._dimensions_cache = size
+                thumbnails.append(thumbnail)
+            else:
+                thumbnails.append(None)
+                missing.append(index)
+        if missing:
+            generated = cls.generate_thumbnails(
+                [sources[index] for index in missing], options)
+            for index, thumbnail in zip(missing, generated):
+                thumbnails[index] = thumbnail
+        return thumbnails
+
+    @classmethod
+    def generate_source_thumbnails(cls, source, options_list):
+        """ Creates all thumbnails of ``source`` from a single decoded
+            source image, instead of reading and decoding the source file
+            for each thumbnail. The source image is generated by
+            easy_thumbnails' engine, and passed to
+            ``Thumbnailer.generate_thumbnail()`` through the thumbnailer's
+            ``generate_source_image()``. """
+        try:
+            thumbnailer = get_thumbnailer(source)
+            generators = getattr(thumbnailer, 'source_generators', None)
+            source_images = {}
+            def generate_cached_source_image(thumbnail_options):
+                # The only option affecting the source image by default
+                key = thumbnail_options.get('exif_orientation', True)
+                if not key in source_images:
+                    source_images[key] = engine.generate_source_image(
+                        thumbnailer, thumbnail_options, generators)
+                image = source_images[key]
+                return image.copy() if image is not None else None
+            thumbnailer.generate_source_image = generate_cached_source_image
+        except Exception:
+            return super(EasyThumbnailsBackend, cls) \
+                .generate_source_thumbnails(source, options_list)
+
+        return [cls.get_thumbnail(thumbnailer, options)
+                for options in options_list]
+
+    @staticmethod
+    def get_thumbnail_storage():
+        return get_storage_class(thumbnail_settings.THUMBNAIL_DEFAULT_STORAGE)()
+
+    @classmethod
+    def delete_thumbnail_records(cls, names):
+        sources = set()
+        for index in range(0, len(names), RECORDS_PER_QUERY):
+            thumbnails = Thumbnail.objects.filter(
+                name__in=names[index:index + RECORDS_PER_QUERY])
+            sources.update(thumbnails.values_list('source__name', flat=True))
+            thumbnails.delete()
+        return list(sources)
+
     @staticmethod
     def get_valid_thumbnail_options():
         options = utils.valid_processor_options()
@@ -45,4 +223,4 @@ class EasyThumbnailsBackend(MediaBackend):
     def get_cache_paths(subdirs=None):
         if hasattr(settings, 'THUMBNAIL_SUBDIR'):
             return MediaBackend.get_cache_paths((settings.THUMBNAIL_SUBDIR,))
-        return ()
\ No newline at end of file
+        return ()
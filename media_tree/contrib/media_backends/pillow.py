@@ -0,0 +1,362 @@
+from __future__ import absolute_import
+from django.core.files import File
+from media_tree import media_types
+from media_tree import settings as app_settings
+from media_tree.media_backends import MediaBackend, ThumbnailError, \
+    ThumbnailInfo, get_scaled_size
+from media_tree.utils import get_media_storage
+from media_tree.utils.instrumentation import timed
+from media_tree.utils.storage_probe import stat_many
+from PIL import Image
+from tempfile import SpooledTemporaryFile
+import os
+
+
+RESAMPLE = getattr(Image, 'LANCZOS', Image.ANTIALIAS)
+
+# Operations applied to images depending on their EXIF orientation tag
+EXIF_ORIENTATION_TAG = 0x0112
+EXIF_TRANSPOSE = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.ROTATE_270, Image.FLIP_LEFT_RIGHT),
+    6: (Image.ROTATE_270,),
+    7: (Image.ROTATE_90, Image.FLIP_LEFT_RIGHT),
+    8: (Image.ROTATE_90,),
+}
+
+# Images are reduced to an integer fraction of their size before being
+# resampled, as long as they remain at least this many times the target size
+REDUCING_GAP = 2
+
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+def get_exif_orientation(image):
+    try:
+        return image._getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+
+
+def reduce_image(image, factor):
+    """ Shrinks ``image`` by an integer ``factor`` using a box filter, which
+        is much faster than resampling the full image. """
+    if hasattr(image, 'reduce'):
+        return image.reduce(factor)
+    return image.resize((image.size[0] // factor, image.size[1] // factor),
+                        getattr(Image, 'BOX', Image.NEAREST))
+
+
+def get_crop_offset(scaled, final, focal):
+    """ Returns the offset at which a length of ``final`` is cropped from a
+        length of ``scaled``, centered on the relative ``focal`` position as
+        far as possible. """
+    offset = int(round(focal * scaled - final / 2.0))
+    return max(0, min(offset, scaled - final))
+
+
+def scale_image(image, scaled_size):
+    factor = min(image.size[0] // (scaled_size[0] * REDUCING_GAP),
+                 image.size[1] // (scaled_size[1] * REDUCING_GAP))
+    if factor > 1:
+        image = reduce_image(image, factor)
+    if image.size != scaled_size:
+        image = image.resize(scaled_size, RESAMPLE)
+    return image
+
+
+def crop_image(image, final_size, focal_point=None):
+    if image.size == final_size:
+        return image
+    focal_x, focal_y = focal_point or (.5, .5)
+    left = get_crop_offset(image.size[0], final_size[0], focal_x)
+    top = get_crop_offset(image.size[1], final_size[1], focal_y)
+    return image.crop((left, top, left + final_size[0], top + final_size[1]))
+
+
+class SourceImage(object):
+    """ An opened source image, which is decoded only once, at the smallest
+        resolution required for all thumbnails that are created from it. """
+
+    def __init__(self, source, storage):
+        self.file = storage.open(source.name)
+        self.image = Image.open(self.file)
+        self.format = self.image.format
+        self.orientation = get_exif_orientation(self.image)
+        self.transposed = self.orientation in (5, 6, 7, 8)
+        self.decoded = False
+        self.pyramid = []
+
+    @property
+    def size(self):
+        """ The size of the image after applying its EXIF orientation. """
+        width, height = self.image.size
+        if self.transposed and not self.decoded:
+            return (height, width)
+        return (width, height)
+
+    def has_alpha(self):
+        return self.image.mode in ('RGBA', 'LA') \
+            or (self.image.mode == 'P' and 'transparency' in self.image.info)
+
+    def decode(self, min_size):
+        """ Decodes the image, allowing JPEG images to be scaled down in the
+            DCT domain while decoding, as long as they remain at least
+            ``min_size``. """
+        if self.decoded:
+            return self.image
+        if self.transposed:
+            min_size = (min_size[1], min_size[0])
+        mode = 'RGBA' if self.has_alpha() else 'RGB'
+        if self.format == 'JPEG':
+            self.image.draft(mode, min_size)
+        image = self.image
+        if image.mode != mode:
+            image = image.convert(mode)
+        for method in EXIF_TRANSPOSE.get(self.orientation, ()):
+            image = image.transpose(method)
+        image.load()
+        self.image = image
+        self.decoded = True
+        return image
+
+    def get_scaled(self, scaled_size):
+        """ Returns the decoded image scaled to ``scaled_size``. Scaled
+            versions are kept, so that when thumbnails are created from
+            largest to smallest, each one is resampled from the previous one
+            instead of from the full decoded image. """
+        base = self.decode(scaled_size)
+        for image in self.pyramid:
+            if image.size[0] >= scaled_size[0] \
+                and image.size[1] >= scaled_size[1] \
+                and image.size[0] < base.size[0]:
+                base = image
+        image = scale_image(base, scaled_size)
+        if image is not base:
+            self.pyramid.append(image)
+        return image
+
+    def close(self):
+        self.pyramid = []
+        self.file.close()
+
+
+class PillowBackend(MediaBackend):
+    """ Media backend which generates thumbnails using Pillow directly.
+
+        JPEG images are scaled down while decoding using ``Image.draft()``,
+        and reduced by an integer factor before being resampled, which is
+        considerably faster and uses less memory than decoding them at full
+        resolution. """
+
+    SUPPORTED_MEDIA_TYPES = (media_types.SUPPORTED_IMAGE,)
+
+    THUMBNAIL_SUBDIR = '_thumbs'
+
+    DEFAULT_QUALITY = 85
+
+    @staticmethod
+    def get_options(options):
+        opts = {}
+        opts.update(app_settings.MEDIA_TREE_GLOBAL_THUMBNAIL_OPTIONS or {})
+        opts.update(options)
+        return opts
+
+    @classmethod
+    def get_output_format(cls, source_image, opts):
+        if opts.get('format'):
+            return opts['format'].upper()
+        return 'PNG' if source_image.has_alpha() else 'JPEG'
+
+    @classmethod
+    def get_thumbnail_name(cls, source, opts, output_format):
+        parts = ['%ix%i' % tuple([int(value or 0) for value in opts['size']])]
+        for option in ('crop', 'upscale', 'progressive'):
+            if opts.get(option):
+                parts.append(option)
+        if opts.get('crop') and opts.get('focal_point'):
+            parts.append('%ix%i' % tuple([int(round(value * 1000))
+                                          for value in opts['focal_point']]))
+        if output_format == 'JPEG':
+            parts.append('q%i' % int(opts.get('quality', cls.DEFAULT_QUALITY)))
+        extension = 'jpg' if output_format == 'JPEG' \
+            else output_format.lower()
+        return os.path.join(os.path.dirname(source.name), cls.THUMBNAIL_SUBDIR,
+            '%s.%s.%s' % (os.path.basename(source.name), '_'.join(parts),
+                          extension))
+
+    @classmethod
+    def get_thumbnail_names(cls, source, opts):
+        if opts.get('format'):
+            formats = (opts['format'].upper(),)
+        else:
+            formats = ('JPEG', 'PNG')
+        return [cls.get_thumbnail_name(source, opts, output_format)
+                for output_format in formats]
+
+    @staticmethod
+    def is_current(thumbnail_stat, source_stat):
+        """ Returns whether a thumbnail exists and its source is not newer,
+            given the results of :func:`stat` for both files. If the storage
+            does not provide modification times, any existing thumbnail is
+            considered current. """
+        if not thumbnail_stat:
+            return False
+        if thumbnail_stat[1] and source_stat and source_stat[1]:
+            return source_stat[1] <= thumbnail_stat[1]
+        return True
+
+    @classmethod
+    def get_existing_thumbnail(cls, storage, source, opts, stats):
+        """ Returns the current thumbnail of ``source`` for ``opts``, if any,
+            given the results of :func:`stat_many` for its possible names
+            and its source. The thumbnail file is only opened if its
+            dimensions cannot be computed from those of the node. """
+        for name in cls.get_thumbnail_names(source, opts):
+            if cls.is_current(stats.get(name), stats.get(source.name)):
+                size = cls.get_thumbnail_size(source, opts)
+                if not size:
+                    thumbnail_file = storage.open(name)
+                    try:
+                        size = Image.open(thumbnail_file).size
+                    finally:
+                        thumbnail_file.close()
+                return ThumbnailInfo(name, storage.url(name), size[0],
+                                     size[1], storage)
+
+    @classmethod
+    def thumbnail_exists(cls, source, options):
+        storage = get_media_storage()
+        opts = cls.get_options(options)
+        names = cls.get_thumbnail_names(source, opts)
+        try:
+            stats = stat_many(storage, names + [source.name])
+        except EnvironmentError:
+            return False
+        return any([cls.is_current(stats[name], stats[source.name])
+                    for name in names])
+
+    @classmethod
+    def resolve_thumbnails(cls, sources, options):
+        """ Checks the files of all existing thumbnails and of their sources
+            in a single batch (see :func:`stat_many`), and only generates
+            the thumbnails that do not exist yet or whose sources are
+            newer. """
+        storage = get_media_storage()
+        opts = cls.get_options(options)
+        names = set()
+        for source in sources:
+            names.add(source.name)
+            names.update(cls.get_thumbnail_names(source, opts))
+        thumbnails = [None] * len(sources)
+        try:
+            stats = stat_many(storage, names)
+            for index, source in enumerate(sources):
+                thumbnails[index] = cls.get_existing_thumbnail(storage,
+                    source, opts, stats)
+        except EnvironmentError:
+            pass
+        missing = [index for index, thumbnail in enumerate(thumbnails)
+                   if not thumbnail]
+        if missing:
+            generated = cls.generate_thumbnails(
+                [sources[index] for index in missing], options)
+            for index, thumbnail in zip(missing, generated):
+                thumbnails[index] = thumbnail
+        return thumbnails
+
+    @classmethod
+    def save_thumbnail(cls, storage, source, source_image, opts):
+        scaled_size, final_size = get_scaled_size(source_image.size,
+            opts['size'], crop=opts.get('crop'), upscale=opts.get('upscale'))
+        image = crop_image(source_image.get_scaled(scaled_size), final_size,
+                           opts.get('focal_point'))
+        output_format = cls.get_output_format(source_image, opts)
+        name = cls.get_thumbnail_name(source, opts, output_format)
+        save_options = {}
+        if output_format == 'JPEG':
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            save_options['quality'] = int(opts.get('quality',
+                                                   cls.DEFAULT_QUALITY))
+            save_options['optimize'] = True
+            if opts.get('progressive'):
+                save_options['progressive'] = True
+
+        # Encoded thumbnails are only kept in memory up to a certain size
+        output = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        try:
+            image.save(output, output_format, **save_options)
+            output.seek(0)
+            if storage.exists(name):
+                storage.delete(name)
+            name = storage.save(name, File(output))
+        finally:
+            output.close()
+        return ThumbnailInfo(name, storage.url(name), image.size[0],
+                             image.size[1], storage)
+
+    @classmethod
+    def generate_source_thumbnails(cls, source, options_list):
+        """ Creates all thumbnails of ``source`` that do not exist yet from
+            a single decoded source image. """
+        storage = get_media_storage()
+        thumbnails = [None] * len(options_list)
+        opts_list = [cls.get_options(options) for options in options_list]
+        try:
+            stats = stat_many(storage, [source.name] + [name
+                for opts in opts_list
+                for name in cls.get_thumbnail_names(source, opts)])
+        except EnvironmentError:
+            stats = {}
+        missing = []
+        for index, opts in enumerate(opts_list):
+            try:
+                thumbnails[index] = cls.get_existing_thumbnail(storage,
+                    source, opts, stats)
+            except EnvironmentError:
+                pass
+            if not thumbnails[index]:
+                missing.append((index, opts))
+        if not missing:
+            return thumbnails
+
+        with timed('thumbnail_generate'):
+            try:
+                source_image = SourceImage(source, storage)
+            except Exception as inst:
+                if app_settings.MEDIA_TREE_MEDIA_BACKEND_DEBUG:
+                    raise ThumbnailError(inst)
+                return thumbnails
+            try:
+                # Process the largest thumbnail first, so that the source
+                # image is decoded at a resolution sufficient for all of them
+                missing.sort(key=lambda item: get_scaled_size(
+                    source_image.size, item[1]['size'],
+                    crop=item[1].get('crop'), upscale=item[1].get('upscale'))[0],
+                    reverse=True)
+                for index, opts in missing:
+                    try:
+                        thumbnails[index] = cls.save_thumbnail(storage, source,
+                            source_image, opts)
+                    except Exception as inst:
+                        if app_settings.MEDIA_TREE_MEDIA_BACKEND_DEBUG:
+                            raise ThumbnailError(inst)
+            finally:
+                source_image.close()
+        return thumbnails
+
+    @classmethod
+    def get_thumbnail(cls, source, options):
+        return cls.generate_source_thumbnails(source, [options])[0]
+
+    @staticmethod
+    def get_valid_thumbnail_options():
+        return set(['crop', 'upscale', 'quality', 'progressive', 'format',
+                    'focal_point'])
+
+    @classmethod
+    def get_cache_paths(cls, subdirs=None):
+        return MediaBackend.get_cache_paths((cls.THUMBNAIL_SUBDIR,))
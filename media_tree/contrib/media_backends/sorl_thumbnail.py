@@ -1,6 +1,7 @@
 from django.core.exceptions import ImproperlyConfigured
 from media_tree import media_types 
 from media_tree.media_backends import MediaBackend, ThumbnailError
+from media_tree.utils.instrumentation import timed
 from sorl.thumbnail import get_thumbnail
 
 
@@ -16,6 +17,7 @@ class SorlThumbnailBackend(MediaBackend):
                                        'INSTALLED_APPS.')
     
     @staticmethod
+    @timed('thumbnail_generate')
     def get_thumbnail(source, options):
         size = options.pop('size')
         if not isinstance(size, basestring):
@@ -19,6 +19,12 @@ then use these coordinates in templates for image cropping.
 
     $ ./manage.py collectstatic
 
+Cropped thumbnails of images that have a focal point, such as those created by
+``{% thumbnail node "100x100" crop %}``, are automatically centered on the
+focal point by the media backend while the thumbnail is generated. The focal
+point is part of the thumbnail options, so a separate thumbnail is cached for
+each focal point.
+
 .. Note::
    This extension adds the fields ``focal_x`` and ``focal_y`` to
    the ``FileNode`` model. You are going to have to add these fields to 
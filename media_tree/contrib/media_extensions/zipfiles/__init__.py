@@ -6,6 +6,22 @@ The *zipfiles* extension adds support for ZIP archives to the ``FileNodeAdmin``.
 If it is installed, you can select files and folders in the admin and
 download them as a ZIP archive. 
 
+Archives are streamed to the client while they are being written, so that
+large selections can be downloaded without holding the archive in memory.
+Files that are already compressed, such as JPEG images or MP4 videos (see
+``MEDIA_TREE_ZIP_STORED_EXTENSIONS``), are stored without compressing them
+again. If all selected files are stored, their sizes are read from the
+storage, files missing from it are left out, and the response has an exact
+``Content-Length``; otherwise, the size of the uncompressed archive is sent in
+the ``X-Estimated-Content-Length`` header.
+
+Selected ZIP archives can also be extracted into the media tree, where each
+archive is extracted into a new folder next to it. Large archives are better
+extracted with the ``mediaunzip`` management command. Archives exceeding the
+``MEDIA_TREE_ZIP_EXTRACT_*`` limits or containing unsafe paths are rejected,
+and files whose types are not allowed (see ``MEDIA_TREE_ALLOWED_FILE_TYPES``)
+are skipped.
+
 To install it, add the extension module to your ``INSTALLED_APPS`` setting::   
 
     INSTALLED_APPS = (
@@ -0,0 +1,376 @@
+""" Extracting ZIP archives into the node tree.
+
+    The members of an archive are checked against the
+    ``MEDIA_TREE_ZIP_EXTRACT_*`` limits before anything is written, and each
+    member is then streamed into the storage, failing if its size turns out
+    to differ from the declared one. Names containing absolute paths or ``..`` are
+    rejected. Folders are created one by one, whereas file nodes are inserted
+    in bulk, and the tree fields of the target tree are computed once
+    afterwards (see :func:`repair_tree`), all in a single transaction. If
+    anything fails, the extracted files are deleted from the storage again.
+    Note that ``pre_save()`` is not called and no ``post_save`` signals are
+    sent for the extracted files. """
+
+from media_tree import media_types, settings as app_settings
+from media_tree.media_backends import get_worker_pool
+from media_tree.models import FileNode
+from media_tree.utils import get_media_storage, multi_splitext
+from media_tree.utils.bulk import update_has_metadata
+from media_tree.utils.checksums import ALGORITHM
+from media_tree.utils.search import get_search_engine, index_nodes
+from media_tree.utils.tree_integrity import repair_tree
+from django.core.files import File
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+from django.utils.translation import ugettext as _
+from PIL import Image
+import hashlib
+import re
+import stat
+import uuid
+import zipfile
+import zlib
+
+
+# Compression ratios are only checked for members larger than this
+RATIO_MIN_SIZE = 1024 * 1024
+
+BULK_CREATE_SIZE = 500
+
+
+class ArchiveError(Exception):
+    """ Raised if an archive cannot be extracted, or exceeds the limits
+        configured for extracting archives. """
+
+
+class ExtractStats(object):
+    """ The result of :func:`extract_archive`. """
+
+    def __init__(self):
+        self.folder = None
+        """ The folder the archive was extracted into """
+        self.files = 0
+        self.folders = 0
+        self.size = 0
+        self.skipped = []
+        """ Names of members that were not extracted """
+
+
+def get_member_path(info):
+    """ Returns the path of an archive member as a list of names, raising
+        :class:`ArchiveError` if it is absolute or contains ``..``. """
+    name = info.filename
+    if not isinstance(name, unicode):
+        # Archives without the UTF-8 flag are often encoded as UTF-8 anyway
+        try:
+            name = name.decode('utf-8')
+        except UnicodeDecodeError:
+            name = name.decode('cp437')
+    name = name.replace('\\', '/')
+    path = [part for part in name.split('/') if part not in ('', '.')]
+    if name.startswith('/') or re.match(r'^[a-zA-Z]:', name) \
+        or '..' in path:
+        raise ArchiveError(_('The archive contains an unsafe path: %s') %
+                           name)
+    return path
+
+
+def get_members(archive, stats, max_files=None, max_size=None,
+                max_ratio=None):
+    """ Returns the paths of all folders in ``archive``, and a list of
+        ``(info, path)`` tuples for the files to extract. Raises
+        :class:`ArchiveError` if the archive exceeds the given limits. """
+    folders = set()
+    members = []
+    total_size = 0
+    for info in archive.infolist():
+        path = get_member_path(info)
+        if not path:
+            continue
+        if info.filename.endswith('/'):
+            folders.add(tuple(path))
+            continue
+        mode = info.external_attr >> 16
+        extension = multi_splitext(path[-1])[2].lstrip('.').lower()
+        if stat.S_ISLNK(mode) or info.flag_bits & 0x1 \
+            or extension not in app_settings.MEDIA_TREE_ALLOWED_FILE_TYPES \
+            or info.file_size > app_settings.MEDIA_TREE_FILE_SIZE_LIMIT:
+            stats.skipped.append('/'.join(path))
+            continue
+        if max_ratio and info.file_size > RATIO_MIN_SIZE \
+            and info.file_size > max_ratio * max(info.compress_size, 1):
+            raise ArchiveError(_('The archive member %(name)s is compressed '
+                'more than %(ratio)i times.') % {'name': '/'.join(path),
+                'ratio': max_ratio})
+        total_size += info.file_size
+        members.append((info, path))
+        for index in range(1, len(path)):
+            folders.add(tuple(path[:index]))
+    if max_files and len(members) > max_files:
+        raise ArchiveError(_('The archive contains more than %i files.') %
+                           max_files)
+    if max_size and total_size > max_size:
+        raise ArchiveError(_('The archive contains more than %s of files.') %
+                           filesizeformat(max_size))
+    return sorted(folders), members
+
+
+def strip_common_folder(folder_paths, members):
+    """ Returns the name of the folder containing all members if there is
+        one, and the folder paths and members relative to that folder.
+        Otherwise, returns ``None`` and the unchanged paths and members. """
+    names = set([path[0] for path in folder_paths])
+    if len(names) != 1 or not all(len(path) > 1 for info, path in members):
+        return None, folder_paths, members
+    return names.pop(), [path[1:] for path in folder_paths if len(path) > 1], \
+        [(info, path[1:]) for info, path in members]
+
+
+class MemberReader(object):
+    """ A file-like object reading an archive member, which computes the
+        checksum of the member and fails if it is larger than declared.
+        Its ``size`` is the declared size, which storages may rely on, and
+        ``bytes_read`` the number of bytes read so far. """
+
+    def __init__(self, file, info):
+        self.file = file
+        self.name = info.filename
+        self.size = info.file_size
+        self.bytes_read = 0
+        self.checksum = hashlib.new(ALGORITHM)
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > self.size:
+            raise ArchiveError(_('The archive member %s is larger than '
+                                 'declared.') % self.name)
+        self.checksum.update(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def extract_file(archive, info, node, storage):
+    """ Saves the archive member ``info`` to ``storage`` as the file of
+        ``node``, and sets the file fields of ``node``. """
+    name = node._meta.get_field('file').generate_filename(node,
+        '%s.%s' % (uuid.uuid4(), node.extension))
+    reader = MemberReader(archive.open(info), info)
+    content = File(reader)
+    content.size = info.file_size
+    try:
+        node.file.name = storage.save(name, content)
+    except:
+        # Remove what has been written so far
+        if storage.exists(name):
+            storage.delete(name)
+        raise
+    finally:
+        reader.close()
+    if reader.bytes_read != info.file_size:
+        storage.delete(node.file.name)
+        raise ArchiveError(_('The archive member %s is smaller than '
+                             'declared.') % reader.name)
+    node.size = reader.bytes_read
+    node.checksum = reader.checksum.hexdigest()
+
+
+def probe_file(args):
+    """ Returns the media type, width and height of a stored file. Only
+        files whose names denote images are opened in order to find out
+        whether they are supported images, and their dimensions. """
+    name, filename = args
+    media_type = FileNode.mimetype_to_media_type(filename)
+    if media_type != media_types.IMAGE:
+        return media_type, None, None
+    try:
+        f = get_media_storage().open(name, 'rb')
+        try:
+            width, height = Image.open(f).size
+            return media_types.SUPPORTED_IMAGE, width, height
+        finally:
+            f.close()
+    except Exception:
+        # Not an image, or one that PIL refuses to open, such as a
+        # decompression bomb
+        return media_type, None, None
+
+
+def probe_files(nodes, workers=None):
+    workers = workers or app_settings.MEDIA_TREE_THUMBNAIL_WORKERS
+    args = [(node.file.name, node.name) for node in nodes]
+    if workers > 1 and len(args) > 1:
+        results = get_worker_pool(workers).map(probe_file, args)
+    else:
+        results = map(probe_file, args)
+    for node, (media_type, width, height) in zip(nodes, results):
+        node.media_type, node.width, node.height = media_type, width, height
+
+
+def delete_files(nodes, storage):
+    for node in nodes:
+        storage.delete(node.file.name)
+
+
+def get_unique_name(name, names):
+    """ Returns ``name``, numbered as :meth:`FileNode.save` does if it is
+        among ``names``, and adds it to ``names``. """
+    split = multi_splitext(name)
+    unique_name = name
+    number = 1
+    while unique_name in names:
+        number += 1
+        unique_name = app_settings.MEDIA_TREE_NAME_UNIQUE_NUMBERED_FORMAT % {
+            'name': split[0], 'number': number, 'ext': split[1]}
+    names.add(unique_name)
+    return unique_name
+
+
+def create_folder(name, parent, user=None):
+    folder = FileNode(node_type=FileNode.FOLDER, name=name, parent=parent)
+    folder.attach_user(user, False)
+    folder.save()
+    return folder
+
+
+def create_folders(target, paths, stats, user=None):
+    """ Returns a dictionary mapping each of the folder ``paths`` (and the
+        empty path, denoting ``target``) to a folder, using existing folders
+        with the same name. """
+    folders = {(): target}
+    created = set()
+    for path in paths:
+        parent = folders[path[:-1]]
+        folder = None
+        if parent.pk not in created:
+            folder = FileNode.folders.filter(parent=parent,
+                                             name=path[-1]).first()
+        if folder is None:
+            # Parents are fetched again since inserting folders changes
+            # their tree fields
+            folder = create_folder(path[-1],
+                FileNode._tree_manager.get(pk=parent.pk), user)
+            created.add(folder.pk)
+            stats.folders += 1
+        folders[path] = folder
+    return folders
+
+
+def create_file_nodes(nodes, folders):
+    """ Inserts ``nodes`` in bulk, within the caller's transaction. Their
+        tree fields are placeholders that sort them after the existing
+        children of their folders, and need to be recomputed afterwards. """
+    opts = FileNode._mptt_meta
+    rights = dict(FileNode._tree_manager.filter(pk__in=[folder.pk for folder
+        in folders]).values_list('pk', opts.right_attr))
+    for node in nodes:
+        folder = getattr(node, opts.parent_attr)
+        setattr(node, opts.tree_id_attr, getattr(folder, opts.tree_id_attr))
+        setattr(node, opts.level_attr, getattr(folder, opts.level_attr) + 1)
+        setattr(node, opts.left_attr, rights[folder.pk])
+        setattr(node, opts.right_attr, rights[folder.pk])
+    for index in range(0, len(nodes), BULK_CREATE_SIZE):
+        FileNode.objects.bulk_create(nodes[index:index + BULK_CREATE_SIZE])
+
+
+def add_nodes(node, target, folder_name, folder_paths, nodes, paths, stats,
+              user=None):
+    """ Creates the folders and file nodes for the extracted files, and
+        returns the target folder. """
+    if target is None:
+        target = create_folder(folder_name or multi_splitext(node.name)[0],
+            node.parent and FileNode._tree_manager.get(pk=node.parent_id),
+            user)
+    folders = create_folders(target, folder_paths, stats, user)
+    names = {}
+    for file_node, path in zip(nodes, paths):
+        folder = folders[path]
+        if folder.pk not in names:
+            names[folder.pk] = set(FileNode.objects.filter(parent=folder)
+                                   .values_list('name', flat=True))
+        file_node.parent = folder
+        file_node.name = get_unique_name(file_node.name, names[folder.pk])
+        file_node.attach_user(user, False)
+        file_node.prepare_metadata()
+    create_file_nodes(nodes, folders.values())
+
+    target = FileNode._tree_manager.get(pk=target.pk)
+    repair_tree(target.tree_id, commit=False)
+    target = FileNode._tree_manager.get(pk=target.pk)
+    update_has_metadata(target.get_descendants(include_self=True))
+    update_has_metadata(target.get_ancestors())
+    return target
+
+
+def extract_archive(node, target=None, user=None, workers=None):
+    """ Extracts the ZIP archive of ``node`` into the folder ``target``, or
+        into a new folder next to it, which is named after the archive or
+        after the folder containing all of its members. Returns an
+        :class:`ExtractStats` instance, or raises :class:`ArchiveError`.
+
+        Files are saved to the storage before any node is created. Their
+        media types and image dimensions are then determined in parallel
+        by ``workers`` processes (by default,
+        ``MEDIA_TREE_THUMBNAIL_WORKERS``). """
+    stats = ExtractStats()
+    storage = get_media_storage()
+    try:
+        f = storage.open(node.file.name, 'rb')
+        archive = zipfile.ZipFile(f)
+    except (zipfile.BadZipfile, EnvironmentError):
+        raise ArchiveError(_('%s is not a valid ZIP archive.') % node.name)
+    nodes = []
+    paths = []
+    try:
+        folder_paths, members = get_members(archive, stats,
+            app_settings.MEDIA_TREE_ZIP_EXTRACT_MAX_FILES,
+            app_settings.MEDIA_TREE_ZIP_EXTRACT_MAX_SIZE,
+            app_settings.MEDIA_TREE_ZIP_EXTRACT_MAX_RATIO)
+        folder_name = None
+        if target is None:
+            # Avoid nesting the folder of the archive in a folder of the same
+            # name, like desktop archive utilities
+            folder_name, folder_paths, members = strip_common_folder(
+                folder_paths, members)
+        for info, path in members:
+            file_node = FileNode(node_type=FileNode.FILE, name=path[-1],
+                extension=multi_splitext(path[-1])[2].lstrip('.').lower())
+            extract_file(archive, info, file_node, storage)
+            nodes.append(file_node)
+            paths.append(tuple(path[:-1]))
+            stats.size += file_node.size
+    except (zipfile.BadZipfile, zlib.error, RuntimeError) as e:
+        delete_files(nodes, storage)
+        raise ArchiveError(_('%(name)s could not be extracted: %(error)s') % {
+            'name': node.name, 'error': e})
+    except:
+        delete_files(nodes, storage)
+        raise
+    finally:
+        archive.close()
+        f.close()
+
+    try:
+        probe_files(nodes, workers)
+        if app_settings.MEDIA_TREE_SEARCH_INDEX:
+            # Looking up the search engine may commit while creating its
+            # table, so this is done before the transaction
+            get_search_engine()
+        with transaction.commit_on_success():
+            target = add_nodes(node, target, folder_name, folder_paths, nodes,
+                               paths, stats, user)
+    except:
+        delete_files(nodes, storage)
+        raise
+
+    if app_settings.MEDIA_TREE_SEARCH_INDEX:
+        for index in range(0, len(nodes), BULK_CREATE_SIZE):
+            for count in index_nodes(FileNode.objects.filter(file__in=[
+                file_node.file.name for file_node
+                in nodes[index:index + BULK_CREATE_SIZE]])):
+                pass
+    stats.folder = target
+    stats.files = len(nodes)
+    return stats
@@ -0,0 +1,50 @@
+from media_tree.contrib.media_extensions.zipfiles.extract_operations import \
+    extract_archive, ArchiveError
+from media_tree.media_backends import close_worker_pool
+from media_tree.models import FileNode
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from optparse import make_option
+import multiprocessing
+
+class Command(BaseCommand):
+
+    args = 'archive_id [folder_id]'
+    help = 'Extracts the ZIP archive of the given node into the given ' \
+        + 'folder, or into a new folder named after the archive.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers',
+            dest='workers',
+            type='int',
+            default=None,
+            help='Number of worker processes probing the extracted files '
+                '(default: number of CPUs)'),
+        )
+
+    def handle(self, *args, **options):
+        if not 1 <= len(args) <= 2:
+            raise CommandError('Usage: %s' % self.args)
+        try:
+            node = FileNode.files.get(pk=args[0])
+        except (FileNode.DoesNotExist, ValueError):
+            raise CommandError('There is no file with id %s.' % args[0])
+        target = None
+        if len(args) > 1:
+            try:
+                target = FileNode.folders.get(pk=args[1])
+            except (FileNode.DoesNotExist, ValueError):
+                raise CommandError('There is no folder with id %s.' % args[1])
+
+        try:
+            stats = extract_archive(node, target,
+                workers=options['workers'] or multiprocessing.cpu_count())
+        except ArchiveError as e:
+            raise CommandError(e)
+        finally:
+            close_worker_pool()
+        for name in stats.skipped:
+            self.stdout.write("Skipped %s\n" % name)
+        self.stdout.write("Extracted %i files (%s) and created %i folders in "
+            "%s (id %i).\n" % (stats.files, filesizeformat(stats.size),
+            stats.folders, stats.folder.get_path(), stats.folder.pk))
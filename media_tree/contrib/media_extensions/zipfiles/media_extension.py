@@ -1,11 +1,9 @@
 from media_tree.contrib.media_extensions.zipfiles import zip_operations as operations
 from media_tree import extension
-from cStringIO import StringIO
-from django.http import HttpResponse
-from django.utils.translation import ugettext, ugettext_lazy as _
+from django.contrib import messages
+from django.http import StreamingHttpResponse
+from django.utils.translation import ugettext, ungettext, ugettext_lazy as _
 
-# TODO: Implement extract_selected_archives, which unzips the selected archives into
-# a selectable or new destination folder
 class ZipFileAdminExtender(extension.AdminExtender):
     
     def download_selected_as_archive(modeladmin, request, queryset):
@@ -15,18 +13,42 @@ class ZipFileAdminExtender(extension.AdminExtender):
             file_name = ugettext('Archive')
         file_ext = 'zip'
         
-        response = HttpResponse(mimetype='application/zip')
+        archive = operations.ZipStream(operations.get_entries(queryset))
+        response = StreamingHttpResponse(archive,
+            content_type='application/zip')
         response['Content-Disposition'] = 'attachment; filename=%s.%s' % (
             file_name, file_ext)
-        buffer = StringIO()
-        operations.compress_nodes(buffer, queryset)
-        buffer.flush()
-        response.write(buffer.getvalue())
-        response['Content-Length'] = len(response.content);
-        buffer.close()
+        # The size is only known in advance if no file is compressed, and the
+        # sizes of all files have been read from the storage
+        if archive.is_stored:
+            archive.entries = operations.check_sizes(archive.entries)
+        if archive.is_size_exact:
+            response['Content-Length'] = archive.size
+        else:
+            response['X-Estimated-Content-Length'] = archive.size
         return response
     download_selected_as_archive.short_description = _('Download selected %(verbose_name_plural)s as archive')
     
-    actions = [download_selected_as_archive]
+    def extract_selected_archives(modeladmin, request, queryset):
+        # Imported here since this module is loaded along with the models
+        from media_tree.contrib.media_extensions.zipfiles.extract_operations \
+            import extract_archive, ArchiveError
+        for node in queryset.filter(extension='zip'):
+            try:
+                stats = extract_archive(node, user=request.user)
+            except ArchiveError as e:
+                messages.error(request, e)
+                continue
+            messages.success(request, ungettext(
+                '%(count)i file extracted to %(folder)s.',
+                '%(count)i files extracted to %(folder)s.', stats.files) % {
+                'count': stats.files, 'folder': stats.folder.name})
+            if stats.skipped:
+                messages.warning(request, ugettext(
+                    'The following files were skipped: %s') %
+                    ', '.join(stats.skipped))
+    extract_selected_archives.short_description = _('Extract selected archives')
+
+    actions = [download_selected_as_archive, extract_selected_archives]
 
 extension.register(ZipFileAdminExtender)
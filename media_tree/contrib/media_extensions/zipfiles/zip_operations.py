@@ -1,17 +1,275 @@
-import zipfile
-import os
+""" Writing ZIP archives as a stream of chunks, so that archives of any size
+    can be sent to the client while they are being written, without holding
+    them in memory or in a temporary file.
 
-def write_nodes_recursive(archive, nodes, parent_path=''):
+    Since the checksum and compressed size of an entry are only known after
+    its data has been written, they follow the data in a data descriptor.
+    Files whose extensions are listed in ``MEDIA_TREE_ZIP_STORED_EXTENSIONS``
+    are already compressed, and are stored without compressing them again.
+    ZIP64 records are written where sizes, offsets or the number of entries
+    exceed the limits of the original ZIP format. """
+
+from media_tree import settings as app_settings
+from media_tree.utils import get_media_storage
+from media_tree.utils.storage_probe import stat_many
+from django.utils import timezone
+import binascii
+import struct
+import zlib
+
+
+CHUNK_SIZE = 64 * 1024
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+COMPRESSION_LEVEL = 6
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+VERSION = 20
+VERSION_ZIP64 = 45
+# Data descriptor follows the data, names are encoded as UTF-8
+FLAGS = 0x08 | 0x800
+# Regular file, rw-r--r--
+EXTERNAL_ATTR = 0100644 << 16
+
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+DATA_DESCRIPTOR = struct.Struct('<4s3L')
+DATA_DESCRIPTOR_ZIP64 = struct.Struct('<4sL2Q')
+CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+ZIP64_END = struct.Struct('<4sQ2H2L4Q')
+ZIP64_LOCATOR = struct.Struct('<4sLQL')
+END = struct.Struct('<4s4H2LH')
+
+
+def dos_date_time(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    if value.year < 1980:
+        return 0, 0x21
+    return (value.hour << 11 | value.minute << 5 | value.second // 2,
+            (value.year - 1980) << 9 | value.month << 5 | value.day)
+
+
+def zip64_extra(*values):
+    """ Returns the ZIP64 extended information extra field containing
+        ``values``, or an empty string if there are none. """
+    if not values:
+        return ''
+    return struct.pack('<2H%iQ' % len(values), 1, 8 * len(values), *values)
+
+
+class ZipEntry(object):
+    """ A file to be written to an archive as ``arcname``, read from
+        ``storage`` using the storage name ``name``. ``size_checked``
+        indicates whether ``size`` was read from the storage, rather than
+        recorded in the database. """
+
+    def __init__(self, arcname, name, size, date_time, compress=True,
+                 size_checked=False):
+        self.arcname = arcname.encode('utf-8')
+        self.name = name
+        self.size = size
+        self.size_checked = size_checked
+        self.date_time = dos_date_time(date_time)
+        self.method = ZIP_DEFLATED if compress else ZIP_STORED
+
+    @property
+    def zip64(self):
+        # Deflating may slightly expand data that does not compress
+        return self.size * 1.05 > ZIP64_LIMIT
+
+    def local_header(self):
+        if self.zip64:
+            size, extra = ZIP64_LIMIT, zip64_extra(0, 0)
+        else:
+            size, extra = 0, ''
+        return LOCAL_HEADER.pack('PK\003\004',
+            VERSION_ZIP64 if self.zip64 else VERSION, FLAGS, self.method,
+            self.date_time[0], self.date_time[1], 0, size, size,
+            len(self.arcname), len(extra)) + self.arcname + extra
+
+    def data_descriptor(self, crc, compressed_size, size):
+        if self.zip64:
+            return DATA_DESCRIPTOR_ZIP64.pack('PK\007\010', crc,
+                                              compressed_size, size)
+        return DATA_DESCRIPTOR.pack('PK\007\010', crc, compressed_size, size)
+
+    def central_header(self, crc, compressed_size, size, offset):
+        values = [value for value in (size, compressed_size, offset)
+                  if value >= ZIP64_LIMIT]
+        extra = zip64_extra(*values)
+        version = VERSION_ZIP64 if values or self.zip64 else VERSION
+        return CENTRAL_HEADER.pack('PK\001\002', 3 << 8 | version, version,
+            FLAGS, self.method, self.date_time[0], self.date_time[1], crc,
+            min(compressed_size, ZIP64_LIMIT), min(size, ZIP64_LIMIT),
+            len(self.arcname), len(extra), 0, 0, 0, EXTERNAL_ATTR,
+            min(offset, ZIP64_LIMIT)) + self.arcname + extra
+
+    def iter_data(self, storage):
+        """ Yields the data of the file, compressed if required, and returns
+            its checksum and sizes in ``self.crc``, ``self.compressed_size``
+            and ``self.written_size`` once exhausted. """
+        crc = compressed_size = size = 0
+        if self.method == ZIP_DEFLATED:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED,
+                                          -zlib.MAX_WBITS)
+        f = storage.open(self.name, 'rb')
+        try:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = binascii.crc32(chunk, crc)
+                size += len(chunk)
+                if self.method == ZIP_DEFLATED:
+                    chunk = compressor.compress(chunk)
+                    if not chunk:
+                        continue
+                compressed_size += len(chunk)
+                yield chunk
+        finally:
+            f.close()
+        if self.method == ZIP_DEFLATED:
+            chunk = compressor.flush()
+            compressed_size += len(chunk)
+            yield chunk
+        self.crc = crc & 0xFFFFFFFF
+        self.compressed_size = compressed_size
+        self.written_size = size
+
+
+class ZipStream(object):
+    """ An iterable yielding a ZIP archive of ``entries`` (a list of
+        :class:`ZipEntry` objects) in chunks. Only the central directory
+        records of the entries written so far are kept in memory. """
+
+    def __init__(self, entries, storage=None):
+        self.entries = entries
+        self.storage = storage or get_media_storage()
+
+    @property
+    def is_stored(self):
+        """ Whether all entries are stored without compression. """
+        return all(entry.method == ZIP_STORED for entry in self.entries)
+
+    @property
+    def is_size_exact(self):
+        """ Whether :attr:`size` is exact, which is the case if all entries
+            are stored without compression, and their sizes were read from
+            the storage (see :func:`check_sizes`). """
+        return self.is_stored and all(entry.size_checked
+                                      for entry in self.entries)
+
+    @property
+    def size(self):
+        """ The size of the archive, assuming that compressed entries are as
+            large as their files. """
+        offset = 0
+        directory_size = 0
+        for entry in self.entries:
+            directory_size += len(entry.central_header(0, entry.size,
+                                                       entry.size, offset))
+            offset += len(entry.local_header()) + entry.size + len(
+                entry.data_descriptor(0, entry.size, entry.size))
+        return offset + directory_size + len(
+            self.end_records(offset, directory_size))
+
+    def end_records(self, directory_offset, directory_size):
+        count = len(self.entries)
+        records = ''
+        if (count > ZIP_MAX_ENTRIES or directory_offset >= ZIP64_LIMIT
+                or directory_size >= ZIP64_LIMIT):
+            zip64_offset = directory_offset + directory_size
+            records = ZIP64_END.pack('PK\006\006', ZIP64_END.size - 12,
+                3 << 8 | VERSION_ZIP64, VERSION_ZIP64, 0, 0, count, count,
+                directory_size, directory_offset) + ZIP64_LOCATOR.pack(
+                'PK\006\007', 0, zip64_offset, 1)
+        count = min(count, ZIP_MAX_ENTRIES)
+        return records + END.pack('PK\005\006', 0, 0, count, count,
+            min(directory_size, ZIP64_LIMIT),
+            min(directory_offset, ZIP64_LIMIT), 0)
+
+    def __iter__(self):
+        offset = 0
+        directory = []
+        for entry in self.entries:
+            header_offset = offset
+            header = entry.local_header()
+            offset += len(header)
+            yield header
+            for chunk in entry.iter_data(self.storage):
+                offset += len(chunk)
+                yield chunk
+            descriptor = entry.data_descriptor(entry.crc,
+                entry.compressed_size, entry.written_size)
+            offset += len(descriptor)
+            yield descriptor
+            directory.append(entry.central_header(entry.crc,
+                entry.compressed_size, entry.written_size, header_offset))
+        directory_size = 0
+        for record in directory:
+            directory_size += len(record)
+            yield record
+        yield self.end_records(offset, directory_size)
+
+
+def is_compressible(name):
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    return extension not in app_settings.MEDIA_TREE_ZIP_STORED_EXTENSIONS
+
+
+def get_entries(nodes, parent_path=''):
+    """ Returns a list of :class:`ZipEntry` objects for the files among
+        ``nodes`` and their descendants. File sizes that are not recorded
+        in the database are read from the storage, and files that turn out
+        to be missing from it are skipped. """
+    entries = []
+    files = []
     for node in nodes:
-        arcname = os.path.join(parent_path, node.name)
+        arcname = u'/'.join(filter(None, (parent_path, node.name)))
         if node.is_file():
-            archive.write(node.file.path, arcname)
+            files.append((arcname, node))
         elif node.is_folder():
-            write_nodes_recursive(archive, node.get_children(), arcname)
+            entries.extend(get_entries(node.get_children(), arcname))
+    stats = stat_many(get_media_storage(), [node.file.name for arcname, node
+                                            in files if node.size is None])
+    for arcname, node in files:
+        size = node.size
+        if size is None:
+            stat = stats.get(node.file.name)
+            if not stat:
+                continue
+            size = stat[0]
+        entries.append(ZipEntry(arcname, node.file.name, size,
+            node.modified or timezone.now(), is_compressible(node.file.name),
+            size_checked=node.size is None))
+    return entries
 
-def compress_nodes(file, nodes):
-    archive = zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED)
-    write_nodes_recursive(archive, nodes)
-    archive.close()
-    return archive
 
+def check_sizes(entries, storage=None):
+    """ Reads the sizes of ``entries`` that were recorded in the database
+        from the storage, so that the size of an archive can be exact, and
+        returns the entries whose files exist in the storage. """
+    stats = stat_many(storage or get_media_storage(), [entry.name for entry
+        in entries if not entry.size_checked])
+    checked = []
+    for entry in entries:
+        if not entry.size_checked:
+            stat = stats.get(entry.name)
+            if not stat:
+                continue
+            entry.size = stat[0]
+            entry.size_checked = True
+        checked.append(entry)
+    return checked
+
+
+def compress_nodes(file, nodes):
+    """ Writes a ZIP archive of ``nodes`` and their descendants to ``file``,
+        and returns the number of entries. """
+    entries = get_entries(nodes)
+    for chunk in ZipStream(entries):
+        file.write(chunk)
+    return len(entries)
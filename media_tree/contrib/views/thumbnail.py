@@ -0,0 +1,70 @@
+from media_tree.models import FileNode
+from media_tree.media_backends import get_source_backend
+from media_tree.utils.lazy_thumbnails import load_thumbnail_token
+from django.core import signing
+from django.core.servers.basehttp import FileWrapper
+from django.http import Http404, HttpResponseNotModified, \
+    HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.views.generic import View
+from hashlib import md5
+import mimetypes
+
+
+class ThumbnailView(View):
+    """
+    View generating thumbnails on first request, which is used for the signed
+    thumbnail URLs created by the ``thumbnail`` and ``thumbnails`` template
+    tags when ``MEDIA_TREE_LAZY_THUMBNAILS`` is enabled. Thumbnails that
+    already exist are looked up in the thumbnail cache, so that only the first
+    request for each thumbnail is slow.
+
+    The view needs to be added to your ``urls.py`` with the name
+    ``media_tree_thumbnail``::
+
+        from media_tree.contrib.views.thumbnail import ThumbnailView
+        from django.conf.urls.defaults import *
+
+        urlpatterns = patterns('',
+            url(r'^thumbnails/(?P<token>[\\w.:-]+)/$', ThumbnailView.as_view(),
+                name='media_tree_thumbnail'),
+        )
+    """
+
+    redirect = True
+    """ If ``True``, clients are redirected to the URL of the thumbnail file.
+    Otherwise, the file is served by the view itself. """
+
+    max_age = 60 * 60 * 24 * 365
+    """ Number of seconds for which clients may cache the response. Since the
+    thumbnail URL changes whenever its node is changed, this can be long. """
+
+    def get(self, request, token):
+        try:
+            pk, options = load_thumbnail_token(token)
+        except signing.BadSignature:
+            raise Http404
+        node = get_object_or_404(FileNode, pk=pk, node_type=FileNode.FILE)
+        backend = get_source_backend(node.file)
+        if not backend:
+            raise Http404
+        thumbnail = backend.get_thumbnails([node.file], options)[0]
+        if not thumbnail:
+            raise Http404
+
+        etag = '"%s"' % md5(thumbnail.url.encode('utf8')).hexdigest()
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponseNotModified()
+        elif self.redirect:
+            response = HttpResponseRedirect(thumbnail.url)
+        else:
+            storage = getattr(thumbnail, 'storage', None) \
+                or backend.get_thumbnail_storage()
+            content_type = mimetypes.guess_type(thumbnail.name)[0]
+            response = StreamingHttpResponse(
+                FileWrapper(storage.open(thumbnail.name)),
+                content_type=content_type or 'application/octet-stream')
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=self.max_age)
+        return response
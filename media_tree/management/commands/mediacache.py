@@ -1,6 +1,9 @@
-from media_tree.utils.maintenance import get_cache_files
+from media_tree.utils.maintenance import get_cache_files, \
+    evict_cache_files, forget_cache_files
 from media_tree.utils import get_media_storage
+from media_tree import settings as app_settings
 from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
 from optparse import make_option
 
 class Command(BaseCommand):
@@ -13,14 +16,54 @@ class Command(BaseCommand):
             dest='delete',
             default=False,
             help='Delete all cache files'),
+        make_option('--evict',
+            action='store_true',
+            dest='evict',
+            default=False,
+            help='Delete the least recently used cache files until the '
+                'cache is within --max-size and --max-age'),
+        make_option('--max-size',
+            dest='max_size',
+            type='int',
+            default=app_settings.MEDIA_TREE_CACHE_MAX_SIZE,
+            help='Maximum total size of cache files in bytes (default: '
+                'MEDIA_TREE_CACHE_MAX_SIZE)'),
+        make_option('--max-age',
+            dest='max_age',
+            type='int',
+            default=app_settings.MEDIA_TREE_CACHE_MAX_AGE,
+            help='Maximum number of seconds since a cache file was last used '
+                '(default: MEDIA_TREE_CACHE_MAX_AGE)'),
+        make_option('--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='With --evict, only list the files that would be deleted'),
         )
 
     def handle(self, *args, **options):
-        cache_files = get_cache_files()
         storage = get_media_storage()
+        if options['evict']:
+            if options['max_size'] is None and options['max_age'] is None:
+                raise CommandError('Eviction requires --max-size or '
+                    '--max-age, or the corresponding settings.')
+            evicted, freed, cache_size = evict_cache_files(
+                options['max_size'], options['max_age'], options['dry_run'])
+            for path in evicted:
+                self.stdout.write("%s %s\n" % (
+                    'Would delete' if options['dry_run'] else 'Deleted',
+                    storage.path(path)))
+            self.stdout.write("Evicted %i files (%s), %s remaining\n" % (
+                len(evicted), filesizeformat(freed),
+                filesizeformat(cache_size)))
+            return
+
+        cache_files = get_cache_files()
         for path in cache_files:
             if options['delete']:
                 storage.delete(path)
                 self.stdout.write("Deleted %s\n" % storage.path(path))
             else:
                 self.stdout.write("%s\n" % storage.path(path))
+        if options['delete'] and cache_files:
+            forget_cache_files(cache_files)
@@ -0,0 +1,44 @@
+from media_tree.models import FileNode
+from media_tree.utils.export import export_metadata, EXPORT_FORMATS
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import sys
+
+class Command(BaseCommand):
+
+    args = '[node_id node_id ...]'
+    help = 'Exports the metadata of the given nodes and all of their ' \
+        + 'descendants as CSV or JSON Lines. If no nodes are given, the ' \
+        + 'entire media tree is exported.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format',
+            dest='format',
+            default='csv',
+            help='Export format, one of: %s' % ', '.join(EXPORT_FORMATS)),
+        make_option('--output',
+            dest='output',
+            default=None,
+            help='Write the export to this file instead of stdout'),
+        )
+
+    def handle(self, *args, **options):
+        if not options['format'] in EXPORT_FORMATS:
+            raise CommandError('Unsupported format: %s' % options['format'])
+        if args:
+            queryset = FileNode.objects.filter(pk__in=args)
+            if queryset.count() != len(set(args)):
+                raise CommandError('Not all nodes could be found.')
+        else:
+            queryset = FileNode.objects.filter(level=0)
+
+        if options['output']:
+            out = open(options['output'], 'wb')
+        else:
+            out = sys.stdout
+        try:
+            for line in export_metadata(queryset, options['format']):
+                out.write(line)
+        finally:
+            if options['output']:
+                out.close()
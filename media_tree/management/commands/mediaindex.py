@@ -0,0 +1,27 @@
+from media_tree.utils.search import clear_index, index_nodes, \
+    get_search_engine
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+class Command(BaseCommand):
+
+    help = 'Builds the media_tree search index for all existing nodes.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--clear',
+            action='store_true',
+            dest='clear',
+            default=False,
+            help='Clear the search index before rebuilding it'),
+        )
+
+    def handle(self, *args, **options):
+        engine = get_search_engine()
+        self.stdout.write("Using %s\n" % engine.__name__)
+        if options['clear']:
+            clear_index()
+            self.stdout.write("Cleared search index\n")
+        count = 0
+        for count in index_nodes():
+            self.stdout.write("Indexed %i nodes\n" % count)
+        self.stdout.write("Done, %i nodes in search index\n" % count)
@@ -0,0 +1,11 @@
+from media_tree.utils.maintenance_jobs import run_pending_jobs
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+
+    help = 'Runs all pending media_tree maintenance jobs, such as finding ' \
+        + 'or deleting orphaned files.'
+
+    def handle(self, *args, **options):
+        count = run_pending_jobs()
+        self.stdout.write("Ran %i jobs\n" % count)
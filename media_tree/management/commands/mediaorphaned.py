@@ -1,4 +1,4 @@
-from media_tree.utils.maintenance import get_orphaned_files
+from media_tree.utils.maintenance import reconcile_media, get_nodes
 from media_tree.utils import get_media_storage
 from django.core.management.base import BaseCommand, CommandError
 from optparse import make_option
@@ -14,14 +14,30 @@ class Command(BaseCommand):
             dest='delete',
             default=False,
             help='Delete all orphaned files from storage'),
+        make_option('--broken',
+            action='store_true',
+            dest='broken',
+            default=False,
+            help='Also list nodes whose file does not exist in storage'),
+        make_option('--rescan',
+            action='store_true',
+            dest='rescan',
+            default=False,
+            help='List the upload folder even if MEDIA_TREE_STORAGE_MANIFEST '
+                'indicates that it did not change'),
         )
 
     def handle(self, *args, **options):
-        orphaned_files = get_orphaned_files()
         storage = get_media_storage()
+        broken_pks, orphaned_files = reconcile_media(storage,
+            rescan=options['rescan'])
         for path in orphaned_files:
             if options['delete']:
                 storage.delete(path)
                 self.stdout.write("Deleted %s\n" % storage.path(path))
             else:
                 self.stdout.write("%s\n" % storage.path(path))
+        if options['broken']:
+            for node in get_nodes(broken_pks):
+                self.stderr.write("Broken node %i: %s\n" % (node.pk,
+                                                            node.file.name))
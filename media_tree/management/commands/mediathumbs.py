@@ -0,0 +1,108 @@
+from media_tree.media_backends import close_worker_pool
+from media_tree.models import FileNode
+from media_tree.utils.warmup import get_thumbnail_sizes, get_image_nodes, \
+    warm_thumbnails, BATCH_SIZE
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from optparse import make_option
+import json
+import multiprocessing
+import os
+
+class Command(BaseCommand):
+
+    args = '[node_id node_id ...]'
+    help = 'Generates the configured thumbnail sizes for all images among ' \
+        + 'the given nodes and their descendants. If no nodes are given, ' \
+        + 'thumbnails are generated for the entire media tree.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--size',
+            action='append',
+            dest='sizes',
+            default=[],
+            help='Only generate thumbnails of this size (a key of '
+                'MEDIA_TREE_THUMBNAIL_SIZES). Can be given several times.'),
+        make_option('--workers',
+            dest='workers',
+            type='int',
+            default=None,
+            help='Number of worker processes (default: number of CPUs)'),
+        make_option('--batch-size',
+            dest='batch_size',
+            type='int',
+            default=BATCH_SIZE,
+            help='Number of images processed per batch'),
+        make_option('--checkpoint',
+            dest='checkpoint',
+            default=None,
+            help='Save progress to this file after each batch, and resume '
+                'from it if it exists'),
+        make_option('--restart',
+            action='store_true',
+            dest='restart',
+            default=False,
+            help='Ignore an existing checkpoint file'),
+        )
+
+    def read_checkpoint(self, path, state):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            checkpoint = json.load(f)
+        for key, value in state.items():
+            if checkpoint.get(key) != value:
+                raise CommandError('The checkpoint file %s was created with '
+                    'different arguments. Use --restart to ignore it.' % path)
+        return checkpoint['after']
+
+    def write_checkpoint(self, path, state, after):
+        state = dict(state, after=after)
+        temp_path = '%s.tmp' % path
+        with open(temp_path, 'wb') as f:
+            json.dump(state, f)
+        os.rename(temp_path, path)
+
+    def handle(self, *args, **options):
+        try:
+            sizes = get_thumbnail_sizes(options['sizes'])
+        except ValueError as e:
+            raise CommandError(e)
+        if args:
+            queryset = FileNode.objects.filter(pk__in=args)
+            if queryset.count() != len(set(args)):
+                raise CommandError('Not all nodes could be found.')
+            nodes = get_image_nodes(queryset)
+        else:
+            nodes = get_image_nodes()
+
+        checkpoint = options['checkpoint']
+        state = {'nodes': sorted(args), 'sizes': sizes.keys()}
+        after = None
+        if checkpoint and not options['restart']:
+            after = self.read_checkpoint(checkpoint, state)
+            if after is not None:
+                self.stdout.write("Resuming after node %i\n" % after)
+
+        self.stdout.write("Generating sizes: %s\n" % ', '.join(sizes.keys()))
+        stats = None
+        workers = options['workers'] or multiprocessing.cpu_count()
+        for after, stats in warm_thumbnails(nodes, sizes, after=after,
+                batch_size=options['batch_size'], workers=workers):
+            if checkpoint:
+                self.write_checkpoint(checkpoint, state, after)
+            self.stdout.write("Processed %i images: %i generated, %i up to "
+                "date, %i failed, %s written, %.1f thumbnails/s\n" % (
+                stats.nodes, stats.generated, stats.skipped, stats.failed,
+                filesizeformat(stats.bytes), stats.throughput))
+        close_worker_pool()
+
+        if stats:
+            for pk, name, size_name in stats.failures:
+                self.stderr.write("Failed: %s (node %i, size %s)\n" % (
+                    name, pk, size_name))
+            self.stdout.write("Done in %.1f s\n" % stats.elapsed)
+        else:
+            self.stdout.write("Done, no images to process\n")
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
@@ -0,0 +1,37 @@
+from media_tree.utils.tree_integrity import check_trees, repair_trees
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+class Command(BaseCommand):
+
+    help = 'Checks the consistency of the media_tree node tree, and ' \
+        + 'optionally repairs the inconsistent parts of it.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--repair',
+            action='store_true',
+            dest='repair',
+            default=False,
+            help='Repair all inconsistent trees'),
+        )
+
+    def handle(self, *args, **options):
+        check = check_trees()
+        self.stdout.write("Checked %i nodes in %i trees: %i inconsistent "
+            "trees, %i surplus root nodes\n" % (check.nodes, check.trees,
+            len(check.invalid_trees), len(check.extra_roots)))
+        if check.is_valid:
+            return
+        if not options['repair']:
+            for tree_id in sorted(check.invalid_trees):
+                self.stdout.write("Inconsistent tree %i\n" % tree_id)
+            for pk in check.extra_roots:
+                self.stdout.write("Surplus root node %i\n" % pk)
+            raise CommandError('The node tree is inconsistent. Use --repair '
+                               'to repair it.')
+
+        total = len(check.invalid_trees) + len(check.extra_roots)
+        for index, (tree_id, nodes, updated) in enumerate(
+                repair_trees(check)):
+            self.stdout.write("Repaired tree %i (%i of %i): %i nodes, %i "
+                "updated\n" % (tree_id, index + 1, total, nodes, updated))
@@ -0,0 +1,47 @@
+from media_tree.models import FileNode
+from media_tree.utils.analytics import get_usage, get_tables, GROUPING_NAMES
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from optparse import make_option
+
+class Command(BaseCommand):
+
+    args = '[folder_id]'
+    help = 'Reports the storage usage of all media_tree files, or of the ' \
+        + 'files in the given folder, by folder, media type, extension, ' \
+        + 'user and month of upload.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--refresh',
+            action='store_true',
+            dest='refresh',
+            default=False,
+            help='Compute the report again instead of updating the cached '
+                'report'),
+        make_option('--limit',
+            dest='limit',
+            type='int',
+            default=20,
+            help='Maximum number of rows per table (default: 20)'),
+        )
+
+    def handle(self, *args, **options):
+        folder = None
+        if args:
+            try:
+                folder = FileNode.folders.get(pk=args[0])
+            except (FileNode.DoesNotExist, ValueError):
+                raise CommandError('There is no folder with id %s.' % args[0])
+
+        report = get_usage(folder, refresh=options['refresh'])
+        self.stdout.write("%i files, %s (computed %s)\n" % (report['count'],
+            filesizeformat(report['size']), report['computed']))
+        for name, rows in get_tables(report, options['limit']).items():
+            self.stdout.write(u"\nBy %s:\n" % GROUPING_NAMES[name])
+            for row in rows:
+                line = "  %-40s %8i files %12s %5.1f%%" % (
+                    unicode(row[0])[:40], row[1], filesizeformat(row[2]),
+                    row[3])
+                if name == 'month':
+                    line += "  total %s" % filesizeformat(row[4])
+                self.stdout.write(line + "\n")
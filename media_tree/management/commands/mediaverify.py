@@ -0,0 +1,65 @@
+from media_tree.media_backends import close_worker_pool
+from media_tree.models import FileNode
+from media_tree.utils.bulk import get_ranges_q
+from media_tree.utils.filenode import get_selection_ranges
+from media_tree.utils.verify import verify_checksums, BATCH_SIZE
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from optparse import make_option
+
+class Command(BaseCommand):
+
+    args = '[node_id node_id ...]'
+    help = 'Verifies the stored files of the given nodes and their ' \
+        + 'descendants against their checksums, and records the checksums ' \
+        + 'of files that have none. If no nodes are given, all files are ' \
+        + 'verified.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--all',
+            action='store_true',
+            dest='full',
+            default=False,
+            help='Also verify files that have not changed since they were '
+                'last verified'),
+        make_option('--workers',
+            dest='workers',
+            type='int',
+            default=None,
+            help='Number of worker processes (default: number of CPUs)'),
+        make_option('--batch-size',
+            dest='batch_size',
+            type='int',
+            default=BATCH_SIZE,
+            help='Number of files processed per batch'),
+        )
+
+    def handle(self, *args, **options):
+        nodes = FileNode.objects.all()
+        if args:
+            queryset = FileNode.objects.filter(pk__in=args)
+            if queryset.count() != len(set(args)):
+                raise CommandError('Not all nodes could be found.')
+            nodes = nodes.filter(get_ranges_q(get_selection_ranges(queryset)))
+
+        stats = None
+        for after, stats in verify_checksums(nodes, full=options['full'],
+                batch_size=options['batch_size'], workers=options['workers']):
+            self.stdout.write("Processed %i files: %i verified, %i recorded, "
+                "%i unchanged, %i mismatched, %i missing, %s read, %.1f MB/s\n"
+                % (stats.nodes, stats.verified, stats.recorded, stats.skipped,
+                len(stats.mismatched), len(stats.missing),
+                filesizeformat(stats.bytes), stats.throughput))
+        close_worker_pool()
+
+        if not stats:
+            self.stdout.write("Done, no files to verify\n")
+            return
+        for pk, name in stats.mismatched:
+            self.stderr.write("Checksum mismatch: %s (node %i)\n" % (name, pk))
+        for pk, name in stats.missing:
+            self.stderr.write("Missing: %s (node %i)\n" % (name, pk))
+        self.stdout.write("Done in %.1f s\n" % stats.elapsed)
+        if stats.mismatched or stats.missing:
+            raise CommandError('%i files are corrupted or missing.' % (
+                len(stats.mismatched) + len(stats.missing)))
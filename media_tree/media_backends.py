@@ -1,46 +1,393 @@
 import os
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from threading import current_thread
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.db import models
+from django.db import connection, connections, models
+from django.db.models.fields.files import FieldFile
+from django.utils.datastructures import SortedDict
+from media_tree import media_types as media_type_constants
 from media_tree import settings as app_settings
 from media_tree.models import FileNode
-from media_tree.utils import get_module_attr
+from media_tree.utils import get_media_storage, get_module_attr
+from media_tree.utils import thumbnail_cache
+from media_tree.utils.lazy_thumbnails import get_thumbnail_url
+from media_tree.utils.instrumentation import incr, timed
+from media_tree.utils.thumbnail_failures import get_circuit_breaker, \
+    record_failures
+from PIL import Image
 
 
 class ThumbnailError(Exception):
     pass
 
 
+class ThumbnailInfo(object):
+    """ A lightweight reference to an existing thumbnail, providing the
+        attributes that templates need without accessing storage.
+
+        Like the thumbnail files returned by media backends, it also
+        provides the ``path``, ``size``, ``file`` and ``image`` of the
+        thumbnail, as well as methods for reading it, all of which access
+        ``storage`` (see :func:`MediaBackend.get_thumbnail_storage`) when
+        used. These are not
+        available for thumbnails that have not been generated yet, whose
+        ``name`` is ``None`` (see :func:`MediaBackend.get_lazy_thumbnails`). """
+
+    def __init__(self, name, url, width, height, storage=None):
+        self.name = name
+        self.url = url
+        self.width = width
+        self.height = height
+        self._storage = storage
+        self._file = None
+        self._image = None
+
+    @classmethod
+    def from_file(cls, thumbnail):
+        return cls(thumbnail.name, thumbnail.url, thumbnail.width,
+                   thumbnail.height, getattr(thumbnail, 'storage', None))
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            self._storage = get_media_storage()
+        return self._storage
+
+    @property
+    def path(self):
+        return self.storage.path(self.name)
+
+    @property
+    def size(self):
+        return self.storage.size(self.name)
+
+    @property
+    def file(self):
+        if self._file is None:
+            self._file = self.storage.open(self.name, 'rb')
+        return self._file
+
+    @property
+    def image(self):
+        """ The thumbnail as a PIL image """
+        if self._image is None:
+            self.file.seek(0)
+            self._image = Image.open(self.file)
+        return self._image
+
+    def open(self, mode='rb'):
+        self.close()
+        self._file = self.storage.open(self.name, mode)
+        return self
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def chunks(self, chunk_size=None):
+        return self.file.chunks(chunk_size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._image = None
+
+    def __unicode__(self):
+        return self.url
+
+
+class MediaBackendRegistry(object):
+    """ Resolves the configured media backends once, and remembers the
+        backend found for each combination of media types and file
+        extensions, so that looking it up again only costs a dictionary
+        access.
+
+        Backends are taken from ``MEDIA_TREE_MEDIA_BACKENDS`` in the order in
+        which they are listed, and the first one whose
+        ``handles_media_types()`` and ``handles_file_extensions()`` accept
+        the requested types is used. Media types or file extensions can be
+        routed to a particular backend using
+        ``MEDIA_TREE_MEDIA_BACKEND_ROUTES``, which applies to the files of
+        nodes with that media type or extension (see :func:`get_for_file`).
+        Call
+        :func:`reload_media_backends` after changing either setting, for
+        instance in tests. """
+
+    def __init__(self, paths=None, routes=None):
+        self.reload(paths, routes)
+
+    def reload(self, paths=None, routes=None):
+        if paths is None:
+            paths = app_settings.MEDIA_TREE_MEDIA_BACKENDS
+        if routes is None:
+            routes = app_settings.MEDIA_TREE_MEDIA_BACKEND_ROUTES
+        self.backends = [get_module_attr(path) for path in paths]
+        self.routes = dict([(normalize_route_key(key), get_module_attr(path))
+                            for key, path in routes.items()])
+        self.lookups = {}
+
+    def get(self, handles_media_types=None, handles_file_extensions=None):
+        """ Returns the backend handling all of the given media types and
+            file extensions, or ``None``. """
+        key = (tuple(handles_media_types or ()),
+               tuple([normalize_route_key(extension) for extension
+                      in handles_file_extensions or ()]))
+        try:
+            return self.lookups[key]
+        except KeyError:
+            backend = self.lookups[key] = self.find(*key)
+            return backend
+
+    def get_for_file(self, media_type, extension):
+        """ Returns the backend for a file with the given media type and
+            extension: the one routed to by its extension or else by its
+            media type, or the first backend handling its media type, or
+            the backend handling images if there is none. """
+        key = ('file', media_type, normalize_route_key(extension))
+        try:
+            return self.lookups[key]
+        except KeyError:
+            backend = self.routes.get(key[2]) or self.routes.get(media_type)
+            if not backend and media_type is not None:
+                backend = self.find((media_type,), ())
+            if not backend:
+                backend = self.get((media_type_constants.SUPPORTED_IMAGE,))
+            self.lookups[key] = backend
+            return backend
+
+    def get_all(self):
+        """ Returns all configured backends, including those that types are
+            routed to. """
+        backends = list(self.backends)
+        for backend in self.routes.values():
+            if not backend in backends:
+                backends.append(backend)
+        return backends
+
+    def find(self, media_types, file_extensions):
+        routed = set([self.routes[key] for key
+                      in list(media_types) + list(file_extensions)
+                      if key in self.routes])
+        if len(routed) == 1:
+            return routed.pop()
+        # Traverse backends until there is one supporting what's requested:
+        for backend in self.backends:
+            hmt = (not media_types
+                   or backend.handles_media_types(media_types))
+            hfe = (not file_extensions
+                   or backend.handles_file_extensions(file_extensions))
+            if hmt and hfe:
+                return backend
+
+
+def normalize_route_key(key):
+    """ Returns file extensions in lowercase and without a leading dot. """
+    if isinstance(key, basestring):
+        return key.lstrip('.').lower()
+    return key
+
+
+_registry = None
+
+
+def get_backend_registry():
+    """ Returns the :class:`MediaBackendRegistry`, which is created on first
+        use. """
+    global _registry
+    if _registry is None:
+        _registry = MediaBackendRegistry()
+    return _registry
+
+
+def reload_media_backends():
+    """ Resolves the configured media backends again, including the one used
+        by the thumbnail template tags. """
+    from media_tree.templatetags import media_tree_thumbnail
+    get_backend_registry().reload()
+    media_tree_thumbnail.load_media_backend()
+
+
 def get_media_backend(fail_silently=True, handles_media_types=None, 
     handles_file_extensions=None):
         """
         Returns the MediaBackend subclass that is configured for use with 
         media_tree.
         """
-        backends = app_settings.MEDIA_TREE_MEDIA_BACKENDS
-        if not len(backends):
+        registry = get_backend_registry()
+        if not registry.backends and not registry.routes:
             if not fail_silently:
                 raise ImproperlyConfigured(
                     'There is no media backend configured. Please define '
                     'MEDIA_TREE_MEDIA_BACKENDS in your settings.')
             else:
                 return False
-        
-        # Traverse backends until there is one supporting what's requested:
-        for path in backends:    
-            backend = get_module_attr(path)
-            hmt = (not handles_media_types
-                   or backend.handles_media_types(handles_media_types))
-            hfe = (not handles_file_extensions
-                   or backend.handles_file_extensions(handles_file_extensions))
-            if hmt and hfe:
-                return backend
-    
+
+        backend = registry.get(handles_media_types, handles_file_extensions)
+        if backend:
+            return backend
+
         if not fail_silently:
             raise ImproperlyConfigured('There is no media backend configured '
                                        'to handle the specified file types.')
         return False
-    
+
+
+def get_source_backend(source, fail_silently=True):
+    """ Returns the MediaBackend subclass for creating thumbnails of
+        ``source``, taking the media type and extension of its node into
+        account (see :func:`MediaBackendRegistry.get_for_file`). Sources
+        that are not the ``file`` of a node, such as preview files, are
+        treated as images. """
+    registry = get_backend_registry()
+    instance = getattr(source, 'instance', None)
+    field = getattr(source, 'field', None)
+    media_type = media_type_constants.SUPPORTED_IMAGE
+    if isinstance(instance, FileNode) and getattr(field, 'name', None) \
+            == 'file' and instance.media_type is not None:
+        media_type = instance.media_type
+    name = getattr(source, 'name', None) or ''
+    backend = registry.get_for_file(media_type, os.path.splitext(name)[1])
+    if backend:
+        return backend
+    if not fail_silently:
+        raise ImproperlyConfigured('There is no media backend configured '
+                                   'to handle the specified file types.')
+    return False
+
+
+def get_source_thumbnails(sources, options, lazy=False):
+    """ Returns a list containing a thumbnail for each item in ``sources``,
+        like :func:`MediaBackend.get_thumbnails`, or
+        :func:`MediaBackend.get_lazy_thumbnails` if ``lazy`` is ``True``.
+        Sources are passed to their backends (see
+        :func:`get_source_backend`) in one call per backend, and ``None`` is
+        returned for sources that no backend handles. """
+    sources = list(sources)
+    groups = SortedDict()
+    for index, source in enumerate(sources):
+        groups.setdefault(get_source_backend(source), []).append(index)
+    thumbnails = [None] * len(sources)
+    for backend, indexes in groups.items():
+        if not backend:
+            continue
+        get_thumbnails = backend.get_lazy_thumbnails if lazy \
+            else backend.get_thumbnails
+        for index, thumbnail in zip(indexes, get_thumbnails(
+                [sources[index] for index in indexes], options)):
+            thumbnails[index] = thumbnail
+    return thumbnails
+
+
+def get_scaled_size(source_size, size, crop=False, upscale=False):
+    """ Returns a tuple containing the size that an image of ``source_size``
+        needs to be scaled to, and its final size after cropping. """
+    source_width, source_height = source_size
+    width, height = [int(value or 0) for value in size]
+    scales = []
+    if width:
+        scales.append(float(width) / source_width)
+    if height:
+        scales.append(float(height) / source_height)
+    if not scales:
+        return source_size, source_size
+    scale = max(scales) if crop else min(scales)
+    if not upscale:
+        scale = min(scale, 1.0)
+    scaled = (max(int(round(source_width * scale)), 1),
+              max(int(round(source_height * scale)), 1))
+    if not crop:
+        return scaled, scaled
+    return scaled, (min(scaled[0], width or scaled[0]),
+                    min(scaled[1], height or scaled[1]))
+
+
+_worker_pool = None
+_worker_pool_size = None
+
+
+def get_source_reference(source):
+    """ Returns a ``(field_name, file_name)`` tuple identifying a file of a
+        ``FileNode``, which can be passed to another process, or ``None`` if
+        ``source`` is not such a file. """
+    field = getattr(source, 'field', None)
+    if isinstance(source, FieldFile) and source.name \
+        and getattr(field, 'model', None) is FileNode:
+        return (field.name, source.name)
+
+
+def get_focal_point(source):
+    """ Returns the focal point of the node that ``source`` belongs to (see
+        the ``focal_point`` extension) as an ``(x, y)`` tuple of fractions
+        of the image size, or ``None`` if the node has no focal point. """
+    instance = getattr(source, 'instance', None)
+    x = getattr(instance, 'focal_x', None)
+    y = getattr(instance, 'focal_y', None)
+    if x is None and y is None:
+        return None
+    return (float(x) if x is not None else .5,
+            float(y) if y is not None else .5)
+
+
+def resolve_source_reference(reference):
+    field_name, name = reference
+    field = FileNode._meta.get_field(field_name)
+    return field.attr_class(None, field, name)
+
+
+def is_memory_database(conn):
+    return conn.vendor == 'sqlite' \
+        and conn.settings_dict['NAME'] in ('', ':memory:')
+
+
+def _init_worker():
+    # Worker processes are forked from the current process, and must not
+    # use its database connections.
+    for conn in connections.all():
+        if not is_memory_database(conn):
+            conn.connection = None
+
+
+def _generate_source_thumbnails(args):
+    backend_path, reference, options_list = args
+    backend = get_module_attr(backend_path)
+    try:
+        thumbnails = backend.generate_source_thumbnails(
+            resolve_source_reference(reference), options_list)
+    finally:
+        connection.close()
+    return [thumbnail and (thumbnail.name, thumbnail.url, thumbnail.width,
+                           thumbnail.height) for thumbnail in thumbnails]
+
+
+def get_worker_pool(processes=None):
+    """ Returns the process pool used for generating thumbnails and other
+        parallel tasks, with ``processes`` workers (by default,
+        ``MEDIA_TREE_THUMBNAIL_WORKERS``). The pool is reused by later calls
+        requesting the same number of processes, so that workers are not
+        forked again for each batch, and replaced when a different number
+        is requested. """
+    global _worker_pool, _worker_pool_size
+    processes = processes or app_settings.MEDIA_TREE_THUMBNAIL_WORKERS
+    if _worker_pool is not None and _worker_pool_size != processes:
+        close_worker_pool()
+    if _worker_pool is None:
+        _worker_pool = Pool(processes, initializer=_init_worker,
+                            maxtasksperchild=100)
+        _worker_pool_size = processes
+    return _worker_pool
+
+
+def close_worker_pool():
+    """ Shuts down the process pool, waiting for its workers to exit. """
+    global _worker_pool, _worker_pool_size
+    if _worker_pool is not None:
+        _worker_pool.close()
+        _worker_pool.join()
+        _worker_pool = None
+        _worker_pool_size = None
+
     
 class MediaBackend(object):
     
@@ -54,19 +401,299 @@ class MediaBackend(object):
 
     @classmethod
     def handles_file_extensions(cls, file_extensions):
-        unsupported = set(file_extensions) - set(cls.SUPPORTED_FILE_EXTENSIONS)
-        return cls.SUPPORTED_FILE_EXTENSIONS and len(unsupported) == 0 
+        if not cls.SUPPORTED_FILE_EXTENSIONS:
+            return False
+        supported = set([normalize_route_key(extension) for extension
+                         in cls.SUPPORTED_FILE_EXTENSIONS])
+        unsupported = set([normalize_route_key(extension) for extension
+                           in file_extensions]) - supported
+        return len(unsupported) == 0
     
     @staticmethod
     def get_thumbnail(source, options):
         raise NotImplementedError('Media backends need to implement the '
                                   '`get_thumbnail()` method.')
 
+    @classmethod
+    def thumbnail_exists(cls, source, options):
+        """ Returns whether an up-to-date thumbnail of ``source`` already
+            exists for ``options``. Backends that cannot tell return
+            ``False``, in which case the thumbnail is always generated. """
+        return False
+
+    @staticmethod
+    def get_thumbnail_size(source, options):
+        """ Returns the dimensions of the thumbnail of ``source`` as computed
+            from the image dimensions stored in its node, or ``None`` if they
+            are not known. """
+        instance = getattr(source, 'instance', None)
+        width = getattr(instance, 'width', None)
+        height = getattr(instance, 'height', None)
+        if not width or not height or not options.get('size'):
+            return None
+        return get_scaled_size((width, height), options['size'],
+            crop=options.get('crop'), upscale=options.get('upscale'))[1]
+
+    @classmethod
+    def get_source_options(cls, source, options):
+        """ Returns the thumbnail options to be used for ``source``. If a
+            cropped thumbnail is requested and ``source`` belongs to a node
+            that has a focal point, it is added as the ``focal_point``
+            option, so that the crop can be centered on it. Backends that
+            support focal points in a different way should override this. """
+        if options.get('crop') == True and not 'focal_point' in options:
+            focal_point = get_focal_point(source)
+            if focal_point:
+                options = dict(options, focal_point=focal_point)
+        return options
+
+    @classmethod
+    def get_thumbnails(cls, sources, options):
+        """ Returns a list containing a thumbnail for each item in
+            ``sources``, in the same order, or ``None`` for each source whose
+            thumbnail could not be created. All sources are looked up in the
+            thumbnail cache with a single request, and only the remaining
+            ones are passed to :func:`resolve_thumbnails`, grouped by the
+            options returned by :func:`get_source_options`. """
+        sources = list(sources)
+        source_options = [cls.get_source_options(source, options)
+                          for source in sources]
+        storage = cls.get_thumbnail_storage()
+        thumbnails = [cached and ThumbnailInfo(*cached, storage=storage)
+                      for cached in thumbnail_cache.get_many(cls, sources,
+                                                             source_options)]
+        missing = [index for index, thumbnail in enumerate(thumbnails)
+                   if not thumbnail]
+        incr('thumbnail_cache_hits', len(sources) - len(missing))
+        incr('thumbnail_cache_misses', len(missing))
+        missing = cls.exclude_failures(sources, source_options, missing)
+        breaker = get_circuit_breaker(cls)
+        if missing and breaker and not breaker.allow():
+            incr('thumbnail_circuit_open', len(missing))
+            return thumbnails
+        if missing:
+            groups = SortedDict()
+            for index in missing:
+                key = thumbnail_cache.normalize_options(source_options[index])
+                groups.setdefault(key, []).append(index)
+            new_thumbnails = []
+            failures = []
+            for indexes in groups.values():
+                try:
+                    resolved = cls.resolve_thumbnails(
+                        [sources[index] for index in indexes],
+                        source_options[indexes[0]])
+                except Exception as inst:
+                    record_failures(cls, [(sources[index],
+                        source_options[index]) for index in indexes], inst)
+                    if breaker:
+                        breaker.record(len(indexes), len(indexes))
+                    raise
+                for index, thumbnail in zip(indexes, resolved):
+                    if thumbnail:
+                        thumbnail = ThumbnailInfo.from_file(thumbnail)
+                        thumbnails[index] = thumbnail
+                        new_thumbnails.append((sources[index],
+                            source_options[index], thumbnail))
+                    else:
+                        failures.append((sources[index],
+                                         source_options[index]))
+            thumbnail_cache.set_many(cls, new_thumbnails)
+            record_failures(cls, failures)
+            if breaker:
+                breaker.record(len(missing), len(failures))
+        return thumbnails
+
+    @classmethod
+    def exclude_failures(cls, sources, source_options, indexes):
+        """ Returns the items of ``indexes`` for which no failure is stored
+            in the negative thumbnail cache. """
+        if not indexes:
+            return indexes
+        failed = thumbnail_cache.get_failures(cls,
+            [sources[index] for index in indexes],
+            [source_options[index] for index in indexes])
+        incr('thumbnail_failure_cache_hits', len(filter(None, failed)))
+        return [index for index, known in zip(indexes, failed) if not known]
+
+    @classmethod
+    def get_lazy_thumbnails(cls, sources, options):
+        """ Returns a list containing a thumbnail for each item in
+            ``sources``, like :func:`get_thumbnails`, but without generating
+            thumbnails that are not in the thumbnail cache yet. Instead,
+            their URL points to a view that generates them on first request
+            (see :mod:`media_tree.utils.lazy_thumbnails`), and their
+            dimensions are computed from those of the node, if known.
+            Thumbnails of sources that do not belong to a node are
+            generated immediately. """
+        sources = list(sources)
+        source_options = [cls.get_source_options(source, options)
+                          for source in sources]
+        storage = cls.get_thumbnail_storage()
+        thumbnails = [cached and ThumbnailInfo(*cached, storage=storage)
+                      for cached in thumbnail_cache.get_many(cls, sources,
+                                                             source_options)]
+        pending = []
+        missing = cls.exclude_failures(sources, source_options,
+            [index for index, thumbnail in enumerate(thumbnails)
+             if not thumbnail])
+        for index in missing:
+            source = sources[index]
+            url = get_thumbnail_url(source, options)
+            if not url:
+                pending.append(index)
+                continue
+            width, height = cls.get_thumbnail_size(source,
+                source_options[index]) or (None, None)
+            thumbnails[index] = ThumbnailInfo(None, url, width, height)
+        if pending:
+            resolved = cls.get_thumbnails(
+                [sources[index] for index in pending], options)
+            for index, thumbnail in zip(pending, resolved):
+                thumbnails[index] = thumbnail
+        return thumbnails
+
+    @classmethod
+    def get_srcset(cls, source, options, widths=None):
+        """ Returns a list containing a thumbnail of ``source`` scaled to
+            each of ``widths`` (``MEDIA_TREE_SRCSET_WIDTHS`` by default), or
+            ``None`` for each width that could not be created. All
+            thumbnails are generated from a single decoded source image by
+            :func:`generate_source_thumbnails`, and cached as one entry. """
+        widths = tuple(widths or app_settings.MEDIA_TREE_SRCSET_WIDTHS)
+        options = cls.get_source_options(source, options)
+        cache_options = dict(options, srcset=widths)
+        cached = thumbnail_cache.get_value(cls, source, cache_options)
+        incr('thumbnail_cache_hits' if cached else 'thumbnail_cache_misses')
+        if cached:
+            storage = cls.get_thumbnail_storage()
+            return [item and ThumbnailInfo(*item, storage=storage)
+                    for item in cached]
+
+        thumbnails = [thumbnail and ThumbnailInfo.from_file(thumbnail)
+            for thumbnail in cls.generate_source_thumbnails(source,
+                [dict(options, size=(width, 0)) for width in widths])]
+        if all(thumbnails):
+            thumbnail_cache.set_value(cls, source, cache_options, [
+                (thumbnail.name, thumbnail.url, thumbnail.width,
+                 thumbnail.height) for thumbnail in thumbnails])
+        return thumbnails
+
+    @classmethod
+    def resolve_thumbnails(cls, sources, options):
+        """ Returns a list of thumbnails for ``sources`` that were not found
+            in the thumbnail cache. Backends that can look up existing
+            thumbnails more efficiently than by calling
+            :func:`get_thumbnail` for each source should override this. """
+        return cls.generate_thumbnails(sources, options)
+
+    @classmethod
+    def generate_thumbnails(cls, sources, options):
+        """ Generates a thumbnail for each item in ``sources`` using the same
+            ``options``, and returns them in the same order. This is used
+            while rendering templates, where several sources are processed
+            in parallel by up to ``MEDIA_TREE_THUMBNAIL_THREADS`` threads. """
+        return cls.run_thumbnail_jobs(
+            [(source, options) for source in sources],
+            threads=app_settings.MEDIA_TREE_THUMBNAIL_THREADS)
+
+    @classmethod
+    def run_thumbnail_jobs(cls, jobs, workers=None, threads=None):
+        """ Generates thumbnails for a list of ``(source, options)`` tuples
+            and returns them in the same order, or ``None`` for each job that
+            failed.
+
+            Jobs are grouped by source, so that each source is only read
+            once for all thumbnails requested for it (see
+            :func:`generate_source_thumbnails`). If there are several
+            sources and ``workers`` (by default,
+            ``MEDIA_TREE_THUMBNAIL_WORKERS``) is greater than 1, they are
+            processed in parallel by the shared worker pool (see
+            :func:`get_worker_pool`), in which case thumbnails are returned
+            as :class:`ThumbnailInfo` objects. Otherwise, they are processed
+            by a pool of up to ``threads`` threads created for this call, or
+            one after another if ``threads`` is not greater than 1. """
+        groups = SortedDict()
+        for index, (source, options) in enumerate(jobs):
+            key = get_source_reference(source) or id(source)
+            if not key in groups:
+                groups[key] = (source, [], [])
+            groups[key][1].append(index)
+            groups[key][2].append(options)
+
+        workers = workers or app_settings.MEDIA_TREE_THUMBNAIL_WORKERS
+        results = [None] * len(jobs)
+        storage = cls.get_thumbnail_storage()
+        local_groups = groups.values()
+        if workers > 1 and len(groups) > 1:
+            remote_groups = [group for group in local_groups
+                             if get_source_reference(group[0])]
+            local_groups = [group for group in local_groups
+                            if not get_source_reference(group[0])]
+            backend_path = '%s.%s' % (cls.__module__, cls.__name__)
+            with timed('thumbnail_pool'):
+                generated = get_worker_pool(workers).map(
+                    _generate_source_thumbnails,
+                    [(backend_path, get_source_reference(source), options_list)
+                     for source, indexes, options_list in remote_groups])
+            for (source, indexes, options_list), thumbnails in zip(
+                    remote_groups, generated):
+                for index, thumbnail in zip(indexes, thumbnails):
+                    results[index] = thumbnail and ThumbnailInfo(*thumbnail,
+                        storage=storage)
+
+        main_thread = current_thread()
+        def generate(group):
+            try:
+                return cls.generate_source_thumbnails(group[0], group[2])
+            finally:
+                if current_thread() is not main_thread:
+                    connection.close()
+
+        threads = min(threads or 1, len(local_groups))
+        if threads > 1 and not is_memory_database(connection):
+            pool = ThreadPool(threads)
+            try:
+                generated = pool.map(generate, local_groups)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            generated = map(generate, local_groups)
+        for (source, indexes, options_list), thumbnails in zip(
+                local_groups, generated):
+            for index, thumbnail in zip(indexes, thumbnails):
+                results[index] = thumbnail
+        return results
+
+    @classmethod
+    def generate_source_thumbnails(cls, source, options_list):
+        """ Returns a thumbnail of ``source`` for each item in
+            ``options_list``. Backends that can decode a source image once
+            and create all of its thumbnails from it should override
+            this. """
+        return [cls.get_thumbnail(source, options.copy())
+                for options in options_list]
+
     @staticmethod
     def get_valid_thumbnail_options():
         raise NotImplementedError('Media backends need to implement the '
                                   '`get_valid_thumbnail_options()` method.')
 
+    @staticmethod
+    def get_thumbnail_storage():
+        """ Returns the storage that thumbnails are saved to. """
+        return get_media_storage()
+
+    @classmethod
+    def delete_thumbnail_records(cls, names):
+        """ Removes any records that the backend keeps of the thumbnail
+            files ``names``, which have been deleted from storage, and
+            returns the names of their source files. Backends that cannot
+            tell return ``None``, in which case all cached thumbnails are
+            invalidated. """
+        return None
+
     @staticmethod
     def get_cache_paths(subdirs=None):
         if not subdirs:
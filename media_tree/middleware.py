@@ -0,0 +1,74 @@
+from media_tree import settings as app_settings
+from media_tree.utils import instrumentation
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+import time
+
+
+class InstrumentationMiddleware(object):
+    """ Collects performance metrics for each request handled by a
+        ``media_tree`` view, i.e. the admin views of the ``FileNode`` model
+        and any view defined in a ``media_tree`` module.
+
+        Metrics include the number of SQL queries and the time spent on
+        them, template rendering, thumbnail generation and lookups, and
+        storage access. They are passed to all sinks configured using
+        ``MEDIA_TREE_METRICS_SINKS``, and added to the response in the
+        ``MEDIA_TREE_INSTRUMENTATION_HEADER`` header.
+
+        To enable it, set ``MEDIA_TREE_INSTRUMENTATION = True`` and add
+        ``media_tree.middleware.InstrumentationMiddleware`` to your
+        ``MIDDLEWARE_CLASSES``. """
+
+    def __init__(self):
+        if not app_settings.MEDIA_TREE_INSTRUMENTATION:
+            raise MiddlewareNotUsed()
+        self.sinks = instrumentation.get_metrics_sinks()
+
+    def is_media_tree_view(self, request, view_func):
+        match = getattr(request, 'resolver_match', None)
+        if match and (match.url_name or '').startswith('media_tree_'):
+            return True
+        return getattr(view_func, '__module__', '').startswith('media_tree.')
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.is_media_tree_view(request, view_func):
+            return
+        instrumentation.start()
+        request._media_tree_queries = {}
+        for connection in connections.all():
+            request._media_tree_queries[connection.alias] = (
+                connection.use_debug_cursor, len(connection.queries))
+            connection.use_debug_cursor = True
+
+    def process_template_response(self, request, response):
+        metrics = instrumentation.get_current_metrics()
+        if metrics:
+            started = time.time()
+            def render_finished(response):
+                metrics.add_time('template_render', time.time() - started)
+            response.add_post_render_callback(render_finished)
+        return response
+
+    def process_response(self, request, response):
+        queries = getattr(request, '_media_tree_queries', None)
+        if queries is None:
+            return response
+        del request._media_tree_queries
+        metrics = instrumentation.stop()
+
+        for connection in connections.all():
+            if not connection.alias in queries:
+                continue
+            use_debug_cursor, offset = queries[connection.alias]
+            connection.use_debug_cursor = use_debug_cursor
+            executed = connection.queries[offset:]
+            metrics.add_time('sql', sum([float(query['time'])
+                for query in executed]), len(executed))
+
+        header = app_settings.MEDIA_TREE_INSTRUMENTATION_HEADER
+        if header:
+            response[header] = metrics.format()
+        for sink in self.sinks:
+            sink(request, metrics)
+        return response
@@ -18,4 +18,13 @@ if app == 'media_tree':
     FileNode = getattr(module, model)
     
 else:
-    FileNode = get_model(app, model, only_installed=False)
\ No newline at end of file
+    FileNode = get_model(app, model, only_installed=False)
+
+
+from .search import SearchTerm, connect_search_index
+from .thumbnails import ThumbnailFailure
+from .jobs import MaintenanceJob, MaintenanceJobItem
+from ..settings import MEDIA_TREE_SEARCH_INDEX
+
+if MEDIA_TREE_SEARCH_INDEX:
+    connect_search_index(FileNode)
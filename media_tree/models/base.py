@@ -3,6 +3,7 @@
 from django.db import models
 from django.utils.translation import ugettext, ugettext_lazy as _
 from media_tree import settings as app_settings
+from media_tree.utils.instrumentation import timed
 from mptt.managers import TreeManager
 from .managers import FileNodeManager
 
@@ -33,5 +34,6 @@ class BaseNode(models.Model):
 
     def save(self, *args, **kwargs):
         self.check_save_prevented()
-        self.pre_save()
+        with timed('pre_save'):
+            self.pre_save()
         return super(BaseNode, self).save(*args, **kwargs)
\ No newline at end of file
@@ -50,6 +50,6 @@ class FancyFileNode(FolderMixin, MetadataMixin, FileInfoMixin, ImageMixin,
         app_label = 'media_tree'
 
     def __init__(self, *args, **kwargs):
-        super(FileNode, self).__init__(*args, **kwargs)
+        super(FancyFileNode, self).__init__(*args, **kwargs)
         
 mptt.register(FancyFileNode)
\ No newline at end of file
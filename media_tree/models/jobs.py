@@ -0,0 +1,137 @@
+#encoding=utf-8
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from datetime import timedelta
+
+from media_tree import settings as app_settings
+
+
+__all__ = ['MaintenanceJob', 'MaintenanceJobItem']
+
+
+class MaintenanceJob(models.Model):
+    """ A maintenance task that runs in the background, such as finding
+        orphaned files, whose progress and results are stored in the
+        database so that the admin can display them while it is running.
+
+        A job first finds files (the ``find`` phase), which are stored as
+        :class:`MaintenanceJobItem` objects. After the user has selected
+        some of them, the job is run again to delete the selected files (the
+        ``delete`` phase). """
+
+    ORPHANED_FILES = 'orphaned_files'
+    CACHE_FILES = 'cache_files'
+    KIND_CHOICES = (
+        (ORPHANED_FILES, _('orphaned files')),
+        (CACHE_FILES, _('cache files')),
+    )
+
+    FIND = 'find'
+    DELETE = 'delete'
+    PHASE_CHOICES = (
+        (FIND, _('finding files')),
+        (DELETE, _('deleting files')),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('pending')),
+        (RUNNING, _('running')),
+        (DONE, _('done')),
+        (FAILED, _('failed')),
+    )
+
+    class Meta:
+        app_label = 'media_tree'
+        verbose_name = _('maintenance job')
+        verbose_name_plural = _('maintenance jobs')
+        ordering = ('-created',)
+
+    kind = models.CharField(_('kind'), max_length=32, choices=KIND_CHOICES)
+
+    phase = models.CharField(_('phase'), max_length=16, choices=PHASE_CHOICES,
+                             default=FIND)
+
+    status = models.CharField(_('status'), max_length=16,
+                              choices=STATUS_CHOICES, default=PENDING)
+
+    processed = models.PositiveIntegerField(_('processed'), default=0)
+    """ Number of files processed in the current phase """
+
+    total = models.PositiveIntegerField(_('total'), null=True, blank=True)
+    """ Number of files to process in the current phase, if known """
+
+    user = models.ForeignKey(getattr(settings, 'AUTH_USER_MODEL', 'auth.User'),
+        null=True, blank=True, on_delete=models.SET_NULL, editable=False)
+
+    created = models.DateTimeField(_('created'), default=timezone.now)
+
+    started = models.DateTimeField(_('started'), null=True, blank=True)
+
+    finished = models.DateTimeField(_('finished'), null=True, blank=True)
+
+    heartbeat = models.DateTimeField(_('heartbeat'), null=True, blank=True)
+    """ The last time the process running the job reported that it is
+        alive """
+
+    error = models.TextField(_('error'), blank=True)
+    """ The traceback of the exception that made the job fail """
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.get_kind_display(),
+                             self.created.strftime('%Y-%m-%d %H:%M'))
+
+    @property
+    def is_active(self):
+        return self.status in (self.PENDING, self.RUNNING)
+
+    @property
+    def is_stale(self):
+        """ Whether the job is running, but has not sent a heartbeat for
+            ``MEDIA_TREE_MAINTENANCE_JOB_TIMEOUT`` seconds. """
+        return self.status == self.RUNNING and (self.heartbeat is None
+            or self.heartbeat < timezone.now() - timedelta(
+                seconds=app_settings.MEDIA_TREE_MAINTENANCE_JOB_TIMEOUT))
+
+    @property
+    def percent_done(self):
+        if self.total:
+            return min(100, int(100 * self.processed / self.total))
+        return 100 if self.status == self.DONE else 0
+
+
+class MaintenanceJobItem(models.Model):
+    """ A file found by a :class:`MaintenanceJob`. Items with a :attr:`node`
+        are nodes whose file is missing, which are only reported. """
+
+    class Meta:
+        app_label = 'media_tree'
+        verbose_name = _('maintenance job item')
+        verbose_name_plural = _('maintenance job items')
+        ordering = ('pk',)
+
+    job = models.ForeignKey(MaintenanceJob, related_name='items')
+
+    name = models.CharField(_('file'), max_length=255)
+    """ The storage name of the file """
+
+    node = models.ForeignKey(app_settings.MEDIA_TREE_MODEL, null=True,
+        blank=True, related_name='+')
+    """ The node whose file is missing, if any. The item is deleted along
+        with the node, so that the file is never offered for deletion. """
+
+    selected = models.BooleanField(_('selected'), default=False)
+    """ Whether the file is to be deleted """
+
+    deleted = models.BooleanField(_('deleted'), default=False)
+
+    error = models.CharField(_('error'), max_length=255, blank=True)
+
+    def __unicode__(self):
+        return self.name
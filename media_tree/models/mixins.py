@@ -20,6 +20,7 @@ from django.utils.translation import ugettext, ugettext_lazy as _
 
 from media_tree import settings as app_settings, media_types
 from media_tree.utils import get_media_storage, multi_splitext, join_formatted
+from media_tree.utils.checksums import get_checksum
 from media_tree.utils.filenode import get_file_link
 from media_tree.utils.staticfiles import get_icon_finders
 from mptt.managers import TreeManager
@@ -535,6 +536,14 @@ class FileInfoMixin(models.Model):
     size = models.IntegerField(_('size'), null=True, editable=False)
     """ File size in bytes """
 
+    checksum = models.CharField(
+        _('checksum'), max_length=64, null=True, editable=False)
+    """ SHA-256 checksum of the file as uploaded """
+
+    checksum_verified = models.DateTimeField(
+        _('checksum verified'), null=True, editable=False)
+    """ Date when the stored file was last found to match :attr:`checksum` """
+
     def __unicode__(self):
         return self.name
 
@@ -577,7 +586,7 @@ class FileInfoMixin(models.Model):
 
     @staticmethod
     def mimetype_to_media_type(filename):
-        mimetype = self.get_mimetype(filename)
+        mimetype = FileInfoMixin.get_mimetype(filename)
         if mimetype:
             if MIMETYPE_CONTENT_TYPE_MAP.has_key(mimetype):
                 return MIMETYPE_CONTENT_TYPE_MAP[mimetype]
@@ -598,6 +607,8 @@ class FileInfoMixin(models.Model):
 
             # Determine various file parameters
             self.size = self.file.size
+            self.checksum = get_checksum(self.file)
+            self.checksum_verified = None
             self.extension = split[2].lstrip('.').lower()
             
             self.file.name = self.name
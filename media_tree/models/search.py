@@ -0,0 +1,50 @@
+#encoding=utf-8
+
+from django.db import models
+from django.db.models import signals
+from django.utils.translation import ugettext_lazy as _
+
+from media_tree import settings as app_settings
+
+
+__all__ = ['SearchTerm']
+
+
+class SearchTerm(models.Model):
+    """ A single normalized term of the portable search index, which is used
+        if the database does not provide a native full-text search. Looking
+        up terms by prefix uses the index on :attr:`term`, avoiding
+        sequential scans over the ``FileNode`` table. """
+
+    class Meta:
+        app_label = 'media_tree'
+        verbose_name = _('search term')
+        verbose_name_plural = _('search terms')
+
+    node = models.ForeignKey(app_settings.MEDIA_TREE_MODEL,
+                             related_name='search_terms')
+    """ The node whose metadata contains the term """
+
+    term = models.CharField(_('term'), max_length=64, db_index=True)
+    """ Lowercase term without diacritics """
+
+    weight = models.PositiveSmallIntegerField(_('weight'), default=1)
+    """ Summed weights of all indexed fields containing the term """
+
+
+def update_search_index(sender, instance, **kwargs):
+    from media_tree.utils.search import index_node
+    if not kwargs.get('raw', False):
+        index_node(instance)
+
+
+def remove_from_search_index(sender, instance, **kwargs):
+    from media_tree.utils.search import unindex_node
+    unindex_node(instance.pk)
+
+
+def connect_search_index(model):
+    signals.post_save.connect(update_search_index, sender=model,
+                              dispatch_uid='media_tree_search_index_save')
+    signals.post_delete.connect(remove_from_search_index, sender=model,
+                                dispatch_uid='media_tree_search_index_delete')
@@ -0,0 +1,56 @@
+#encoding=utf-8
+
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from media_tree import settings as app_settings
+
+
+__all__ = ['ThumbnailFailure']
+
+
+class ThumbnailFailure(models.Model):
+    """ A source file for which a media backend failed to create a thumbnail
+        with particular options. Failures are recorded whenever they are not
+        in the negative thumbnail cache, so :attr:`count` reflects how
+        persistently a source is failing. """
+
+    class Meta:
+        app_label = 'media_tree'
+        verbose_name = _('thumbnail failure')
+        verbose_name_plural = _('thumbnail failures')
+        unique_together = ('backend', 'name', 'options_hash')
+        ordering = ('-last_failed',)
+
+    backend = models.CharField(_('media backend'), max_length=255)
+    """ The name of the media backend class """
+
+    name = models.CharField(_('source file'), max_length=255)
+    """ The storage name of the source file """
+
+    node = models.ForeignKey(app_settings.MEDIA_TREE_MODEL, null=True,
+        blank=True, on_delete=models.SET_NULL,
+        related_name='thumbnail_failures')
+    """ The node the source file belongs to, if any """
+
+    options = models.CharField(_('thumbnail options'), max_length=255)
+    """ The thumbnail options, as a readable string """
+
+    options_hash = models.CharField(max_length=32, editable=False)
+    """ A hash of the thumbnail options """
+
+    error = models.TextField(_('error'), blank=True)
+    """ The last error message, if the backend raised one """
+
+    count = models.PositiveIntegerField(_('count'), default=1)
+    """ Number of recorded failures """
+
+    first_failed = models.DateTimeField(_('first failure'),
+                                        default=timezone.now)
+
+    last_failed = models.DateTimeField(_('last failure'),
+                                       default=timezone.now)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.name, self.options)
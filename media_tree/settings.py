@@ -42,10 +42,20 @@ MEDIA_TREE_MEDIA_BACKENDS = getattr(settings, 'MEDIA_TREE_MEDIA_BACKENDS', ())
 """ A tuple of media backends for thumbnail generation and other media-related
     tasks.
 
-    Currently, the only supported backend is
+    Supported backends are
     ``media_tree.contrib.media_backends.easy_thumbnails.\EasyThumbnailsBackend``,
-    which depends on ``easy_thumbnails`` to be installed. Please refer to
-    :ref:`media-backends` for more information. """
+    which depends on ``easy_thumbnails`` to be installed, and
+    ``media_tree.contrib.media_backends.pillow.PillowBackend``, which only
+    depends on Pillow. Please refer to :ref:`media-backends` for more
+    information. """
+
+
+MEDIA_TREE_MEDIA_BACKEND_ROUTES = getattr(settings,
+    'MEDIA_TREE_MEDIA_BACKEND_ROUTES', {})
+""" A dictionary mapping media types (see ``media_tree.media_types``) or file
+    extensions to the media backend that should handle them, regardless of
+    the order of ``MEDIA_TREE_MEDIA_BACKENDS``. For instance, you can route
+    images and PDF documents to different backends. """
 
 
 MEDIA_TREE_MEDIA_BACKEND_DEBUG = getattr(settings,
@@ -54,6 +64,30 @@ MEDIA_TREE_MEDIA_BACKEND_DEBUG = getattr(settings,
     ``ThumbnailError``, should be raised or silently ignored. """
 
 
+MEDIA_TREE_INSTRUMENTATION = getattr(settings,
+    'MEDIA_TREE_INSTRUMENTATION', False)
+""" Toggles the collection of performance metrics for ``media_tree`` views,
+    such as SQL queries, template rendering, thumbnail generation and
+    storage access. Requires
+    ``media_tree.middleware.InstrumentationMiddleware`` to be installed. """
+
+
+MEDIA_TREE_INSTRUMENTATION_HEADER = getattr(settings,
+    'MEDIA_TREE_INSTRUMENTATION_HEADER', 'X-Media-Tree-Metrics')
+""" Name of the response header the collected metrics are added to when
+    instrumentation is enabled, or ``None`` to not add them to the
+    response. """
+
+
+MEDIA_TREE_METRICS_SINKS = getattr(settings, 'MEDIA_TREE_METRICS_SINKS', (
+    'media_tree.utils.instrumentation.log_sink',
+))
+""" A tuple of callables that the collected metrics are passed to after each
+    instrumented request. Each is called with the ``request`` and a
+    :class:`media_tree.utils.instrumentation.Metrics` instance. The default
+    sink logs them to the ``media_tree.instrumentation`` logger. """
+
+
 _DEFAULT_LIST_DISPLAY = {
     'media_tree.FileNode': (
         'browse_controls', 'size_formatted', 'extension',
@@ -93,6 +127,31 @@ MEDIA_TREE_SEARCH_FIELDS = getattr(settings, 'MEDIA_TREE_SEARCH_FIELDS',
     the ``FileNodeAdmin``. """
 
 
+MEDIA_TREE_SEARCH_INDEX = getattr(settings, 'MEDIA_TREE_SEARCH_INDEX', False)
+""" Toggles the full-text search index on or off. If enabled, the index is
+    kept up to date whenever a node is saved or deleted, and admin searches
+    are answered from the index (ranked by relevance) instead of scanning
+    the ``MEDIA_TREE_SEARCH_FIELDS`` with ``icontains``.
+
+    The index uses SQLite FTS5 or PostgreSQL full-text search if available,
+    and a portable term table otherwise. Run ``manage.py mediaindex`` to
+    build the index for existing nodes. """
+
+
+MEDIA_TREE_SEARCH_INDEX_FIELDS = getattr(settings,
+    'MEDIA_TREE_SEARCH_INDEX_FIELDS', SortedDict((
+        ('name', 4),
+        ('title', 4),
+        ('keywords', 3),
+        ('author', 2),
+        ('copyright', 2),
+        ('description', 1),
+    )))
+""" The fields that are stored in the search index, mapped to their relative
+    weight when ranking search results. Fields not defined by the
+    ``FileNode`` model are ignored. """
+
+
 MEDIA_TREE_UPLOAD_SUBDIR = getattr(settings, 'MEDIA_TREE_UPLOAD_SUBDIR',
     'upload')
 """ The name of the folder under your ``MEDIA_ROOT`` where media files
@@ -105,6 +164,33 @@ MEDIA_TREE_PREVIEW_SUBDIR = getattr(settings, 'MEDIA_TREE_PREVIEW_SUBDIR',
     of mediafiles, e.g. thumbnails, are stored. """
 
 
+MEDIA_TREE_STORAGE_MANIFEST = getattr(settings,
+    'MEDIA_TREE_STORAGE_MANIFEST', None)
+""" Path of a file in which the listing of the upload folder is kept
+    between maintenance runs, so that the folder is only listed again if
+    it changed. Must not be located in the upload folder. """
+
+
+MEDIA_TREE_MAINTENANCE_JOB_THREADS = getattr(settings,
+    'MEDIA_TREE_MAINTENANCE_JOB_THREADS', True)
+""" If ``True``, maintenance jobs started by admin actions run in a thread of
+    the web server process. Otherwise, they remain pending until
+    ``manage.py mediajobs`` runs them. """
+
+MEDIA_TREE_MAINTENANCE_JOB_TIMEOUT = getattr(settings,
+    'MEDIA_TREE_MAINTENANCE_JOB_TIMEOUT', 300)
+""" Number of seconds after which a running maintenance job that has not
+    sent a heartbeat is considered interrupted, for instance because its
+    process was terminated, and is run again. """
+
+
+MEDIA_TREE_STORAGE_PROBE_WORKERS = getattr(settings,
+    'MEDIA_TREE_STORAGE_PROBE_WORKERS', 8)
+""" Maximum number of threads that maintenance tasks use for checking
+    whether files exist in storage, and for retrieving their size and
+    modification time. """
+
+
 MEDIA_TREE_STATIC_SUBDIR = 'media_tree'
 
 
@@ -184,6 +270,43 @@ MEDIA_TREE_FILE_SIZE_LIMIT = getattr(settings, 'MEDIA_TREE_FILE_SIZE_LIMIT',
     Maximum file size for uploaded files. """
 
 
+MEDIA_TREE_ZIP_STORED_EXTENSIONS = getattr(settings,
+    'MEDIA_TREE_ZIP_STORED_EXTENSIONS', ('jpg', 'jpeg', 'png', 'gif', 'webp',
+    'mp3', 'm4a', 'aac', 'ogg', 'oga', 'mp4', 'm4v', 'mov', 'ogv', 'webm',
+    'flv', 'zip', 'gz', 'tgz', 'bz2', '7z', 'rar', 'docx', 'xlsx', 'pptx',
+    'odt', 'ods', 'odp'))
+""" Default: Common image, audio, video and archive formats
+
+    A tuple of extensions of already compressed file types, which are stored
+    without compressing them again when downloading files as a ZIP archive
+    (see the *zipfiles* extension). """
+
+
+MEDIA_TREE_ZIP_EXTRACT_MAX_FILES = getattr(settings,
+    'MEDIA_TREE_ZIP_EXTRACT_MAX_FILES', 10000)
+""" Default: ``10000``
+
+    Maximum number of files in an archive that is extracted into the node
+    tree (see the *zipfiles* extension). """
+
+
+MEDIA_TREE_ZIP_EXTRACT_MAX_SIZE = getattr(settings,
+    'MEDIA_TREE_ZIP_EXTRACT_MAX_SIZE', 5000000000) # 5 GB
+""" Default: 5 GB
+
+    Maximum total size of the files in an archive that is extracted into the
+    node tree. Files larger than ``MEDIA_TREE_FILE_SIZE_LIMIT`` are skipped. """
+
+
+MEDIA_TREE_ZIP_EXTRACT_MAX_RATIO = getattr(settings,
+    'MEDIA_TREE_ZIP_EXTRACT_MAX_RATIO', 100)
+""" Default: ``100``
+
+    Maximum compression ratio of the files in an archive that is extracted
+    into the node tree. Archives containing files larger than 1 MB that are
+    compressed more than this are rejected as possible zip bombs. """
+
+
 MEDIA_TREE_SWFUPLOAD = getattr(settings, 'MEDIA_TREE_SWFUPLOAD', True)
 """ Toggles support for SWFUpload on or off. See :ref:`install-swfupload`
     for more information. """
@@ -196,6 +319,93 @@ MEDIA_TREE_GLOBAL_THUMBNAIL_OPTIONS = getattr(settings,
     all thumbnails. """
 
 
+MEDIA_TREE_THUMBNAIL_CACHE_TIMEOUT = getattr(settings,
+    'MEDIA_TREE_THUMBNAIL_CACHE_TIMEOUT', 60 * 60 * 24 * 30)
+""" Default: 30 days
+
+    Number of seconds for which the URL and dimensions of generated
+    thumbnails are kept in Django's cache, allowing batch lookups such as
+    :func:`MediaBackend.get_thumbnails` to skip storage and database
+    checks. """
+
+
+MEDIA_TREE_CACHE_MAX_SIZE = getattr(settings, 'MEDIA_TREE_CACHE_MAX_SIZE',
+    None)
+""" Maximum total size in bytes of media cache files, such as thumbnails,
+    which ``manage.py mediacache --evict`` enforces by deleting the least
+    recently used files. """
+
+
+MEDIA_TREE_CACHE_MAX_AGE = getattr(settings, 'MEDIA_TREE_CACHE_MAX_AGE',
+    None)
+""" Number of seconds after which media cache files that have not been
+    used are deleted by ``manage.py mediacache --evict``. """
+
+
+MEDIA_TREE_THUMBNAIL_FAILURE_TIMEOUT = getattr(settings,
+    'MEDIA_TREE_THUMBNAIL_FAILURE_TIMEOUT', 60 * 60)
+""" Default: 1 hour
+
+    Number of seconds during which no further attempts are made to create a
+    thumbnail of a source with the same options after it failed. """
+
+
+MEDIA_TREE_THUMBNAIL_CIRCUIT_BREAKER = getattr(settings,
+    'MEDIA_TREE_THUMBNAIL_CIRCUIT_BREAKER', {
+        'window': 60,
+        'min_attempts': 20,
+        'max_failure_rate': .5,
+        'cooldown': 60,
+    })
+""" Configures the circuit breaker of each media backend: If, within
+    ``window`` seconds, at least ``min_attempts`` thumbnails were requested
+    and more than ``max_failure_rate`` of them failed, no thumbnails are
+    generated by that backend for ``cooldown`` seconds. Set this to ``None``
+    to disable circuit breakers. """
+
+
+MEDIA_TREE_THUMBNAIL_WORKERS = getattr(settings,
+    'MEDIA_TREE_THUMBNAIL_WORKERS', 1)
+""" Number of worker processes that media backends use for generating
+    thumbnails of several source images in parallel. Each source image is
+    only decoded once for all of its thumbnails. By default, no processes
+    are forked, and template tags generate thumbnails in threads instead
+    (see ``MEDIA_TREE_THUMBNAIL_THREADS``). Note that with a greater value,
+    a pool of processes is forked inside each web server process that
+    generates thumbnails. Management commands such as ``mediathumbs`` use
+    one process per CPU unless told otherwise. """
+
+
+MEDIA_TREE_THUMBNAIL_THREADS = getattr(settings,
+    'MEDIA_TREE_THUMBNAIL_THREADS', 4)
+""" Maximum number of threads that are started for generating the missing
+    thumbnails of several source images in parallel while a template is
+    rendered, for instance by the ``thumbnails`` template tag. The threads
+    only exist while the thumbnails are generated. Set this to ``1`` to
+    generate thumbnails one after another. """
+
+
+MEDIA_TREE_LAZY_THUMBNAILS = getattr(settings, 'MEDIA_TREE_LAZY_THUMBNAILS',
+    False)
+""" If ``True``, the ``thumbnail`` and ``thumbnails`` template tags do not
+    generate missing thumbnails while a page is rendered, but return signed
+    URLs of :class:`media_tree.contrib.views.thumbnail.ThumbnailView`, which
+    generates each thumbnail on its first request. """
+
+
+MEDIA_TREE_SRCSET_WIDTHS = getattr(settings, 'MEDIA_TREE_SRCSET_WIDTHS',
+    (320, 640, 960, 1280, 1920))
+""" The widths of the image versions listed in the ``srcset`` attribute
+    created by the ``srcset`` template tag. """
+
+
+MEDIA_TREE_THUMBNAIL_LRU_SIZE = getattr(settings,
+    'MEDIA_TREE_THUMBNAIL_LRU_SIZE', 1000)
+""" Number of thumbnail lookups that are additionally kept in memory by each
+    process, in front of Django's cache. Set this to ``0`` to disable the
+    in-process cache. """
+
+
 MEDIA_TREE_METADATA_FORMATS = getattr(
     settings, 'MEDIA_TREE_METADATA_FORMATS', {'title': '<strong>%s</strong>'})
 
@@ -1,5 +1,9 @@
 from django import template
 from django.contrib.admin.templatetags.admin_list import result_headers, results
+from media_tree import settings as app_settings, media_types
+from media_tree.admin.utils import get_current_request, get_request_attr
+from media_tree.media_backends import get_media_backend, \
+    get_source_thumbnails
 
 register = template.Library()
 
@@ -10,6 +14,37 @@ def _result_list(cl):
         'results': list(cl.result_list) #list(results(cl))
     }
 
+def _attach_thumbnails(nodes, size):
+    """
+    Resolves the preview thumbnails of all nodes with a single call to each
+    media backend involved, setting the ``thumbnail`` attribute of each node that has
+    an image preview, and ``preview_icon`` of all others.
+    """
+    media_backend = get_media_backend(handles_media_types=(
+        media_types.SUPPORTED_IMAGE,))
+    thumbnail_nodes = []
+    sources = []
+    for node in nodes:
+        node.thumbnail = None
+        preview_file = node.get_preview_file() if media_backend else None
+        if preview_file and not getattr(preview_file, 'is_icon', False):
+            thumbnail_nodes.append(node)
+            sources.append(preview_file)
+        else:
+            node.preview_icon = node.get_icon_file()
+    if sources:
+        thumbnails = get_source_thumbnails(sources, {'size': size})
+        for node, thumbnail in zip(thumbnail_nodes, thumbnails):
+            node.thumbnail = thumbnail
+            if not thumbnail:
+                node.preview_icon = node.get_icon_file()
+
 def result_list_thumbnails(cl):
-    return _result_list(cl)
+    context = _result_list(cl)
+    thumb_size_key = get_request_attr(
+        get_current_request(), 'thumbnail_size') or 'default'
+    context['thumbnail_size'] = \
+        app_settings.MEDIA_TREE_ADMIN_THUMBNAIL_SIZES[thumb_size_key]
+    _attach_thumbnails(context['results'], context['thumbnail_size'])
+    return context
 result_list_thumbnails = register.inclusion_tag("admin/media_tree/filenode/change_list_results_thumbnails.html")(result_list_thumbnails)
@@ -8,7 +8,8 @@ library as follows::
 .. Note::
    Most of the code of this module is an almost identical copy of
    easy_thumbnails' template tag, modified to work with ``FileNode`` sources and
-   the configured ``MEDIA_BACKEND``. Hence, the :func:`thumbnail` tag is
+   the configured media backends, which are chosen for each source by
+   :func:`media_tree.media_backends.get_source_backend`. Hence, the :func:`thumbnail` tag is
    compatible to that of easy_thumbnails, but it will work with any
    thumbnail-generating application if you provide an appropriate
    ``MediaBackend`` class.
@@ -16,7 +17,9 @@ library as follows::
 
 from media_tree import settings as app_settings
 from media_tree.models import FileNode
-from media_tree.media_backends import get_media_backend
+from media_tree.media_backends import get_backend_registry, \
+    get_media_backend, get_source_backend, get_source_thumbnails
+from media_tree.utils.instrumentation import timed
 from media_tree import media_types
 from django.conf import settings
 from django import template
@@ -28,12 +31,34 @@ import re
 
 THUMBNAIL_SIZES = app_settings.MEDIA_TREE_THUMBNAIL_SIZES
 RE_SIZE = re.compile(r'(\d+)x(\d+)$')
-MEDIA_BACKEND = get_media_backend(fail_silently=False, handles_media_types=(
-    media_types.SUPPORTED_IMAGE,))
-VALID_OPTIONS = MEDIA_BACKEND.get_valid_thumbnail_options() if MEDIA_BACKEND else {}
 register = template.Library()
 
 
+def load_media_backend():
+    """
+    Sets the backend handling images, and the options that are valid for
+    any of the configured backends. This is done when the module is loaded,
+    and again by :func:`media_tree.media_backends.reload_media_backends`.
+    """
+    global MEDIA_BACKEND, VALID_OPTIONS
+    MEDIA_BACKEND = get_media_backend(fail_silently=False,
+        handles_media_types=(media_types.SUPPORTED_IMAGE,))
+    VALID_OPTIONS = set()
+    for backend in get_backend_registry().get_all():
+        VALID_OPTIONS.update(backend.get_valid_thumbnail_options())
+
+load_media_backend()
+
+
+def get_thumbnails(sources, opts):
+    """
+    Returns the thumbnails of all sources, or if ``MEDIA_TREE_LAZY_THUMBNAILS``
+    is enabled, signed URLs of thumbnails that have not been generated yet.
+    """
+    return get_source_thumbnails(sources, opts,
+                                 lazy=app_settings.MEDIA_TREE_LAZY_THUMBNAILS)
+
+
 class ThumbnailSizeNode(template.Node):
     def __init__(self, size_name=None, context_name=None):
         if size_name:
@@ -133,6 +158,7 @@ class ThumbnailNode(Node):
         self.opts = opts
         self.context_name = context_name
 
+    @timed('thumbnail_tag')
     def render(self, context):
         # Note that this isn't a global constant because we need to change the
         # value for tests.
@@ -147,7 +173,29 @@ class ThumbnailNode(Node):
                 raise VariableDoesNotExist("Variable '%s' does not exist." %
                         self.source_var)
             return self.bail_out(context)
-        # Resolve the thumbnail option values.
+        opts = self.resolve_options(context, raise_errors)
+        if opts is None:
+            return self.bail_out(context)
+        # Look up the thumbnail in the thumbnail cache, which only falls
+        # back to the media backend if it hasn't been generated before.
+        try:
+            thumbnail = get_thumbnails([source], opts)[0]
+        except:
+            if raise_errors:
+                raise
+            return self.bail_out(context)
+        if not thumbnail:
+            return self.bail_out(context)
+        # Return the thumbnail file url, or put the file on the context.
+        if self.context_name is None:
+            return escape(thumbnail.url)
+        else:
+            context[self.context_name] = thumbnail
+            return ''
+
+    def resolve_options(self, context, raise_errors=False):
+        """ Returns the resolved thumbnail options, or ``None`` if they could
+            not be resolved. """
         try:
             opts = {}
             for key, value in self.opts.iteritems():
@@ -157,7 +205,7 @@ class ThumbnailNode(Node):
         except:
             if raise_errors:
                 raise
-            return self.bail_out(context)
+            return None
             
         # Size variable can be either a tuple/list of two integers or a
         # valid string, only the string is checked.
@@ -173,20 +221,9 @@ class ThumbnailNode(Node):
                     if raise_errors:
                         raise TemplateSyntaxError("Variable '%s' was resolved "
                                 "but '%s' is not a valid size." %
-                                (self.size_var, size))
-                    return self.bail_out(context)
-        try:
-            thumbnail = MEDIA_BACKEND.get_thumbnail(source, opts)
-        except:
-            if raise_errors:
-                raise
-            return self.bail_out(context)
-        # Return the thumbnail file url, or put the file on the context.
-        if self.context_name is None:
-            return escape(thumbnail.url)
-        else:
-            context[self.context_name] = thumbnail
-            return ''
+                                (self.opts['size'], size))
+                    return None
+        return opts
 
     def bail_out(self, context):
         if self.context_name:
@@ -220,18 +257,20 @@ def thumbnail(parser, token):
     processing the image to a thumbnail such as ``sharpen``, ``crop`` and
     ``quality=90``.
 
-    The thumbnail tag can also place a ``ThumbnailFile`` object in the context,
-    providing access to the properties of the thumbnail such as the height and
-    width::
+    The thumbnail tag can also place a ``ThumbnailInfo`` object in the
+    context, providing access to the properties of the thumbnail such as its
+    URL, height and width::
 
         {% thumbnail [source] [size] [options] as [variable] %}
 
     When ``as [variable]`` is used, the tag does not return the absolute URL of
     the thumbnail.
 
-    Having access to the ``ThumbnailFile`` object is extremely useful, since
+    Having access to the ``ThumbnailInfo`` object is extremely useful, since
     you should always include the width and height attributes in the output
-    HTML.
+    HTML. Its ``url``, ``width`` and ``height`` are looked up in the thumbnail
+    cache, whereas its ``path``, ``size``, ``file`` and ``image`` are read from
+    storage when accessed, like those of a ``ThumbnailFile``.
 
     Example usage, passing the tag a ``FileNode`` instance::
     
@@ -268,21 +307,30 @@ def thumbnail(parser, token):
             "'{%% %s source size [option1 option2 ...] as variable %%}'" %
             (tag, tag))
 
-    opts = {}
-
     # The first argument is the source file.
     source_var = parser.compile_filter(args[1])
+    opts = compile_options(parser, tag, args[2], args[3:])
+    return ThumbnailNode(source_var, opts=opts, context_name=context_name)
+
+register.tag(thumbnail)
+
+
+def compile_options(parser, tag, size, args):
+    """
+    Compiles the size argument and all further option arguments of the
+    :func:`thumbnail` and :func:`thumbnails` tags.
+    """
+    opts = {}
 
-    # The second argument is the requested size. If it's the static "10x10"
-    # format, wrap it in quotes so that it is compiled correctly.
-    size = args[2]
+    # The requested size. If it's the static "10x10" format, wrap it in
+    # quotes so that it is compiled correctly.
     match = RE_SIZE.match(size)
     if match:
         size = '"%s"' % size
     opts['size'] = parser.compile_filter(size)
 
     # All further arguments are options.
-    args_list = split_args(args[3:]).items()
+    args_list = split_args(args).items()
     for arg, value in args_list:
         if arg in VALID_OPTIONS:
             if value and value is not True:
@@ -291,6 +339,212 @@ def thumbnail(parser, token):
         else:
             raise TemplateSyntaxError("'%s' tag received a bad argument: "
                                       "'%s'" % (tag, arg))
-    return ThumbnailNode(source_var, opts=opts, context_name=context_name)
+    return opts
 
-register.tag(thumbnail)
+
+class ThumbnailMap(dict):
+    """
+    A dictionary mapping the primary key of each ``FileNode`` (or the name of
+    each file) passed to the :func:`thumbnails` tag to its thumbnail. Use the
+    :func:`thumbnail_for` filter to look up the thumbnail of a node.
+    """
+
+    @staticmethod
+    def get_key(source):
+        if isinstance(source, FileNode):
+            return source.pk
+        return getattr(source, 'name', source)
+
+    def get_for(self, source):
+        return self.get(self.get_key(source), '')
+
+
+class ThumbnailsNode(ThumbnailNode):
+
+    @timed('thumbnails_tag')
+    def render(self, context):
+        raise_errors = getattr(settings, 'TEMPLATE_DEBUG', False)
+        try:
+            source_list = list(self.source_var.resolve(context) or ())
+        except VariableDoesNotExist:
+            if raise_errors:
+                raise VariableDoesNotExist("Variable '%s' does not exist." %
+                        self.source_var)
+            return self.bail_out(context)
+        opts = self.resolve_options(context, raise_errors)
+        if opts is None:
+            return self.bail_out(context)
+
+        keys = []
+        sources = []
+        for source in source_list:
+            keys.append(ThumbnailMap.get_key(source))
+            sources.append(source.file if isinstance(source, FileNode)
+                           else source)
+        # Resolve all thumbnails at once: Cached ones are returned by a
+        # single cache request, and only the others are passed on to the
+        # media backend.
+        try:
+            thumbnails = get_thumbnails(sources, opts)
+        except:
+            if raise_errors:
+                raise
+            return self.bail_out(context)
+        context[self.context_name] = ThumbnailMap([(key, thumbnail)
+            for key, thumbnail in zip(keys, thumbnails) if thumbnail])
+        return ''
+
+    def bail_out(self, context):
+        context[self.context_name] = ThumbnailMap()
+        return ''
+
+
+def thumbnails(parser, token):
+    """
+    Creates the thumbnails of all ``FileNode`` instances (or files) in a list
+    at once, which is considerably faster than calling :func:`thumbnail` for
+    each item of the list.
+
+    Basic tag syntax::
+
+        {% thumbnails [source_list] [size] [options] as [variable] %}
+
+    ``size`` and ``options`` are the same as for :func:`thumbnail`. The
+    variable is set to a dictionary mapping each node to its thumbnail, which
+    you can query using the :func:`thumbnail_for` filter.
+
+    Example usage::
+
+        {% thumbnails gallery_nodes "200x200" crop as thumbs %}
+        {% for node in gallery_nodes %}
+            {% with thumb=thumbs|thumbnail_for:node %}
+            <img src="{{ thumb.url }}" alt="{{ node.alt }}"
+                width="{{ thumb.width }}" height="{{ thumb.height }}" />
+            {% endwith %}
+        {% endfor %}
+
+    """
+    args = token.split_contents()
+    tag = args[0]
+
+    if len(args) < 5 or args[-2] != 'as':
+        raise TemplateSyntaxError("Invalid syntax. Expected "
+            "'{%% %s source_list size [option1 option2 ...] as variable %%}'" %
+            tag)
+    context_name = args[-1]
+    args = args[:-2]
+
+    source_var = parser.compile_filter(args[1])
+    opts = compile_options(parser, tag, args[2], args[3:])
+    return ThumbnailsNode(source_var, opts=opts, context_name=context_name)
+
+register.tag(thumbnails)
+
+
+@register.filter
+def thumbnail_for(thumbnail_map, source):
+    """
+    Returns the thumbnail of a ``FileNode`` (or file) from the dictionary
+    created by the :func:`thumbnails` tag, or an empty string if no thumbnail
+    could be created for it.
+    """
+    if not isinstance(thumbnail_map, ThumbnailMap):
+        return ''
+    return thumbnail_map.get_for(source)
+
+
+class Srcset(list):
+    """
+    A list of thumbnails of different widths, which is rendered as the value
+    of an ``<img>`` tag's ``srcset`` attribute.
+    """
+
+    def __unicode__(self):
+        return u', '.join([u'%s %iw' % (thumbnail.url, thumbnail.width)
+                           for thumbnail in self])
+
+
+class SrcsetNode(ThumbnailNode):
+
+    @timed('srcset_tag')
+    def render(self, context):
+        raise_errors = getattr(settings, 'TEMPLATE_DEBUG', False)
+        try:
+            source = self.source_var.resolve(context)
+            if isinstance(source, FileNode):
+                source = source.file
+            opts = {}
+            for key, value in self.opts.iteritems():
+                if hasattr(value, 'resolve'):
+                    value = value.resolve(context)
+                opts[str(key)] = value
+            thumbnails = get_source_backend(source, fail_silently=False) \
+                .get_srcset(source, opts)
+        except:
+            if raise_errors:
+                raise
+            return self.bail_out(context)
+
+        # Versions of images narrower than some of the widths are only
+        # listed once.
+        srcset = Srcset()
+        for thumbnail in sorted([thumbnail for thumbnail in thumbnails
+                                 if thumbnail], key=lambda t: t.width):
+            if not srcset or srcset[-1].width != thumbnail.width:
+                srcset.append(thumbnail)
+        if self.context_name is None:
+            return escape(unicode(srcset))
+        context[self.context_name] = srcset
+        return ''
+
+
+def srcset(parser, token):
+    """
+    Creates versions of an image in all widths configured in
+    ``MEDIA_TREE_SRCSET_WIDTHS`` and returns them as the value of a
+    ``srcset`` attribute. The source image is only decoded once for all
+    versions, and all of them are cached together.
+
+    Basic tag syntax::
+
+        {% srcset [source] [options] %}
+
+    ``source`` and ``options`` are the same as for :func:`thumbnail`. Using
+    ``as [variable]``, the tag places a list of the thumbnails in the context
+    instead, which is rendered as the ``srcset`` value as well.
+
+    Example usage::
+
+        {% srcset node as versions %}
+        <img src="{{ versions.0.url }}" srcset="{{ versions }}"
+            sizes="100vw" alt="{{ node.alt }}" />
+
+    """
+    args = token.split_contents()
+    tag = args[0]
+
+    if len(args) > 3 and args[-2] == 'as':
+        context_name = args[-1]
+        args = args[:-2]
+    else:
+        context_name = None
+
+    if len(args) < 2:
+        raise TemplateSyntaxError("Invalid syntax. Expected "
+            "'{%% %s source [option1 option2 ...] %%}' or "
+            "'{%% %s source [option1 option2 ...] as variable %%}'" %
+            (tag, tag))
+
+    source_var = parser.compile_filter(args[1])
+    opts = {}
+    for arg, value in split_args(args[2:]).items():
+        if arg in VALID_OPTIONS:
+            if value and value is not True:
+                value = parser.compile_filter(value)
+            opts[arg] = value
+        else:
+            raise TemplateSyntaxError("'%s' tag received a bad argument: "
+                                      "'%s'" % (tag, arg))
+    return SrcsetNode(source_var, opts=opts, context_name=context_name)
+
+register.tag(srcset)
@@ -5,7 +5,14 @@ unittest). These will both pass when you run "manage.py test".
 Replace these with more appropriate tests for your application.
 """
 
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Template, Context
 from django.test import TestCase
+from django.utils import unittest
+from media_tree import media_types
+from media_tree.models import FileNode
+import StringIO
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,10 +21,50 @@ class SimpleTest(TestCase):
         """
         self.failUnlessEqual(1 + 1, 2)
 
+
+@unittest.skipUnless('easy_thumbnails' in settings.INSTALLED_APPS,
+                     'easy_thumbnails is not installed')
+class EasyThumbnailsBackendTest(TestCase):
+
+    def setUp(self):
+        from media_tree.contrib.media_backends.easy_thumbnails import \
+            EasyThumbnailsBackend
+        from media_tree.utils import thumbnail_cache
+        from PIL import Image
+        self.backend = EasyThumbnailsBackend
+        thumbnail_cache.invalidate()
+        output = StringIO.StringIO()
+        Image.new('RGB', (400, 200), 'red').save(output, 'JPEG')
+        self.node = FileNode(node_type=media_types.FILE)
+        self.node.file = SimpleUploadedFile('test.jpg', output.getvalue())
+        self.node.save()
+        self.thumbnails = []
+
+    def tearDown(self):
+        for thumbnail in self.thumbnails:
+            thumbnail.storage.delete(thumbnail.name)
+        self.node.file.delete(save=False)
+
+    def test_generate_source_thumbnails(self):
+        self.thumbnails = self.backend.generate_source_thumbnails(
+            self.node.file, [{'size': (100, 100)}, {'size': (50, 0)}])
+        self.failUnlessEqual([(thumbnail.width, thumbnail.height)
+            for thumbnail in self.thumbnails], [(100, 50), (50, 25)])
+
+    def test_render_thumbnail_tag(self):
+        from media_tree.templatetags import media_tree_thumbnail
+        if media_tree_thumbnail.MEDIA_BACKEND is not self.backend:
+            self.skipTest('easy_thumbnails is not the configured backend')
+        context = Context({'node': self.node})
+        output = Template('{% load media_tree_thumbnail %}'
+            '{% thumbnail node.file 60x60 as thumbnail %}'
+            '{{ thumbnail.width }}x{{ thumbnail.height }}').render(context)
+        self.thumbnails = [context['thumbnail']]
+        self.failUnlessEqual(output, '60x30')
+
 __test__ = {"doctest": """
 Another way to test that 1 + 1 is equal to 2.
 
 >>> 1 + 1 == 2
 True
 """}
-
@@ -12,11 +12,20 @@ RE_SPLITEXT = re.compile('^(\.*.*?)((\.[^\.]+)*|\.)$')
 
 def get_media_storage():
     klass = get_storage_class(import_path=app_settings.MEDIA_TREE_STORAGE)
+    if app_settings.MEDIA_TREE_INSTRUMENTATION:
+        from media_tree.utils.instrumentation import instrument_storage
+        return instrument_storage(klass())
     return klass()
  
     
-# TODO: This function should probably cache all imported modules
+_module_attrs = {}
+
+
 def get_module_attr(path):
+    try:
+        return _module_attrs[path]
+    except KeyError:
+        pass
     i = path.rfind('.')
     module_name, attr_name = path[:i], path[i+1:]
     try:
@@ -30,6 +39,7 @@ def get_module_attr(path):
         raise ImproperlyConfigured(
             'Module "%s" does not define a "%s" callable' % (
                 module_name, attr_name))
+    _module_attrs[path] = attr
     return attr
 
 
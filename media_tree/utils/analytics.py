@@ -0,0 +1,236 @@
+""" Storage usage reports, grouping the number and size of files by folder,
+    media type, extension, uploading user and month of upload.
+
+    Each report is computed with one aggregate query per grouping, files
+    being assigned to folders by their ``lft`` and ``rght`` values. Reports
+    are stored in Django's cache together with a stamp describing the files
+    and folders they were computed from. Since moving a folder saves it, its
+    modification date changes, as does the stamp. When a report is requested
+    again and nodes have only been added since, the aggregates of the new
+    files are added to the cached report instead of computing it again. """
+
+from media_tree import media_types, settings as app_settings
+from media_tree.models import FileNode
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Sum, Max
+from django.utils import timezone
+from django.utils.datastructures import SortedDict
+from django.utils.translation import ugettext_lazy as _
+
+
+CACHE_KEY = 'media_tree:usage:%s'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+GROUPINGS = ('folder', 'media_type', 'extension', 'created_by', 'month')
+
+GROUPING_NAMES = {
+    'folder': _('folder'),
+    'media_type': _('media type'),
+    'extension': _('type'),
+    'created_by': _('created by'),
+    'month': _('month'),
+}
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def has_field(name):
+    return name in FileNode._meta.get_all_field_names()
+
+
+def get_nodes(node_type, folder=None):
+    nodes = FileNode._tree_manager.filter(node_type=node_type)
+    if folder:
+        opts = FileNode._mptt_meta
+        nodes = nodes.filter(**{
+            opts.tree_id_attr: getattr(folder, opts.tree_id_attr),
+            '%s__gt' % opts.left_attr: getattr(folder, opts.left_attr),
+            '%s__lt' % opts.right_attr: getattr(folder, opts.right_attr)})
+    return nodes
+
+
+def get_files(folder=None):
+    return get_nodes(FileNode.FILE, folder)
+
+
+def get_stamp(nodes):
+    """ Returns a dictionary describing the nodes in the queryset ``nodes``,
+        which changes whenever nodes are added, removed or modified. """
+    stamp = nodes.aggregate(count=Count('pk'), size=Sum('size'),
+                            modified=Max('modified'), max_pk=Max('pk'))
+    stamp['size'] = stamp['size'] or 0
+    return stamp
+
+
+def get_stamps(folder=None):
+    return {'files': get_stamp(get_files(folder)),
+            'folders': get_stamp(get_nodes(FileNode.FOLDER, folder))}
+
+
+def group_by_folder(folder=None, after_pk=None):
+    """ Groups files by the child folder of ``folder`` (or the top-level
+        folder) that contains them, using a single self-join on the tree
+        fields. Files that are not in a child folder are left out. """
+    opts = FileNode._mptt_meta
+    table = qn(FileNode._meta.db_table)
+    fields = dict([(name, qn(FileNode._meta.get_field(name).column))
+                   for name in ('node_type', 'size', opts.tree_id_attr,
+                                opts.left_attr, opts.right_attr,
+                                opts.level_attr)])
+    pk = qn(FileNode._meta.pk.column)
+    conditions = ['f.%s = %%s' % fields['node_type'],
+                  'a.%s = %%s' % fields['node_type'],
+                  'a.%s = %%s' % fields[opts.level_attr]]
+    params = [FileNode.FILE, media_types.FOLDER,
+              getattr(folder, opts.level_attr) + 1 if folder else 0]
+    if folder:
+        conditions.append('a.%s = %%s AND a.%s > %%s AND a.%s < %%s' % (
+            fields[opts.tree_id_attr], fields[opts.left_attr],
+            fields[opts.right_attr]))
+        params.extend([getattr(folder, opts.tree_id_attr),
+                       getattr(folder, opts.left_attr),
+                       getattr(folder, opts.right_attr)])
+    if after_pk is not None:
+        conditions.append('f.%s > %%s' % pk)
+        params.append(after_pk)
+    cursor = connection.cursor()
+    cursor.execute('SELECT a.%(pk)s, COUNT(f.%(pk)s), SUM(f.%(size)s) '
+        'FROM %(table)s f INNER JOIN %(table)s a ON a.%(tree_id)s = '
+        'f.%(tree_id)s AND a.%(lft)s < f.%(lft)s AND a.%(rght)s > f.%(rght)s '
+        'WHERE %(conditions)s GROUP BY a.%(pk)s' % {
+            'pk': pk, 'size': fields['size'], 'table': table,
+            'tree_id': fields[opts.tree_id_attr],
+            'lft': fields[opts.left_attr], 'rght': fields[opts.right_attr],
+            'conditions': ' AND '.join(conditions)}, params)
+    return dict([(key, [count, size or 0])
+                 for key, count, size in cursor.fetchall()])
+
+
+def group_by_field(files, field):
+    return dict([(row[field], [row['count'], row['size'] or 0])
+                 for row in files.order_by().values(field).annotate(
+                     count=Count('pk'), size=Sum('size'))])
+
+
+def group_by_month(files):
+    month = connection.ops.date_trunc_sql('month', '%s.%s' % (
+        qn(FileNode._meta.db_table),
+        qn(FileNode._meta.get_field('created').column)))
+    rows = files.order_by().extra(select={'month': month}).values('month') \
+        .annotate(count=Count('pk'), size=Sum('size'))
+    # Depending on the database, months are dates or strings
+    return dict([(unicode(row['month'])[:7], [row['count'], row['size'] or 0])
+                 for row in rows])
+
+
+def get_groups(files, folder=None, after_pk=None):
+    if after_pk is not None:
+        files = files.filter(pk__gt=after_pk)
+    groups = {'folder': group_by_folder(folder, after_pk),
+              'media_type': group_by_field(files, 'media_type'),
+              'extension': group_by_field(files, 'extension')}
+    if has_field('created_by'):
+        groups['created_by'] = group_by_field(files, 'created_by')
+    if has_field('created'):
+        groups['month'] = group_by_month(files)
+    return groups
+
+
+def merge_groups(groups, new_groups):
+    for name, new_group in new_groups.items():
+        group = groups.setdefault(name, {})
+        for key, (count, size) in new_group.items():
+            totals = group.setdefault(key, [0, 0])
+            totals[0] += count
+            totals[1] += size
+
+
+def is_append_only(folder, old_stamps, stamps):
+    """ Returns ``True`` if the only change since ``old_stamps`` were taken
+        is that files and folders with greater primary keys were added. """
+    if not old_stamps['files']['max_pk']:
+        return False
+    for kind, node_type in (('files', FileNode.FILE),
+                            ('folders', FileNode.FOLDER)):
+        old_stamp = old_stamps[kind]
+        if stamps[kind]['count'] < old_stamp['count']:
+            return False
+        if old_stamp['max_pk'] and get_stamp(get_nodes(node_type, folder)
+                .filter(pk__lte=old_stamp['max_pk'])) != old_stamp:
+            return False
+    return True
+
+
+def get_usage(folder=None, refresh=False):
+    """ Returns a dictionary containing the storage usage of all files, or
+        of the files below ``folder``, with the keys ``count``, ``size``,
+        ``computed`` (the date when the report was last updated) and
+        ``groups``, which maps each of the ``GROUPINGS`` to a dictionary
+        mapping keys (such as primary keys of folders and users, media types
+        or months) to ``[count, size]`` lists. """
+    key = CACHE_KEY % (folder.pk if folder else 'all')
+    files = get_files(folder)
+    stamps = get_stamps(folder)
+    report = None if refresh else cache.get(key)
+    if report and report['stamps'] == stamps:
+        return report
+
+    if report and is_append_only(folder, report['stamps'], stamps):
+        merge_groups(report['groups'], get_groups(files, folder,
+            report['stamps']['files']['max_pk']))
+    else:
+        report = {'groups': get_groups(files, folder)}
+    report.update(stamps=stamps, count=stamps['files']['count'],
+                  size=stamps['files']['size'], computed=timezone.now())
+    cache.set(key, report, CACHE_TIMEOUT)
+    return report
+
+
+def get_labels(name, keys):
+    """ Returns a dictionary mapping the given keys of the grouping ``name``
+        to display names. """
+    if name == 'folder':
+        return dict(FileNode._tree_manager.filter(pk__in=keys)
+                    .values_list('pk', 'name'))
+    if name == 'media_type':
+        return dict([(key, app_settings.MEDIA_TREE_CONTENT_TYPES.get(key, key))
+                     for key in keys])
+    if name == 'created_by':
+        user_model = FileNode._meta.get_field('created_by').rel.to
+        return dict([(user.pk, unicode(user)) for user
+                     in user_model._default_manager.filter(pk__in=keys)])
+    return dict([(key, key) for key in keys])
+
+
+def get_table(report, name, limit=None):
+    """ Returns the grouping ``name`` of ``report`` as a list of
+        ``(label, count, size, percent)`` tuples, largest first, or ordered
+        by month for the ``month`` grouping, in which case the cumulative
+        size is appended to each tuple. """
+    group = report['groups'].get(name, {})
+    labels = get_labels(name, [key for key in group if key is not None])
+    total = report['size'] or 1
+    labels[None] = _('unknown')
+    rows = [(labels.get(key, key), count, size,
+             100.0 * size / total) for key, (count, size) in group.items()]
+    if name == 'month':
+        rows.sort()
+        table = []
+        cumulative = 0
+        for row in rows:
+            cumulative += row[2]
+            table.append(row + (cumulative,))
+        return table
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:limit] if limit else rows
+
+
+def get_tables(report, limit=None):
+    tables = SortedDict()
+    for name in GROUPINGS:
+        if name in report['groups']:
+            tables[name] = get_table(report, name, limit)
+    return tables
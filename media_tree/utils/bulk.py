@@ -0,0 +1,202 @@
+""" Set-based metadata updates for large selections of nodes.
+
+    Instead of saving each node, metadata is written using ``UPDATE``
+    statements covering the ``lft``/``rght`` ranges of the selected subtrees,
+    and the derived fields ``has_metadata``, ``modified`` and
+    ``modified_by`` are recomputed in the same manner. Note that
+    consequently, ``pre_save()`` is not called and no ``post_save`` signals
+    are sent for the updated nodes. """
+
+from media_tree import media_types, settings as app_settings
+from media_tree.models import FileNode
+from media_tree.utils.filenode import get_selection_ranges
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+import operator
+
+
+RANGES_PER_QUERY = 100
+
+PKS_PER_QUERY = 500
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def get_editable_fields(model=FileNode):
+    """ Returns the names of all editable fields, except for file fields. """
+    return [field.name for field in model._meta.fields
+            if field.editable and not field.primary_key
+            and not isinstance(field, models.FileField)]
+
+
+def get_bulk_fields(model=FileNode):
+    """ Returns the names of all editable fields that can be updated without
+        affecting the tree structure, any files or the slug. """
+    return [name for name in get_editable_fields(model)
+            if not name in (model._mptt_meta.parent_attr, 'name')]
+
+
+def get_common_values(queryset, field_names):
+    """ Returns a dictionary containing the value of each of the given fields
+        that all nodes in ``queryset`` have in common, or ``None`` if their
+        values differ, using a single aggregate query. """
+    model = queryset.model
+    subquery, params = queryset.order_by().values('pk').query \
+        .sql_with_params()
+    fields = [model._meta.get_field(name) for name in field_names]
+    selects = ['COUNT(*)']
+    for field in fields:
+        column = qn(field.column)
+        if isinstance(field, models.BooleanField):
+            column = 'CASE WHEN %s THEN 1 ELSE 0 END' % column
+        selects.extend(['MIN(%s)' % column, 'MAX(%s)' % column,
+                        'COUNT(%s)' % column])
+    cursor = connection.cursor()
+    cursor.execute('SELECT %s FROM %s WHERE %s IN (%s)' % (
+        ', '.join(selects), qn(model._meta.db_table),
+        qn(model._meta.pk.column), subquery), params)
+    row = cursor.fetchone()
+
+    total = row[0]
+    values = {}
+    for index, field in enumerate(fields):
+        min_value, max_value, count = row[1 + index * 3:4 + index * 3]
+        if total and count == total and min_value == max_value:
+            if isinstance(field, models.BooleanField):
+                value = bool(min_value)
+            else:
+                value = field.to_python(
+                    connection.ops.convert_values(min_value, field))
+        else:
+            value = None
+        values[field.name] = value
+    return values
+
+
+def get_minimal_metadata_q():
+    """ Returns a ``Q`` object matching nodes for which the minimal metadata
+        has been entered, equivalent to
+        ``MetadataMixin.check_minimal_metadata()`` without taking descendants
+        into account. """
+    return (Q(media_type__in=app_settings.MEDIA_TREE_METADATA_LESS_MEDIA_TYPES)
+            & ~Q(name='')) \
+        | ~Q(title='') | ~Q(description='') | ~Q(override_alt='') \
+        | ~Q(override_caption='')
+
+
+def get_ranges_q(ranges, recursive=True):
+    if recursive:
+        conditions = [Q(tree_id=tree_id, lft__gte=lft, lft__lte=rght)
+                      for tree_id, lft, rght, level in ranges]
+    else:
+        conditions = [Q(tree_id=tree_id, lft=lft)
+                      for tree_id, lft, rght, level in ranges]
+    return reduce(operator.or_, conditions)
+
+
+def get_ancestors_q(ranges):
+    return reduce(operator.or_, [
+        Q(tree_id=tree_id, lft__lt=lft, rght__gt=rght)
+        for tree_id, lft, rght, level in ranges])
+
+
+def iter_chunks(items, size=RANGES_PER_QUERY):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def update_folders_has_metadata(folders):
+    """ Updates the ``has_metadata`` flag of the ``folders`` queryset, all of
+        which need to be on the same level, based on their own metadata and
+        that of their children.
+
+        The primary keys of the folders and of those with incomplete children
+        are fetched first, since MySQL does not allow updating a table using
+        a subquery on the same table. """
+    pks = list(folders.values_list('pk', flat=True))
+    for chunk in iter_chunks(pks, PKS_PER_QUERY):
+        folders = FileNode.objects.filter(pk__in=chunk)
+        incomplete = list(set(FileNode.objects.filter(parent__in=chunk,
+            has_metadata=False).values_list('parent', flat=True)))
+        folders.filter(pk__in=incomplete).update(has_metadata=False)
+        folders.exclude(pk__in=incomplete).filter(get_minimal_metadata_q()) \
+            .update(has_metadata=True)
+        folders.exclude(get_minimal_metadata_q()).update(has_metadata=False)
+
+
+def update_has_metadata(nodes):
+    """ Recomputes the ``has_metadata`` flag for all nodes in ``nodes``.
+        Folders are updated level by level, starting with the deepest, so
+        that their flag reflects that of their descendants. """
+    nodes.filter(get_minimal_metadata_q()).update(has_metadata=True)
+    nodes.exclude(get_minimal_metadata_q()).update(has_metadata=False)
+    folders = nodes.filter(node_type=media_types.FOLDER)
+    levels = folders.order_by('-level').values_list('level', flat=True) \
+        .distinct()
+    for level in levels:
+        update_folders_has_metadata(folders.filter(level=level))
+
+
+def update_metadata(queryset, metadata, user=None, recursive=False):
+    """ Sets the field values in the ``metadata`` dictionary for all nodes
+        in ``queryset``, and if ``recursive`` is true, for all of their
+        descendants. Returns the number of nodes that were changed.
+
+        The ``has_metadata`` flag of the updated nodes and their ancestors
+        is recomputed, and ``modified`` and ``modified_by`` are set for
+        all changed nodes. """
+    if not metadata:
+        return 0
+    bulk_fields = get_bulk_fields()
+    for key in metadata:
+        if not key in bulk_fields:
+            raise ValueError('Field %s cannot be updated in bulk.' % key)
+
+    if recursive:
+        ranges = get_selection_ranges(queryset)
+    else:
+        ranges = list(queryset.order_by('tree_id', 'lft').values_list(
+            'tree_id', 'lft', 'rght', 'level'))
+    if not ranges:
+        return 0
+
+    now = timezone.now()
+    values = dict(metadata)
+    values['modified'] = now
+    if user:
+        values['modified_by'] = user
+    changed = reduce(operator.or_, [~Q(**{key: value})
+                                    for key, value in metadata.items()])
+
+    changed_pks = []
+    with transaction.commit_on_success():
+        for chunk in iter_chunks(ranges):
+            nodes = FileNode.objects.filter(get_ranges_q(chunk, recursive))
+            pks = list(nodes.filter(changed).values_list('pk', flat=True))
+            for pks_chunk in iter_chunks(pks, PKS_PER_QUERY):
+                FileNode.objects.filter(pk__in=pks_chunk).update(**values)
+            changed_pks.extend(pks)
+            update_has_metadata(nodes)
+
+        ancestors = []
+        for chunk in iter_chunks(ranges):
+            ancestors.extend(FileNode.objects.filter(get_ancestors_q(chunk))
+                .values_list('pk', 'level'))
+        for level in sorted(set([level for pk, level in ancestors]),
+                            reverse=True):
+            pks = list(set([pk for pk, pk_level in ancestors
+                            if pk_level == level]))
+            for chunk in iter_chunks(pks):
+                update_folders_has_metadata(
+                    FileNode.objects.filter(pk__in=chunk))
+
+    if changed_pks and app_settings.MEDIA_TREE_SEARCH_INDEX:
+        from media_tree.utils.search import index_nodes
+        for pks_chunk in iter_chunks(changed_pks, PKS_PER_QUERY):
+            for indexed in index_nodes(
+                    FileNode.objects.filter(pk__in=pks_chunk)):
+                pass
+    return len(changed_pks)
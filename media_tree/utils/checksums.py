@@ -0,0 +1,43 @@
+""" Checksums of media files, which are recorded when a file is uploaded
+    (see :attr:`FileNode.checksum`) and compared to the stored files by the
+    ``mediaverify`` management command in order to detect corruption. """
+
+import hashlib
+
+
+ALGORITHM = 'sha256'
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_checksum(file, chunk_size=CHUNK_SIZE):
+    """ Returns the hexadecimal checksum of a Django ``File`` object, reading
+        it in chunks so that large files are not loaded into memory. The file
+        is rewound afterwards. """
+    checksum = hashlib.new(ALGORITHM)
+    for chunk in file.chunks(chunk_size):
+        checksum.update(chunk)
+    file.seek(0)
+    return checksum.hexdigest()
+
+
+def get_stored_checksum(storage, name, chunk_size=CHUNK_SIZE):
+    """ Returns a ``(checksum, size)`` tuple for the file ``name`` in
+        ``storage``, or ``None`` if it cannot be read. """
+    checksum = hashlib.new(ALGORITHM)
+    size = 0
+    try:
+        f = storage.open(name, 'rb')
+    except EnvironmentError:
+        return None
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            checksum.update(chunk)
+            size += len(chunk)
+    except EnvironmentError:
+        return None
+    finally:
+        f.close()
+    return checksum.hexdigest(), size
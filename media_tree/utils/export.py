@@ -0,0 +1,124 @@
+""" Exports node metadata as CSV or JSON Lines.
+
+    Rows are fetched in batches of plain value dictionaries using keyset
+    pagination on the tree ordering, and the path of each node is compiled
+    from a stack of ancestor names while iterating. Since neither model
+    instances nor the complete result set are ever held in memory, memory
+    usage is independent of the number of exported nodes. """
+
+from media_tree.models import FileNode
+from media_tree.models.mixins import MetadataMixin
+from media_tree.utils.filenode import get_selection_ranges
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.datastructures import SortedDict
+import csv
+import json
+
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+FILE_FIELDS = ('file', 'size', 'width', 'height', 'mimetype')
+
+BATCH_SIZE = 2000
+
+
+def get_export_fields(model=FileNode):
+    """ Returns the names of all exported columns, starting with ``id`` and
+        ``path``, followed by file information and all metadata fields that
+        the model defines. Foreign keys are exported as their raw value. """
+    metadata_fields = [field.name for field in MetadataMixin._meta.local_fields]
+    columns = ['id', 'path']
+    for field in model._meta.fields:
+        if field.name in FILE_FIELDS or field.name in metadata_fields:
+            columns.append(field.attname)
+    return columns
+
+
+def get_ancestor_names(tree_id, lft, rght):
+    return list(FileNode.objects.filter(tree_id=tree_id, lft__lt=lft,
+        rght__gt=rght).order_by('lft').values_list('name', flat=True))
+
+
+def iter_values(queryset, fields, batch_size=BATCH_SIZE):
+    """ Yields a value dictionary for each node in ``queryset``, ordered by
+        tree. Rows are fetched in batches, each batch starting after the
+        last row of the previous one instead of using an offset, so that
+        every query is equally fast regardless of the position in the
+        tree. """
+    fields = list(fields) + ['tree_id', 'lft', 'level']
+    queryset = queryset.order_by('tree_id', 'lft')
+    last = None
+    while True:
+        batch = queryset
+        if last:
+            batch = batch.filter(Q(tree_id__gt=last['tree_id'])
+                | Q(tree_id=last['tree_id'], lft__gt=last['lft']))
+        rows = list(batch.values(*fields)[:batch_size])
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            break
+        last = rows[-1]
+
+
+def iter_export_rows(queryset, batch_size=BATCH_SIZE):
+    """ Yields a value dictionary containing all export fields for each
+        node in ``queryset`` and all of their descendants. """
+    columns = get_export_fields()
+    fields = [column for column in columns if column != 'path'] + ['name']
+    for tree_id, lft, rght, level in get_selection_ranges(queryset):
+        path_stack = get_ancestor_names(tree_id, lft, rght)
+        nodes = FileNode.objects.filter(tree_id=tree_id, lft__gte=lft,
+                                        lft__lte=rght)
+        for row in iter_values(nodes, fields, batch_size):
+            path_stack[row['level']:] = [row['name'] or '']
+            row['path'] = '/'.join(path_stack)
+            yield SortedDict([(column, row[column]) for column in columns])
+
+
+class Echo(object):
+    """ A file-like object that returns written values instead of buffering
+        them, so that ``csv.writer`` can be used for streaming. """
+
+    def write(self, value):
+        return value
+
+
+def encode_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def export_csv(rows, columns=None):
+    writer = csv.writer(Echo())
+    columns = columns or get_export_fields()
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([encode_csv_value(row[column])
+                               for column in columns])
+
+
+def export_jsonl(rows, columns=None):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_metadata(queryset, format='csv', batch_size=BATCH_SIZE):
+    """ Returns a generator yielding the export of all nodes in
+        ``queryset`` and their descendants, line by line, in the requested
+        format, which is either ``'csv'`` or ``'jsonl'``. """
+    if not format in EXPORT_FORMATS:
+        raise ValueError('Unsupported export format: %s' % format)
+    rows = iter_export_rows(queryset, batch_size)
+    if format == 'csv':
+        return export_csv(rows)
+    return export_jsonl(rows)
@@ -187,3 +187,16 @@ def get_file_link(node, use_metadata=False, include_size=False, include_extensio
             link_class, icon, link_text, extra)
 
     return force_unicode(mark_safe(link))
+
+
+def get_selection_ranges(queryset):
+    """ Returns a list of ``(tree_id, lft, rght, level)`` tuples, one for
+        each selected node that is not a descendant of another selected
+        node. """
+    ranges = []
+    for tree_id, lft, rght, level in queryset.order_by('tree_id', 'lft') \
+        .values_list('tree_id', 'lft', 'rght', 'level'):
+        if ranges and ranges[-1][0] == tree_id and rght < ranges[-1][2]:
+            continue
+        ranges.append((tree_id, lft, rght, level))
+    return ranges
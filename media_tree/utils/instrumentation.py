@@ -0,0 +1,147 @@
+""" Optional per-request instrumentation of the performance-critical parts of
+    ``media_tree``, such as SQL queries, template rendering, thumbnail
+    generation and storage access.
+
+    Instrumentation is disabled unless ``MEDIA_TREE_INSTRUMENTATION`` is set,
+    in which case :class:`media_tree.middleware.InstrumentationMiddleware`
+    starts collecting metrics for each request handled by a ``media_tree``
+    view. While no request is being instrumented, :func:`timed` and
+    :func:`incr` return immediately, so they can safely be used in hot
+    spots. """
+
+from media_tree import settings as app_settings
+from django.utils.datastructures import SortedDict
+from functools import wraps
+import logging
+import time
+
+try:
+    from threading import local
+except ImportError:
+    from django.utils._threading_local import local
+
+
+logger = logging.getLogger('media_tree.instrumentation')
+
+_thread_locals = local()
+
+STORAGE_METHODS = ('open', 'save', 'delete', 'exists', 'listdir', 'size',
+                   'accessed_time', 'created_time', 'modified_time')
+
+
+class Metrics(object):
+    """ Collects counters and timings (in seconds) for a single request. """
+
+    def __init__(self):
+        self.counters = SortedDict()
+        self.timings = SortedDict()
+        self.started = time.time()
+
+    def incr(self, name, count=1):
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def add_time(self, name, seconds, count=1):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+        self.incr(name, count)
+
+    def as_dict(self):
+        data = SortedDict()
+        data['total_time'] = time.time() - self.started
+        for name, count in self.counters.items():
+            data['%s_count' % name if name in self.timings else name] = count
+        for name, seconds in self.timings.items():
+            data['%s_time' % name] = seconds
+        return data
+
+    def format(self):
+        """ Returns all metrics as a string of ``key=value`` pairs, times
+            being formatted in milliseconds. """
+        items = []
+        for key, value in self.as_dict().items():
+            if key.endswith('_time'):
+                value = '%.1fms' % (value * 1000)
+            items.append('%s=%s' % (key, value))
+        return ' '.join(items)
+
+
+def start():
+    _thread_locals.metrics = Metrics()
+    return _thread_locals.metrics
+
+
+def stop():
+    metrics = get_current_metrics()
+    _thread_locals.metrics = None
+    return metrics
+
+
+def get_current_metrics():
+    return getattr(_thread_locals, 'metrics', None)
+
+
+def incr(name, count=1):
+    metrics = get_current_metrics()
+    if metrics:
+        metrics.incr(name, count)
+
+
+class timed(object):
+    """ Measures the time spent in a block of code or a function, adding it
+        to the current request's metrics under ``name``. Can be used as a
+        context manager::
+
+            with timed('template_render'):
+                ...
+
+        or as a decorator::
+
+            @timed('pre_save')
+            def pre_save(self):
+                ...
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.metrics = None
+
+    def __enter__(self):
+        self.metrics = get_current_metrics()
+        if self.metrics:
+            self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.metrics:
+            self.metrics.add_time(self.name, time.time() - self.started)
+            self.metrics = None
+
+    def __call__(self, func):
+        name = self.name
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def instrument_storage(storage):
+    """ Wraps the I/O methods of a storage instance so that each call is
+        counted and timed as ``storage_<method>``. """
+    for method_name in STORAGE_METHODS:
+        method = getattr(storage, method_name, None)
+        if method:
+            setattr(storage, method_name,
+                    timed('storage_%s' % method_name)(method))
+    return storage
+
+
+def get_metrics_sinks():
+    from media_tree.utils import get_module_attr
+    return [get_module_attr(path)
+            for path in app_settings.MEDIA_TREE_METRICS_SINKS]
+
+
+def log_sink(request, metrics):
+    """ The default metrics sink, which logs the metrics of each request to
+        the ``media_tree.instrumentation`` logger. """
+    logger.info('%s %s %s', request.method, request.path, metrics.format())
@@ -0,0 +1,53 @@
+""" Signed URLs for thumbnails that are generated on first request by
+    :class:`media_tree.contrib.views.thumbnail.ThumbnailView`, instead of
+    while a page is rendered (see ``MEDIA_TREE_LAZY_THUMBNAILS``).
+
+    A URL contains the primary key of the node, the node's modification
+    date and the thumbnail options, signed with the ``SECRET_KEY`` so that
+    visitors cannot request arbitrary thumbnails. Since the modification date
+    is included, the URL of a thumbnail changes whenever its node is changed,
+    and thumbnails can be cached by browsers indefinitely. """
+
+from media_tree.models import FileNode
+from media_tree.utils.thumbnail_cache import get_source_stamp
+from django.core import signing
+from django.core.urlresolvers import reverse, NoReverseMatch
+
+
+SALT = 'media_tree.thumbnail'
+URL_NAME = 'media_tree_thumbnail'
+
+
+def get_thumbnail_token(source, options):
+    """ Returns a signed token identifying a thumbnail of ``source``, or
+        ``None`` if ``source`` is not the file of a saved ``FileNode``. """
+    instance = getattr(source, 'instance', None)
+    if not isinstance(instance, FileNode) or not instance.pk:
+        return None
+    try:
+        return signing.dumps([instance.pk, get_source_stamp(source), options],
+                             salt=SALT, compress=True)
+    except TypeError:
+        # Options that cannot be serialized
+        return None
+
+
+def load_thumbnail_token(token):
+    """ Returns a ``(node_pk, options)`` tuple for a token created by
+        :func:`get_thumbnail_token`. Raises ``signing.BadSignature`` if the
+        token is invalid. """
+    pk, stamp, options = signing.loads(token, salt=SALT)
+    options = dict([(str(key), tuple(value) if isinstance(value, list)
+                     else value) for key, value in options.items()])
+    return pk, options
+
+
+def get_thumbnail_url(source, options):
+    """ Returns the URL of the view generating a thumbnail of ``source``, or
+        ``None`` if there is no such URL. """
+    token = get_thumbnail_token(source, options)
+    if token:
+        try:
+            return reverse(URL_NAME, args=[token])
+        except NoReverseMatch:
+            pass
@@ -1,16 +1,31 @@
 from media_tree.utils import get_media_storage
-from media_tree.media_backends import get_media_backend
+from media_tree.media_backends import get_backend_registry
 from media_tree.models import FileNode
+from media_tree.utils.manifest import get_storage_manifest, scandir
+from media_tree.utils.storage_probe import exists_many, stat_many
+from media_tree.utils import thumbnail_cache
 from media_tree import settings as app_settings
+from django.utils.encoding import force_unicode
 from unicodedata import normalize
 import os
+import time
+
+
+def get_cache_paths():
+    """ Returns the cache directories of all configured media backends. """
+    paths = []
+    for backend in get_backend_registry().get_all():
+        for path in backend.get_cache_paths():
+            if not path in paths:
+                paths.append(path)
+    return paths
 
 
 def get_cache_files():
     storage = get_media_storage()
     cache_files = []
 
-    for cache_dir in get_media_backend().get_cache_paths():
+    for cache_dir in get_cache_paths():
         if storage.exists(cache_dir):
             files_in_dir = [storage.path(os.path.join(cache_dir, filename))  \
                 for filename in storage.listdir(cache_dir)[1]]
@@ -23,32 +38,176 @@ def get_cache_files():
     return cache_files
 
 
-def get_broken_media():
+def get_cache_file_stats(storage=None):
+    """ Returns a list of ``(name, size, last_used)`` tuples for all cache
+        files, ``last_used`` being the Unix timestamp of the last access to
+        the file, or of its last modification if the storage does not track
+        access times. """
+    storage = storage or get_media_storage()
+    stats = []
+    for cache_dir in get_cache_paths():
+        try:
+            local_path = storage.path(cache_dir)
+        except NotImplementedError:
+            local_path = None
+        if local_path and scandir:
+            if not os.path.isdir(local_path):
+                continue
+            for entry in scandir(local_path):
+                if entry.is_file():
+                    stat = entry.stat()
+                    stats.append((os.path.join(cache_dir, entry.name),
+                        stat.st_size, max(stat.st_atime, stat.st_mtime)))
+        elif storage.exists(cache_dir):
+            names = [os.path.join(cache_dir, filename)
+                     for filename in storage.listdir(cache_dir)[1]]
+            for name, stat in stat_many(storage, names).items():
+                if stat:
+                    size, mtime, atime = stat
+                    stats.append((name, size, max(atime or 0, mtime or 0)))
+    return stats
+
+
+def evict_cache_files(max_size=None, max_age=None, dry_run=False):
+    """ Deletes the cache files that have not been used for ``max_age``
+        seconds, and then the least recently used ones until the total size
+        of all cache files is at most ``max_size`` bytes. Returns a tuple
+        containing the list of deleted files, the number of bytes freed and
+        the remaining size of the cache. If ``dry_run`` is ``True``, no files
+        are deleted. """
     storage = get_media_storage()
-    media_subdir = app_settings.MEDIA_TREE_UPLOAD_SUBDIR
-    broken_nodes = []
-    orphaned_files = []
-
-    files_in_db = []
-    for node in FileNode.objects.filter(node_type=FileNode.FILE):
-        path = node.file.path
-        # need to normalize unicode path due to https://code.djangoproject.com/ticket/16315
-        path = normalize('NFC', path)
-        files_in_db.append(path)
-        if not storage.exists(node.file):
-            broken_nodes.append(node)
-
-    files_in_storage = [storage.path(os.path.join(media_subdir, filename))  \
-        for filename in storage.listdir(media_subdir)[1]]
-
-    for file_path in files_in_storage:
-        # need to normalize unicode path due to https://code.djangoproject.com/ticket/16315
-        file_path = normalize('NFC', file_path)
-        if not file_path in files_in_db:
-            storage_name = os.path.join(media_subdir, os.path.basename(file_path))
-            orphaned_files.append(storage_name)
-
-    return [broken_nodes, orphaned_files]
+    stats = sorted(get_cache_file_stats(storage), key=lambda stat: stat[2])
+    cache_size = sum([size for name, size, last_used in stats])
+    min_last_used = time.time() - max_age if max_age else None
+
+    evicted = []
+    freed = 0
+    for name, size, last_used in stats:
+        expired = min_last_used is not None and last_used < min_last_used
+        if not expired and (max_size is None or cache_size <= max_size):
+            # All remaining files were used more recently
+            break
+        if not dry_run:
+            storage.delete(name)
+        evicted.append(name)
+        freed += size
+        cache_size -= size
+
+    if evicted and not dry_run:
+        forget_cache_files(evicted)
+    return evicted, freed, cache_size
+
+
+def forget_cache_files(names):
+    """ Removes the records of the deleted cache files ``names`` kept by the
+        media backends, and invalidates the cached thumbnails of their
+        sources, or all cached thumbnails if the sources are not known. """
+    names = list(names)
+    sources = set()
+    for backend in get_backend_registry().get_all():
+        backend_sources = backend.delete_thumbnail_records(names)
+        if backend_sources is None:
+            sources = None
+        elif sources is not None:
+            sources.update(backend_sources)
+    if sources is None:
+        thumbnail_cache.invalidate()
+    else:
+        thumbnail_cache.invalidate_sources(sources)
+
+
+def iter_storage_files(storage, path, manifest=None, rescan=False):
+    """ Yields the names of all files in the directory ``path`` of
+        ``storage``. For local storages, the directory is looked up in
+        ``manifest`` if given (see :class:`StorageManifest`), or read using
+        ``scandir`` if available, which avoids a ``stat`` call per entry. """
+    try:
+        local_path = storage.path(path)
+    except NotImplementedError:
+        local_path = None
+    if local_path and manifest:
+        if os.path.isdir(local_path):
+            for filename in manifest.get_files(local_path, rescan):
+                yield filename
+    elif local_path and scandir:
+        if os.path.isdir(local_path):
+            for entry in scandir(local_path):
+                if entry.is_file():
+                    yield entry.name
+    elif storage.exists(path):
+        for filename in storage.listdir(path)[1]:
+            yield filename
+
+
+def normalize_name(name):
+    # need to normalize unicode path due to https://code.djangoproject.com/ticket/16315
+    return normalize('NFC', force_unicode(name))
+
+
+def reconcile_media(storage=None, rescan=False):
+    """ Compares the files of all nodes with the files in the upload
+        directory in a single pass over each, and returns a tuple containing
+        a list of the primary keys of nodes whose file does not exist, and a
+        sorted list of the storage names of files that do not belong to any
+        node.
+
+        Memory use is bounded by the size of the upload directory listing,
+        since nodes are streamed from the database. Only files of nodes
+        outside of the upload directory are checked individually, using
+        :func:`media_tree.utils.storage_probe.exists_many`.
+
+        If ``MEDIA_TREE_STORAGE_MANIFEST`` is set, the upload directory is
+        only listed if it changed since the last run, or if ``rescan`` is
+        ``True``. """
+    storage = storage or get_media_storage()
+    media_subdir = os.path.normpath(app_settings.MEDIA_TREE_UPLOAD_SUBDIR)
+    manifest = get_storage_manifest()
+
+    # Maps each file in the upload directory to whether it is referenced
+    referenced = dict.fromkeys([normalize_name(os.path.join(media_subdir,
+        filename)) for filename in iter_storage_files(storage, media_subdir,
+        manifest, rescan)], False)
+    if manifest:
+        manifest.save()
+
+    broken_pks = []
+    # Files outside of the upload directory, which are probed in batches
+    unlisted = []
+    for pk, name in FileNode.objects.filter(node_type=FileNode.FILE) \
+        .order_by().values_list('pk', 'file').iterator():
+        if not name:
+            broken_pks.append(pk)
+            continue
+        name = normalize_name(name)
+        if name in referenced:
+            referenced[name] = True
+        elif os.path.dirname(name) == media_subdir:
+            broken_pks.append(pk)
+        else:
+            unlisted.append((pk, name))
+
+    if unlisted:
+        exists = exists_many(storage, set([name for pk, name in unlisted]))
+        broken_pks.extend([pk for pk, name in unlisted if not exists[name]])
+
+    orphaned_files = sorted([name for name, is_referenced
+                             in referenced.iteritems() if not is_referenced])
+    return broken_pks, orphaned_files
+
+
+def get_nodes(pks, batch_size=500):
+    """ Returns the nodes with the given primary keys, fetched in batches. """
+    nodes = []
+    for index in range(0, len(pks), batch_size):
+        batch = FileNode.objects.in_bulk(pks[index:index + batch_size])
+        nodes.extend([batch[pk] for pk in pks[index:index + batch_size]
+                      if pk in batch])
+    return nodes
+
+
+def get_broken_media():
+    broken_pks, orphaned_files = reconcile_media()
+    return [get_nodes(broken_pks), orphaned_files]
 
 
 def get_orphaned_files():
@@ -0,0 +1,217 @@
+""" Running the maintenance tasks of the admin, such as finding and deleting
+    orphaned files, in the background (see :class:`MaintenanceJob`).
+
+    By default, jobs run in a thread of the process that started them, as
+    configured by ``MEDIA_TREE_MAINTENANCE_JOB_THREADS``. Otherwise, they
+    remain pending until the ``mediajobs`` management command runs them.
+    Progress is written to the database after each chunk of files, so that
+    the admin can display it while the job is running.
+
+    While a job runs, a thread sends a heartbeat every
+    ``HEARTBEAT_INTERVAL`` seconds. Jobs whose heartbeat stops for
+    ``MEDIA_TREE_MAINTENANCE_JOB_TIMEOUT`` seconds are run again. """
+
+from media_tree import settings as app_settings
+from media_tree.models import MaintenanceJob, MaintenanceJobItem
+from media_tree.utils import get_media_storage
+from media_tree.utils.maintenance import reconcile_media, get_nodes, \
+    get_cache_files, forget_cache_files
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.encoding import force_unicode
+from datetime import timedelta
+from threading import Event, Thread
+import logging
+import traceback
+
+
+logger = logging.getLogger('media_tree')
+
+CHUNK_SIZE = 500
+
+HEARTBEAT_INTERVAL = 30
+
+
+def update_job(job, **kwargs):
+    for key, value in kwargs.items():
+        setattr(job, key, value)
+    MaintenanceJob.objects.filter(pk=job.pk).update(**kwargs)
+
+
+def get_runnable_q():
+    """ Returns a ``Q`` object matching jobs that are pending, or whose
+        process has been interrupted. """
+    cutoff = timezone.now() - timedelta(
+        seconds=app_settings.MEDIA_TREE_MAINTENANCE_JOB_TIMEOUT)
+    return Q(status=MaintenanceJob.PENDING) \
+        | Q(status=MaintenanceJob.RUNNING, heartbeat__lt=cutoff)
+
+
+class Heartbeat(Thread):
+    """ Updates the heartbeat of the running job with primary key ``pk``
+        until :meth:`stop` is called. """
+
+    def __init__(self, pk):
+        super(Heartbeat, self).__init__()
+        self.daemon = True
+        self.pk = pk
+        self.stopped = Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(HEARTBEAT_INTERVAL):
+                MaintenanceJob.objects.filter(pk=self.pk,
+                    status=MaintenanceJob.RUNNING).update(
+                    heartbeat=timezone.now())
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def find_files(job):
+    max_length = MaintenanceJobItem._meta.get_field('name').max_length
+    if job.kind == MaintenanceJob.ORPHANED_FILES:
+        broken_pks, names = reconcile_media()
+        # Nodes with missing files are only reported, not deleted
+        items = [MaintenanceJobItem(job=job,
+                                    name=node.file.name[:max_length],
+                                    node=node)
+                 for node in get_nodes(broken_pks)]
+    else:
+        names = get_cache_files()
+        items = []
+    # Remove the items of an interrupted run
+    job.items.all().delete()
+    for name in names:
+        # Truncated names could refer to other files when deleting
+        if len(name) > max_length:
+            logger.warning('Skipping file with a name longer than %i '
+                           'characters: %s', max_length, name)
+            continue
+        items.append(MaintenanceJobItem(job=job, name=name))
+    update_job(job, total=len(items))
+    for index in range(0, len(items), CHUNK_SIZE):
+        MaintenanceJobItem.objects.bulk_create(
+            items[index:index + CHUNK_SIZE])
+        update_job(job, processed=min(index + CHUNK_SIZE, len(items)))
+
+
+def delete_files(job):
+    storage = get_media_storage()
+    items = job.items.filter(selected=True, deleted=False, node=None)
+    update_job(job, total=items.count())
+    after = 0
+    while True:
+        chunk = list(items.filter(pk__gt=after).order_by('pk')
+                     .values_list('pk', 'name')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        deleted = []
+        for pk, name in chunk:
+            try:
+                storage.delete(name)
+                deleted.append((pk, name))
+            except EnvironmentError as e:
+                job.items.filter(pk=pk).update(
+                    error=force_unicode(e)[:255])
+        if deleted:
+            job.items.filter(pk__in=[pk for pk, name in deleted]).update(
+                deleted=True, selected=False)
+            if job.kind == MaintenanceJob.CACHE_FILES:
+                forget_cache_files([name for pk, name in deleted])
+        after = chunk[-1][0]
+        update_job(job, processed=job.processed + len(chunk))
+
+
+def run_job(pk):
+    """ Runs the current phase of the job with primary key ``pk``, unless it
+        is neither pending nor interrupted (for instance, because another
+        process already started it). """
+    now = timezone.now()
+    claimed = MaintenanceJob.objects.filter(get_runnable_q(), pk=pk).update(
+        status=MaintenanceJob.RUNNING, started=now, heartbeat=now,
+        processed=0, total=None, error='')
+    if not claimed:
+        return
+    job = MaintenanceJob.objects.get(pk=pk)
+    heartbeat = Heartbeat(pk)
+    heartbeat.start()
+    try:
+        if job.phase == MaintenanceJob.FIND:
+            find_files(job)
+        else:
+            delete_files(job)
+    except Exception:
+        logger.exception('Maintenance job %i failed', pk)
+        update_job(job, status=MaintenanceJob.FAILED,
+                   error=traceback.format_exc(), finished=timezone.now())
+    else:
+        update_job(job, status=MaintenanceJob.DONE, finished=timezone.now())
+    finally:
+        heartbeat.stop()
+
+
+def _run_job_in_thread(pk):
+    try:
+        run_job(pk)
+    finally:
+        connection.close()
+
+
+def start_job(job):
+    """ Starts running ``job`` in a background thread if
+        ``MEDIA_TREE_MAINTENANCE_JOB_THREADS`` is enabled. """
+    if app_settings.MEDIA_TREE_MAINTENANCE_JOB_THREADS:
+        thread = Thread(target=_run_job_in_thread, args=(job.pk,))
+        thread.daemon = True
+        thread.start()
+
+
+def create_job(kind, user=None):
+    """ Creates and starts a job finding files of the given kind. """
+    job = MaintenanceJob.objects.create(kind=kind,
+        user=user if user and user.is_authenticated() else None)
+    start_job(job)
+    return job
+
+
+def delete_selected_files(job, item_pks=None):
+    """ Selects the items of ``job`` with the given primary keys, or all of
+        its items if ``item_pks`` is ``None``, and starts deleting their
+        files. Returns the number of selected items, which is 0 if the job
+        is still active. """
+    items = job.items.filter(node=None, deleted=False)
+    if item_pks is not None:
+        items = items.filter(pk__in=item_pks)
+    values = {'phase': MaintenanceJob.DELETE,
+              'status': MaintenanceJob.PENDING, 'processed': 0}
+    with transaction.commit_on_success():
+        count = items.count()
+        if not count:
+            return 0
+        values['total'] = count
+        # The job is only claimed if no other request or process did
+        claimed = MaintenanceJob.objects.filter(pk=job.pk).exclude(
+            status__in=(MaintenanceJob.PENDING, MaintenanceJob.RUNNING)) \
+            .update(**values)
+        if not claimed:
+            return 0
+        items.update(selected=True)
+    for key, value in values.items():
+        setattr(job, key, value)
+    start_job(job)
+    return count
+
+
+def run_pending_jobs():
+    """ Runs all pending or interrupted jobs, and returns the number of jobs
+        run. """
+    pks = list(MaintenanceJob.objects.filter(get_runnable_q())
+               .order_by('pk').values_list('pk', flat=True))
+    for pk in pks:
+        run_job(pk)
+    return len(pks)
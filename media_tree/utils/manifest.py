@@ -0,0 +1,108 @@
+""" A persistent record of the files in local storage directories, which
+    allows maintenance tasks such as finding orphaned files to skip listing
+    directories that have not changed since the previous run (see
+    ``MEDIA_TREE_STORAGE_MANIFEST``).
+
+    For each directory, the manifest stores the modification time of the
+    directory and the size and modification time of each file in it. Since
+    adding, removing or renaming a file changes the modification time of its
+    directory, a directory whose modification time is unchanged can be
+    assumed to contain the same files. Note that this is not true for changes
+    to the contents of a file, so sizes and modification times in an
+    unchanged directory reflect the state of the last scan. """
+
+from media_tree import settings as app_settings
+from django.utils.encoding import force_unicode
+import json
+import logging
+import os
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+logger = logging.getLogger('media_tree')
+
+
+# Directories modified less than this number of seconds before they are
+# scanned are not trusted, since files may be added within the resolution of
+# the file system's timestamps without changing the directory's mtime.
+MTIME_RESOLUTION = 2
+
+
+def iter_directory(path):
+    """ Yields a ``(name, size, mtime)`` tuple for each file in the local
+        directory ``path``. """
+    if scandir:
+        for entry in scandir(path):
+            if entry.is_file():
+                stat = entry.stat()
+                yield entry.name, stat.st_size, stat.st_mtime
+    else:
+        for name in os.listdir(path):
+            file_path = os.path.join(path, name)
+            if os.path.isfile(file_path):
+                stat = os.stat(file_path)
+                yield name, stat.st_size, stat.st_mtime
+
+
+class StorageManifest(object):
+    """ The manifest stored in the JSON file ``path``. Call :func:`save`
+        after scanning to persist any changes. """
+
+    def __init__(self, path):
+        self.path = path
+        self.directories = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                self.directories = json.load(f)
+        except (IOError, ValueError) as e:
+            logger.warning('Ignoring unreadable storage manifest %s: %s',
+                           self.path, e)
+
+    def save(self):
+        if not self.changed:
+            return
+        temp_path = '%s.tmp' % self.path
+        with open(temp_path, 'wb') as f:
+            json.dump(self.directories, f, separators=(',', ':'))
+        os.rename(temp_path, self.path)
+        self.changed = False
+
+    def get_files(self, path, rescan=False):
+        """ Returns a dictionary mapping the names of the files in the local
+            directory ``path`` to ``[size, mtime]`` lists. The directory is
+            only listed if it changed since it was last scanned, or if
+            ``rescan`` is ``True``. """
+        key = force_unicode(path)
+        mtime = os.stat(path).st_mtime
+        entry = self.directories.get(key)
+        if not rescan and entry and entry['mtime'] == mtime:
+            return entry['files']
+        files = dict([(force_unicode(name), [size, file_mtime])
+                      for name, size, file_mtime in iter_directory(path)])
+        if time.time() - mtime < MTIME_RESOLUTION:
+            # Force the next scan to list the directory again
+            mtime = None
+        self.directories[key] = {'mtime': mtime, 'files': files}
+        self.changed = True
+        return files
+
+
+def get_storage_manifest():
+    """ Returns the manifest configured by ``MEDIA_TREE_STORAGE_MANIFEST``,
+        or ``None`` if there is none. """
+    if app_settings.MEDIA_TREE_STORAGE_MANIFEST:
+        return StorageManifest(app_settings.MEDIA_TREE_STORAGE_MANIFEST)
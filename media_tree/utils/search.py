@@ -0,0 +1,376 @@
+""" Full-text search index for ``FileNode`` metadata.
+
+    The index stores the fields configured in
+    ``MEDIA_TREE_SEARCH_INDEX_FIELDS`` and is queried instead of running
+    ``icontains`` lookups over the whole ``FileNode`` table. Depending on the
+    database, one of the following engines is used:
+
+    * SQLite with the FTS5 extension: a virtual table ranked by ``bm25()``
+    * PostgreSQL: a ``tsvector`` table with a GIN index, ranked by
+      ``ts_rank()``
+    * any other database: the portable :class:`SearchTerm` table, which is
+      queried by indexed term prefixes and ranked by summed field weights
+
+    Search terms are matched as prefixes, and all terms of a query need to
+    match for a node to be returned.
+
+    The engine is chosen once per process for the default database
+    connection, which the index is always read from and written to. Storing
+    nodes in several databases is therefore not supported. """
+
+import re
+from unicodedata import combining, normalize
+
+from django.db import connection, transaction, DatabaseError
+from django.utils.encoding import force_unicode
+
+from media_tree import settings as app_settings
+from media_tree.models import FileNode, SearchTerm
+
+
+RE_TERM = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 64
+INDEX_BATCH_SIZE = 500
+
+
+def tokenize(text):
+    """ Splits a string into lowercase terms without diacritics. """
+    if not text:
+        return []
+    text = normalize('NFKD', force_unicode(text).lower())
+    text = u''.join([char for char in text if not combining(char)])
+    return [term[:MAX_TERM_LENGTH] for term in RE_TERM.findall(text)]
+
+
+def get_index_fields():
+    """ Returns a list of ``(field_name, weight)`` tuples for all configured
+        fields that exist on the ``FileNode`` model. """
+    field_names = set([field.name for field in FileNode._meta.fields])
+    return [(name, weight) for name, weight
+            in app_settings.MEDIA_TREE_SEARCH_INDEX_FIELDS.items()
+            if name in field_names]
+
+
+def get_row(node):
+    row = {'pk': node.pk}
+    for name, weight in get_index_fields():
+        row[name] = getattr(node, name)
+    return row
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+class SearchEngine(object):
+    """ Base class for search index implementations. Rows passed to
+        :func:`index` are dictionaries containing the node's ``pk`` and the
+        values of all index fields. """
+
+    @classmethod
+    def is_available(cls):
+        return False
+
+    @classmethod
+    def index(cls, rows):
+        raise NotImplementedError
+
+    @classmethod
+    def unindex(cls, pks):
+        raise NotImplementedError
+
+    @classmethod
+    def clear(cls):
+        raise NotImplementedError
+
+    @classmethod
+    def filter(cls, queryset, terms):
+        """ Returns ``queryset`` restricted to nodes matching all ``terms``,
+            with an extra ``search_rank`` column (higher is better). """
+        raise NotImplementedError
+
+    @staticmethod
+    def node_pk_column(queryset):
+        opts = queryset.model._meta
+        return '%s.%s' % (qn(opts.db_table), qn(opts.pk.column))
+
+
+class TermSearchEngine(SearchEngine):
+    """ Portable engine storing one :class:`SearchTerm` row per distinct
+        term and node. """
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    @classmethod
+    def index(cls, rows):
+        fields = get_index_fields()
+        terms = []
+        pks = []
+        for row in rows:
+            pks.append(row['pk'])
+            weights = {}
+            for name, weight in fields:
+                for term in set(tokenize(row[name])):
+                    weights[term] = weights.get(term, 0) + weight
+            terms.extend([SearchTerm(node_id=row['pk'], term=term,
+                                     weight=weight)
+                          for term, weight in weights.iteritems()])
+        cls.unindex(pks)
+        SearchTerm.objects.bulk_create(terms)
+
+    @classmethod
+    def unindex(cls, pks):
+        if pks:
+            SearchTerm.objects.filter(node__pk__in=pks).delete()
+
+    @classmethod
+    def clear(cls):
+        SearchTerm.objects.all().delete()
+
+    @staticmethod
+    def like_pattern(term):
+        return connection.ops.prep_for_like_query(term) + '%'
+
+    @classmethod
+    def filter(cls, queryset, terms):
+        for term in terms:
+            matching = SearchTerm.objects.filter(term__startswith=term)
+            queryset = queryset.filter(pk__in=matching.values('node'))
+        # The operator of startswith lookups, which matches the escaping of
+        # prep_for_like_query() on each database
+        like = '%s %s' % (qn('term'), connection.operators['startswith'])
+        rank = ('SELECT COALESCE(SUM(weight), 0) FROM %s WHERE %s = %s '
+                'AND (%s)') % (
+            qn(SearchTerm._meta.db_table),
+            qn(SearchTerm._meta.get_field('node').column),
+            cls.node_pk_column(queryset),
+            ' OR '.join([like] * len(terms)))
+        return queryset.extra(
+            select={'search_rank': rank},
+            select_params=[cls.like_pattern(term) for term in terms])
+
+
+class TableSearchEngine(SearchEngine):
+    """ Base class for engines that store the index in a table that is
+        created on demand, since it cannot be expressed as a model. """
+
+    vendor = None
+    table = None
+
+    _table_exists = None
+
+    @classmethod
+    def create_table(cls, cursor):
+        raise NotImplementedError
+
+    @classmethod
+    def ensure_table(cls):
+        if not cls._table_exists:
+            if not cls.table in connection.introspection.table_names():
+                with transaction.commit_on_success():
+                    cls.create_table(connection.cursor())
+            cls._table_exists = True
+
+    @classmethod
+    def is_available(cls):
+        if connection.vendor != cls.vendor:
+            return False
+        try:
+            cls.ensure_table()
+        except DatabaseError:
+            return False
+        return True
+
+    @classmethod
+    def unindex(cls, pks):
+        if pks:
+            cursor = connection.cursor()
+            cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+                qn(cls.table), cls.key_column, ', '.join(['%s'] * len(pks))),
+                list(pks))
+
+    @classmethod
+    def clear(cls):
+        connection.cursor().execute('DROP TABLE IF EXISTS %s' % qn(cls.table))
+        cls._table_exists = False
+        cls.ensure_table()
+
+
+class SQLiteSearchEngine(TableSearchEngine):
+    """ Engine using an SQLite FTS5 virtual table, whose ``rowid`` is the
+        node's primary key. """
+
+    vendor = 'sqlite'
+    table = 'media_tree_search_fts'
+    key_column = 'rowid'
+
+    @classmethod
+    def create_table(cls, cursor):
+        cursor.execute('CREATE VIRTUAL TABLE %s USING fts5(%s, tokenize='
+                       '"unicode61 remove_diacritics 1")' % (
+                           qn(cls.table), ', '.join(
+                               [qn(name) for name, w in get_index_fields()])))
+
+    @classmethod
+    def index(cls, rows):
+        fields = get_index_fields()
+        rows = list(rows)
+        cls.unindex([row['pk'] for row in rows])
+        connection.cursor().executemany(
+            'INSERT INTO %s (rowid, %s) VALUES (%%s, %s)' % (
+                qn(cls.table),
+                ', '.join([qn(name) for name, weight in fields]),
+                ', '.join(['%s'] * len(fields))),
+            [[row['pk']] + [row[name] or '' for name, weight in fields]
+             for row in rows])
+
+    @classmethod
+    def filter(cls, queryset, terms):
+        match = ' '.join(['"%s"*' % term for term in terms])
+        weights = ', '.join([str(weight) for name, weight
+                             in get_index_fields()])
+        return queryset.extra(
+            tables=[cls.table],
+            where=['%s.rowid = %s' % (qn(cls.table),
+                                      cls.node_pk_column(queryset)),
+                   '%s MATCH %%s' % qn(cls.table)],
+            params=[match],
+            select={'search_rank': '-bm25(%s, %s)' % (qn(cls.table),
+                                                     weights)})
+
+
+class PostgreSQLSearchEngine(TableSearchEngine):
+    """ Engine using a ``tsvector`` column with a GIN index. Field weights
+        are mapped to the PostgreSQL weight classes A to D. """
+
+    vendor = 'postgresql'
+    table = 'media_tree_search_tsv'
+    key_column = 'node_id'
+
+    @classmethod
+    def create_table(cls, cursor):
+        cursor.execute('CREATE TABLE %s (node_id integer PRIMARY KEY, '
+                       'document tsvector NOT NULL)' % qn(cls.table))
+        cursor.execute('CREATE INDEX %s ON %s USING gin(document)' % (
+            qn(cls.table + '_document'), qn(cls.table)))
+
+    @staticmethod
+    def weight_class(weight):
+        return 'ABCD'[max(0, min(3, 4 - weight))]
+
+    @classmethod
+    def index(cls, rows):
+        fields = get_index_fields()
+        rows = list(rows)
+        cls.unindex([row['pk'] for row in rows])
+        document = ' || '.join([
+            "setweight(to_tsvector('simple', %%s), '%s')"
+            % cls.weight_class(weight) for name, weight in fields])
+        connection.cursor().executemany(
+            'INSERT INTO %s (node_id, document) VALUES (%%s, %s)' % (
+                qn(cls.table), document),
+            [[row['pk']] + [' '.join(tokenize(row[name]))
+                            for name, weight in fields]
+             for row in rows])
+
+    @classmethod
+    def filter(cls, queryset, terms):
+        query = ' & '.join(['%s:*' % term for term in terms])
+        return queryset.extra(
+            tables=[cls.table],
+            where=['%s.node_id = %s' % (qn(cls.table),
+                                        cls.node_pk_column(queryset)),
+                   "%s.document @@ to_tsquery('simple', %%s)"
+                   % qn(cls.table)],
+            params=[query],
+            select={'search_rank': "ts_rank(%s.document, "
+                                   "to_tsquery('simple', %%s))"
+                                   % qn(cls.table)},
+            select_params=[query])
+
+
+SEARCH_ENGINES = (SQLiteSearchEngine, PostgreSQLSearchEngine,
+                  TermSearchEngine)
+
+SEARCH_ENGINE = None
+
+
+def get_search_engine():
+    """ Returns the first engine in ``SEARCH_ENGINES`` that is supported by
+        the current database. """
+    global SEARCH_ENGINE
+    if not SEARCH_ENGINE:
+        for engine in SEARCH_ENGINES:
+            if engine.is_available():
+                SEARCH_ENGINE = engine
+                break
+    return SEARCH_ENGINE
+
+
+def index_node(node):
+    """ Adds or updates a single node in the search index. """
+    get_search_engine().index([get_row(node)])
+
+
+def unindex_node(pk):
+    """ Removes a node from the search index. """
+    get_search_engine().unindex([pk])
+
+
+def index_nodes(queryset=None, batch_size=INDEX_BATCH_SIZE):
+    """ Indexes all nodes in ``queryset`` (or all nodes), reading them in
+        batches of ``values()`` rows instead of model instances. Yields the
+        number of nodes indexed after each batch. """
+    if queryset is None:
+        queryset = FileNode.objects.all()
+    engine = get_search_engine()
+    fields = [name for name, weight in get_index_fields()]
+    batch = []
+    count = 0
+    for row in queryset.values('pk', *fields).iterator():
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with transaction.commit_on_success():
+                engine.index(batch)
+            count += len(batch)
+            batch = []
+            yield count
+    if batch:
+        with transaction.commit_on_success():
+            engine.index(batch)
+        count += len(batch)
+        yield count
+
+
+def clear_index():
+    get_search_engine().clear()
+
+
+def filter_subtree(queryset, node, include_self=False):
+    """ Restricts ``queryset`` to the descendants of ``node`` using its
+        ``lft`` / ``rght`` range. """
+    opts = node._mptt_meta
+    lookup = 'e' if include_self else ''
+    return queryset.filter(**{
+        opts.tree_id_attr: getattr(node, opts.tree_id_attr),
+        '%s__gt%s' % (opts.left_attr, lookup): getattr(node, opts.left_attr),
+        '%s__lt%s' % (opts.right_attr, lookup): getattr(node,
+                                                        opts.right_attr)})
+
+
+def search_nodes(queryset, query, subtree=None):
+    """ Returns the nodes in ``queryset`` matching all terms in ``query``,
+        annotated with a ``search_rank`` attribute. You will usually want to
+        order the result by ``-search_rank``. No nodes are returned if the
+        query contains no search terms (see :func:`tokenize`).
+
+        :param subtree: An optional folder node. If passed, only its
+        descendants will be searched. """
+    if subtree is not None and not subtree.is_top_node():
+        queryset = filter_subtree(queryset, subtree)
+    terms = tokenize(query)
+    if not terms:
+        return queryset.none().extra(select={'search_rank': '0'})
+    return get_search_engine().filter(queryset, terms)
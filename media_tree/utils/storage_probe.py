@@ -0,0 +1,97 @@
+""" Batched checks whether files exist in storage, and of their size and
+    modification time, for maintenance tasks that need to check a large
+    number of files.
+
+    On network-backed storages, each call to ``exists()``, ``size()`` or
+    ``modified_time()`` is a round trip, so files are checked by a bounded
+    pool of ``MEDIA_TREE_STORAGE_PROBE_WORKERS`` threads. A storage can
+    also implement the methods ``exists_many(names)`` and
+    ``stat_many(names)``, returning the same dictionaries as
+    :func:`exists_many` and :func:`stat_many`, in order to check a whole
+    batch of files in a single request. """
+
+from media_tree import settings as app_settings
+from multiprocessing.pool import ThreadPool
+import calendar
+import time
+
+
+BATCH_SIZE = 1000
+
+
+def map_concurrently(func, items, workers=None):
+    """ Returns the results of calling ``func`` for each item in ``items``,
+        using a pool of at most ``workers`` threads. """
+    if workers is None:
+        workers = app_settings.MEDIA_TREE_STORAGE_PROBE_WORKERS
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return map(func, items)
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def iter_batches(names, batch_size=BATCH_SIZE):
+    batch = []
+    for name in names:
+        batch.append(name)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def exists_many(storage, names, workers=None):
+    """ Returns a dictionary mapping each of the storage names ``names`` to
+        whether the file exists in ``storage``. """
+    result = {}
+    for batch in iter_batches(names):
+        if hasattr(storage, 'exists_many'):
+            result.update(storage.exists_many(batch))
+        else:
+            result.update(zip(batch,
+                map_concurrently(storage.exists, batch, workers)))
+    return result
+
+
+def get_timestamp(value):
+    if value.tzinfo is None:
+        # Storages return naive datetimes in local time
+        return time.mktime(value.timetuple())
+    return calendar.timegm(value.utctimetuple())
+
+
+def stat(storage, name):
+    """ Returns a ``(size, mtime, atime)`` tuple for the file ``name``, the
+        modification and access times being Unix timestamps or ``None`` if
+        the storage does not provide them, or ``None`` if the file does not
+        exist. """
+    try:
+        size = storage.size(name)
+    except (OSError, IOError):
+        return None
+    times = []
+    for method in (storage.modified_time, storage.accessed_time):
+        try:
+            times.append(get_timestamp(method(name)))
+        except NotImplementedError:
+            times.append(None)
+    return (size,) + tuple(times)
+
+
+def stat_many(storage, names, workers=None):
+    """ Returns a dictionary mapping each of the storage names ``names`` to
+        the result of :func:`stat` for the file. """
+    result = {}
+    for batch in iter_batches(names):
+        if hasattr(storage, 'stat_many'):
+            result.update(storage.stat_many(batch))
+        else:
+            result.update(zip(batch, map_concurrently(
+                lambda name: stat(storage, name), batch, workers)))
+    return result
@@ -0,0 +1,235 @@
+""" A lookup cache for thumbnails that have already been generated, mapping
+    a source file and thumbnail options to the thumbnail's name, URL and
+    dimensions. Media backends consult this cache before checking storage
+    or their own thumbnail databases.
+
+    Lookups go to a small in-process LRU cache first, and then to Django's
+    cache backend. Cache keys include the modification date of the node that
+    a source file belongs to, so that thumbnails are looked up again as soon
+    as a node's file is changed, as well as a generation number that is
+    changed by :func:`invalidate` when all thumbnail files are deleted.
+
+    When only some thumbnail files are deleted, :func:`invalidate_sources`
+    stores the time of deletion for each of their sources, and entries
+    stored before that time are ignored. Entries in the in-process cache are
+    looked up again after ``GENERATION_CHECK_INTERVAL`` seconds, so that
+    other processes notice either kind of invalidation. """
+
+from django.core.cache import cache
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import force_bytes
+from hashlib import md5
+from threading import Lock
+import time
+
+from media_tree import settings as app_settings
+
+
+KEY_PREFIX = 'media_tree:thumbnail:'
+FAILURE_KEY_PREFIX = 'media_tree:thumbnail_failure:'
+SOURCE_KEY_PREFIX = 'media_tree:thumbnail_source:'
+GENERATION_KEY = 'media_tree:thumbnail_generation'
+
+# Number of seconds for which each process uses the generation number and
+# the entries in its LRU cache without checking Django's cache for changes
+GENERATION_CHECK_INTERVAL = 60
+
+
+class LRUCache(object):
+    """ A thread-safe dictionary holding at most ``max_size`` items,
+        discarding the least recently used ones. """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = SortedDict()
+        self.lock = Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.data:
+                    # Move key to the end, marking it as most recently used
+                    found[key] = self.data[key] = self.data.pop(key)
+        return found
+
+    def set_many(self, data):
+        if not self.max_size:
+            return
+        with self.lock:
+            for key, value in data.items():
+                self.data.pop(key, None)
+                self.data[key] = value
+            while len(self.data) > self.max_size:
+                del self.data[self.data.keyOrder[0]]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+local_cache = LRUCache(app_settings.MEDIA_TREE_THUMBNAIL_LRU_SIZE)
+
+_generation = {'value': None, 'checked': 0}
+
+
+def get_generation():
+    now = time.time()
+    if now - _generation['checked'] > GENERATION_CHECK_INTERVAL:
+        _generation['value'] = cache.get(GENERATION_KEY, '')
+        _generation['checked'] = now
+    return _generation['value']
+
+
+def invalidate():
+    """ Invalidates all cached thumbnails, for instance after thumbnail files
+        have been deleted. Other processes notice this within
+        ``GENERATION_CHECK_INTERVAL`` seconds. """
+    generation = repr(time.time())
+    # Entries of the previous generation expire before this key does
+    cache.set(GENERATION_KEY, generation,
+              app_settings.MEDIA_TREE_THUMBNAIL_CACHE_TIMEOUT)
+    _generation['value'] = generation
+    _generation['checked'] = time.time()
+    local_cache.clear()
+
+
+def invalidate_sources(names):
+    """ Invalidates the cached thumbnails of the source files ``names``, for
+        instance after some of their thumbnail files have been deleted. """
+    now = time.time()
+    cache.set_many(dict([(get_source_key(name), now) for name in names]),
+                   app_settings.MEDIA_TREE_THUMBNAIL_CACHE_TIMEOUT)
+    local_cache.clear()
+
+
+def normalize_options(options):
+    """ Returns a string representing ``options`` independently of the
+        order of its keys or the type of the size value. """
+    items = []
+    for key, value in sorted(options.items()):
+        if isinstance(value, (list, tuple)):
+            value = 'x'.join([str(item) for item in value])
+        items.append('%s=%s' % (key, value))
+    return '&'.join(items)
+
+
+def get_source_name(source):
+    return getattr(source, 'name', None) or source
+
+
+def get_source_stamp(source):
+    """ Returns the modification date of the model instance that ``source``
+        belongs to (if any) as a string, without accessing storage. """
+    instance = getattr(source, 'instance', None)
+    modified = getattr(instance, 'modified', None)
+    return modified.isoformat() if modified else ''
+
+
+def get_source_key(source):
+    return SOURCE_KEY_PREFIX + md5(force_bytes(get_source_name(source))) \
+        .hexdigest()
+
+
+def get_options_hash(options):
+    return md5(force_bytes(normalize_options(options))).hexdigest()
+
+
+def get_cache_key(backend, source, options, prefix=KEY_PREFIX):
+    data = u'|'.join([backend.__name__, get_source_name(source),
+                      get_source_stamp(source), get_options_hash(options),
+                      get_generation()])
+    return prefix + md5(data.encode('utf8')).hexdigest()
+
+
+def get_entries(keys, sources):
+    """ Returns a dictionary mapping those of ``keys`` that are cached to
+        their values, where ``sources`` contains the source of each key.
+        Entries are stored as ``(time, value)`` tuples, and those stored
+        before their source was invalidated are left out. """
+    now = time.time()
+    found = dict([(key, entry) for key, entry
+                  in local_cache.get_many(keys).items()
+                  if now - entry[0] < GENERATION_CHECK_INTERVAL])
+    source_keys = dict([(key, get_source_key(source)) for key, source
+                        in zip(keys, sources) if not key in found])
+    if source_keys:
+        shared = cache.get_many(source_keys.keys() + source_keys.values())
+        fetched = {}
+        for key, source_key in source_keys.items():
+            if key in shared and shared[key][0] > shared.get(source_key, 0):
+                fetched[key] = (now, shared[key][1])
+        local_cache.set_many(fetched)
+        found.update(fetched)
+    return dict([(key, entry[1]) for key, entry in found.items()])
+
+
+def set_entries(data):
+    """ Stores the values of the dictionary ``data`` under its keys. """
+    data = dict([(key, (time.time(), value)) for key, value in data.items()])
+    local_cache.set_many(data)
+    cache.set_many(data, app_settings.MEDIA_TREE_THUMBNAIL_CACHE_TIMEOUT)
+
+
+def get_many(backend, sources, options):
+    """ Looks up the thumbnails of all ``sources`` using a single cache
+        request, where ``options`` is a list containing the thumbnail options
+        for each source. Returns a list containing a
+        ``(name, url, width, height)`` tuple for each source found in the
+        cache, and ``None`` for each source that is not. """
+    keys = [get_cache_key(backend, source, source_options)
+            for source, source_options in zip(sources, options)]
+    found = get_entries(keys, sources)
+    return [found.get(key) for key in keys]
+
+
+def set_many(backend, thumbnails):
+    """ Stores a list of ``(source, options, thumbnail)`` tuples, where each
+        thumbnail provides the attributes ``name``, ``url``, ``width`` and
+        ``height``. """
+    data = {}
+    for source, options, thumbnail in thumbnails:
+        data[get_cache_key(backend, source, options)] = (
+            thumbnail.name, thumbnail.url, thumbnail.width, thumbnail.height)
+    if data:
+        set_entries(data)
+
+
+def get_value(backend, source, options):
+    """ Returns the value stored for ``source`` and ``options`` by
+        :func:`set_value`, or ``None``. """
+    key = get_cache_key(backend, source, options)
+    return get_entries([key], [source]).get(key)
+
+
+def set_value(backend, source, options, value):
+    """ Stores an arbitrary value, such as a list of thumbnail tuples, for
+        ``source`` and ``options``. """
+    set_entries({get_cache_key(backend, source, options): value})
+
+
+def get_failures(backend, sources, options):
+    """ Returns a list containing ``True`` for each source for which a
+        failure has been recorded by :func:`set_failures` within the last
+        ``MEDIA_TREE_THUMBNAIL_FAILURE_TIMEOUT`` seconds, where ``options``
+        is a list containing the thumbnail options for each source. """
+    keys = [get_cache_key(backend, source, source_options, FAILURE_KEY_PREFIX)
+            for source, source_options in zip(sources, options)]
+    found = cache.get_many(keys)
+    return [key in found for key in keys]
+
+
+def set_failures(backend, failures):
+    """ Records a list of ``(source, options)`` tuples for which no thumbnail
+        could be created in the negative cache. """
+    data = dict([(get_cache_key(backend, source, options, FAILURE_KEY_PREFIX),
+                  True) for source, options in failures])
+    if data:
+        cache.set_many(data,
+                       app_settings.MEDIA_TREE_THUMBNAIL_FAILURE_TIMEOUT)
+
+
+def delete_failures(backend, failures):
+    cache.delete_many([get_cache_key(backend, source, options,
+                                     FAILURE_KEY_PREFIX)
+                       for source, options in failures])
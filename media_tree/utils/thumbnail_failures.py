@@ -0,0 +1,147 @@
+""" Handling of sources for which media backends fail to create thumbnails,
+    for instance because a file is corrupt or missing.
+
+    * Each failure is stored in the negative thumbnail cache for
+      ``MEDIA_TREE_THUMBNAIL_FAILURE_TIMEOUT`` seconds, during which no
+      further attempts are made for the same source and options.
+    * Each failure is also recorded as a :class:`ThumbnailFailure`, which are
+      listed in the admin, so that persistently failing sources can be fixed.
+    * Each backend has a circuit breaker, which stops all generation attempts
+      for a while when the rate of failures spikes, as configured by
+      ``MEDIA_TREE_THUMBNAIL_CIRCUIT_BREAKER``. """
+
+from media_tree import settings as app_settings
+from media_tree.models import FileNode, ThumbnailFailure
+from media_tree.utils import thumbnail_cache
+from media_tree.utils.instrumentation import incr
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.encoding import force_unicode
+from threading import Lock
+import json
+import logging
+import time
+
+
+logger = logging.getLogger('media_tree.thumbnails')
+
+
+class CircuitBreaker(object):
+    """ Counts the attempts and failures of a backend within a time window,
+        and opens when at least ``min_attempts`` were made and more than
+        ``max_failure_rate`` of them failed. While open, :func:`allow`
+        returns ``False`` for ``cooldown`` seconds, after which counting
+        starts anew. """
+
+    def __init__(self, name, window=60, min_attempts=20, max_failure_rate=.5,
+                 cooldown=60):
+        self.name = name
+        self.window = window
+        self.min_attempts = min_attempts
+        self.max_failure_rate = max_failure_rate
+        self.cooldown = cooldown
+        self.lock = Lock()
+        self.opened = None
+        self.reset()
+
+    def reset(self, now=None):
+        self.started = now or time.time()
+        self.attempts = 0
+        self.failures = 0
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            now = time.time()
+            if now - self.opened < self.cooldown:
+                return False
+            self.opened = None
+            self.reset(now)
+            return True
+
+    def record(self, attempts, failures):
+        with self.lock:
+            now = time.time()
+            if now - self.started > self.window:
+                self.reset(now)
+            self.attempts += attempts
+            self.failures += failures
+            if self.opened is None and self.attempts >= self.min_attempts \
+                and self.failures > self.attempts * self.max_failure_rate:
+                self.opened = now
+                logger.warning('Circuit breaker for %s opened after %i of %i '
+                               'thumbnails failed', self.name, self.failures,
+                               self.attempts)
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = Lock()
+
+
+def get_circuit_breaker(backend):
+    """ Returns the circuit breaker of ``backend``, or ``None`` if circuit
+        breakers are disabled. """
+    options = app_settings.MEDIA_TREE_THUMBNAIL_CIRCUIT_BREAKER
+    if not options:
+        return None
+    with _circuit_breakers_lock:
+        if not backend in _circuit_breakers:
+            _circuit_breakers[backend] = CircuitBreaker(backend.__name__,
+                                                        **options)
+        return _circuit_breakers[backend]
+
+
+def get_backend_path(backend):
+    return '%s.%s' % (backend.__module__, backend.__name__)
+
+
+def record_failures(backend, failures, error=None):
+    """ Stores a list of ``(source, options)`` tuples for which ``backend``
+        could not create a thumbnail in the negative cache, and records them
+        as :class:`ThumbnailFailure` objects. """
+    if not failures:
+        return
+    incr('thumbnail_failures', len(failures))
+    thumbnail_cache.set_failures(backend, failures)
+    backend_path = get_backend_path(backend)
+    now = timezone.now()
+    for source, options in failures:
+        name = force_unicode(thumbnail_cache.get_source_name(source))[:255]
+        options_hash = thumbnail_cache.get_options_hash(options)
+        recorded = ThumbnailFailure.objects.filter(backend=backend_path,
+            name=name, options_hash=options_hash)
+        values = {'count': F('count') + 1, 'last_failed': now,
+                  'error': force_unicode(error or '')}
+        if recorded.update(**values):
+            continue
+        instance = getattr(source, 'instance', None)
+        try:
+            with transaction.commit_on_success():
+                ThumbnailFailure.objects.create(backend=backend_path,
+                    name=name, options_hash=options_hash,
+                    options=json.dumps(options, sort_keys=True)[:255],
+                    error=values['error'],
+                    node=instance if isinstance(instance, FileNode)
+                        and instance.pk else None,
+                    first_failed=now, last_failed=now)
+        except IntegrityError:
+            # Another process recorded the same failure in the meantime
+            recorded.update(**values)
+
+
+def retry_failures(queryset):
+    """ Removes the given :class:`ThumbnailFailure` objects and their
+        negative cache entries, so that their thumbnails are created again
+        on the next request. """
+    from media_tree.utils import get_module_attr
+    for failure in queryset.select_related('node'):
+        try:
+            backend = get_module_attr(failure.backend)
+            options = json.loads(failure.options)
+        except Exception:
+            continue
+        source = failure.node.file if failure.node else failure.name
+        thumbnail_cache.delete_failures(backend, [(source, options)])
+    queryset.delete()
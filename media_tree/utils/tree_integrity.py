@@ -0,0 +1,213 @@
+""" Consistency checks and repair of the MPTT fields (``tree_id``, ``lft``,
+    ``rght`` and ``level``) of the node tree.
+
+    :func:`check_trees` reads all nodes once, ordered by tree and left value,
+    and verifies each tree against the ``parent`` links, which are the
+    authoritative structure. :func:`repair_trees` then recomputes the MPTT
+    fields of the inconsistent trees only, and only updates the nodes whose
+    values are wrong. Since updates are committed in chunks, the table is
+    never locked for as long as a full rebuild would. """
+
+from media_tree.models import FileNode
+from django.db import transaction
+from django.db.models import Max
+
+
+CHUNK_SIZE = 500
+
+
+class TreeCheck(object):
+    """ The result of :func:`check_trees`. Nodes are passed to :func:`add`
+        ordered by ``tree_id`` and ``lft``. """
+
+    def __init__(self):
+        self.nodes = 0
+        self.trees = 0
+        self.invalid_trees = set()
+        """ Tree ids of the trees that need to be repaired """
+        self.extra_roots = []
+        """ Primary keys of root nodes sharing their tree id with another
+            root node, which need to be moved to trees of their own """
+        self.foreign_parents = set()
+        """ Primary keys of the parents of nodes that are not in the tree of
+            their parent """
+        self.tree_id = None
+        self.ancestors = []
+        self.position = 0
+
+    @property
+    def is_valid(self):
+        return not self.invalid_trees and not self.extra_roots
+
+    def close_ancestors(self, left=None):
+        # Right values need to follow the last left or right value when
+        # leaving a subtree
+        while self.ancestors and (left is None or self.ancestors[-1][1] < left):
+            pk, right = self.ancestors.pop()
+            if right != self.position + 1:
+                self.invalid_trees.add(self.tree_id)
+            self.position = right
+
+    def add(self, pk, parent_id, tree_id, left, right, level):
+        self.nodes += 1
+        if tree_id != self.tree_id:
+            self.close_ancestors()
+            self.tree_id = tree_id
+            self.trees += 1
+            self.position = 0
+            if parent_id is not None:
+                # The first node of a tree needs to be its root
+                self.invalid_trees.add(tree_id)
+        elif parent_id is None:
+            self.extra_roots.append(pk)
+            return
+
+        self.close_ancestors(left)
+        parent_pk = self.ancestors[-1][0] if self.ancestors else None
+        if left != self.position + 1 or right <= left \
+            or level != len(self.ancestors):
+            self.invalid_trees.add(tree_id)
+        if parent_id != parent_pk:
+            self.invalid_trees.add(tree_id)
+            if parent_id is not None:
+                self.foreign_parents.add(parent_id)
+        self.position = left
+        self.ancestors.append((pk, right))
+
+    def finish(self):
+        self.close_ancestors()
+        if self.foreign_parents:
+            # A node can only be moved back to the tree of its parent by
+            # repairing that tree
+            opts = FileNode._mptt_meta
+            self.invalid_trees.update(FileNode._tree_manager.filter(
+                pk__in=self.foreign_parents).values_list(opts.tree_id_attr,
+                                                         flat=True))
+
+
+def check_trees():
+    """ Checks all trees in a single pass over the node table and returns a
+        :class:`TreeCheck`. """
+    opts = FileNode._mptt_meta
+    check = TreeCheck()
+    rows = FileNode._tree_manager.order_by(opts.tree_id_attr, opts.left_attr,
+        'pk').values_list('pk', '%s_id' % opts.parent_attr, opts.tree_id_attr,
+        opts.left_attr, opts.right_attr, opts.level_attr).iterator()
+    for row in rows:
+        check.add(*row)
+    check.finish()
+    return check
+
+
+def get_tree_nodes(root_pk):
+    """ Returns a dictionary mapping the primary key of each node reachable
+        from ``root_pk`` via ``parent`` links to the ordered list of its
+        children, and a dictionary of the current MPTT values of each node.
+        Each level of the tree is fetched with one query per chunk. """
+    opts = FileNode._mptt_meta
+    fields = ('pk', '%s_id' % opts.parent_attr, opts.tree_id_attr,
+              opts.left_attr, opts.right_attr, opts.level_attr)
+    ordering = list(opts.order_insertion_by) + [opts.left_attr, 'pk']
+    children = {}
+    values = dict([(row[0], row[2:]) for row in FileNode._tree_manager.filter(
+        pk=root_pk).values_list(*fields)])
+    level_pks = [root_pk]
+    while level_pks:
+        next_level_pks = []
+        for index in range(0, len(level_pks), CHUNK_SIZE):
+            rows = FileNode._tree_manager.filter(**{'%s__in' % opts.parent_attr:
+                level_pks[index:index + CHUNK_SIZE]}).order_by(*ordering) \
+                .values_list(*fields)
+            for row in rows:
+                pk, parent_id = row[:2]
+                if pk in values:
+                    # Guard against cycles
+                    continue
+                values[pk] = row[2:]
+                children.setdefault(parent_id, []).append(pk)
+                next_level_pks.append(pk)
+        level_pks = next_level_pks
+    return children, values
+
+
+def number_tree(root_pk, tree_id, children):
+    """ Yields a ``(pk, (tree_id, lft, rght, level))`` tuple for each node in
+        the tree below ``root_pk``, as a depth-first traversal numbers
+        them. """
+    counter = 1
+    lefts = {root_pk: counter}
+    stack = [(root_pk, 0, iter(children.get(root_pk, ())))]
+    while stack:
+        pk, level, child_pks = stack[-1]
+        child_pk = next(child_pks, None)
+        counter += 1
+        if child_pk is None:
+            stack.pop()
+            yield pk, (tree_id, lefts.pop(pk), counter, level)
+        else:
+            lefts[child_pk] = counter
+            stack.append((child_pk, level + 1,
+                          iter(children.get(child_pk, ()))))
+
+
+def save_tree_values(updates):
+    opts = FileNode._mptt_meta
+    for pk, (tree_id, left, right, level) in updates:
+        FileNode._tree_manager.filter(pk=pk).update(**{
+            opts.tree_id_attr: tree_id, opts.left_attr: left,
+            opts.right_attr: right, opts.level_attr: level})
+
+
+def update_nodes(updates, commit=True):
+    """ Saves a list of ``(pk, (tree_id, lft, rght, level))`` tuples,
+        committing after each chunk, or if ``commit`` is ``False``, leaving
+        it to the caller's transaction. """
+    for index in range(0, len(updates), CHUNK_SIZE):
+        if commit:
+            with transaction.commit_on_success():
+                save_tree_values(updates[index:index + CHUNK_SIZE])
+        else:
+            save_tree_values(updates[index:index + CHUNK_SIZE])
+
+
+def repair_tree(tree_id, commit=True):
+    """ Recomputes the MPTT fields of the tree ``tree_id`` from the
+        ``parent`` links of its nodes, and saves those that changed (see
+        :func:`update_nodes`). Returns the number of nodes in the tree and
+        the number of updated nodes. """
+    opts = FileNode._mptt_meta
+    root_pks = list(FileNode._tree_manager.filter(**{opts.tree_id_attr:
+        tree_id, opts.parent_attr: None}).order_by(opts.left_attr, 'pk')
+        .values_list('pk', flat=True)[:1])
+    if not root_pks:
+        return 0, 0
+    children, values = get_tree_nodes(root_pks[0])
+    updates = [(pk, new_values) for pk, new_values
+               in number_tree(root_pks[0], tree_id, children)
+               if values[pk] != new_values]
+    update_nodes(updates, commit)
+    return len(values), len(updates)
+
+
+def get_new_tree_id():
+    opts = FileNode._mptt_meta
+    max_tree_id = FileNode._tree_manager.aggregate(
+        max_tree_id=Max(opts.tree_id_attr))['max_tree_id']
+    return (max_tree_id or 0) + 1
+
+
+def repair_trees(check):
+    """ Repairs all trees that :func:`check_trees` found to be inconsistent.
+        Yields a ``(tree_id, nodes, updated)`` tuple for each repaired
+        tree. """
+    opts = FileNode._mptt_meta
+    tree_ids = sorted(check.invalid_trees)
+    for pk in check.extra_roots:
+        # Move each surplus root node to a tree of its own
+        tree_id = get_new_tree_id()
+        FileNode._tree_manager.filter(pk=pk).update(
+            **{opts.tree_id_attr: tree_id})
+        tree_ids.append(tree_id)
+    for tree_id in tree_ids:
+        nodes, updated = repair_tree(tree_id)
+        yield tree_id, nodes, updated
@@ -0,0 +1,130 @@
+""" Verification of stored media files against the checksums recorded when
+    they were uploaded, in order to detect files that are missing, truncated
+    or corrupted (see the ``mediaverify`` management command).
+
+    Files are hashed in parallel by worker processes. By default,
+    verification is incremental: files whose size matches the node and that
+    have not been modified since they were last verified are skipped. Since
+    silent corruption of a file does not change its size or modification
+    time, a full verification should be run now and then as well.
+
+    Nodes uploaded before checksums were introduced have no checksum yet, in
+    which case the checksum of the stored file is recorded. """
+
+from media_tree.media_backends import get_worker_pool
+from media_tree.models import FileNode
+from media_tree.utils import get_media_storage
+from media_tree.utils.checksums import get_stored_checksum
+from media_tree.utils.storage_probe import stat_many, get_timestamp
+from django.utils import timezone
+import multiprocessing
+import time
+
+
+BATCH_SIZE = 100
+
+
+class VerifyStats(object):
+    """ Counters describing the progress of :func:`verify_checksums`. """
+
+    def __init__(self):
+        self.started = time.time()
+        self.nodes = 0
+        self.verified = 0
+        self.recorded = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.mismatched = []
+        self.missing = []
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def throughput(self):
+        """ Returns the number of hashed megabytes per second. """
+        elapsed = self.elapsed
+        return self.bytes / 1048576.0 / elapsed if elapsed else 0.0
+
+
+def _get_stored_checksum(name):
+    return get_stored_checksum(get_media_storage(), name)
+
+
+def needs_verification(node, stat):
+    size, mtime, atime = stat
+    if not node['checksum'] or not node['checksum_verified'] \
+        or size != node['size'] or mtime is None:
+        return True
+    return mtime > get_timestamp(node['checksum_verified'])
+
+
+def verify_checksums(nodes, full=False, after=None, batch_size=BATCH_SIZE,
+                     workers=None):
+    """ Compares the stored files of all nodes in the ``nodes`` queryset
+        whose primary key is greater than ``after`` to their checksums. If
+        ``full`` is ``False``, files that have not changed since their last
+        verification are skipped.
+
+        Yields a ``(last_pk, stats)`` tuple after each batch, where
+        ``last_pk`` is the primary key that a later call can pass as
+        ``after`` in order to resume, and ``stats`` is a
+        :class:`VerifyStats` instance. """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    storage = get_media_storage()
+    stats = VerifyStats()
+    nodes = nodes.filter(node_type=FileNode.FILE).order_by('pk')
+    while True:
+        batch = nodes
+        if after is not None:
+            batch = batch.filter(pk__gt=after)
+        batch = list(batch.values('pk', 'file', 'size', 'checksum',
+                                  'checksum_verified')[:batch_size])
+        if not batch:
+            break
+
+        file_stats = stat_many(storage, [node['file'] for node in batch
+                                         if node['file']])
+        jobs = []
+        for node in batch:
+            stats.nodes += 1
+            stat = file_stats.get(node['file'])
+            if not stat:
+                stats.missing.append((node['pk'], node['file']))
+            elif full or needs_verification(node, stat):
+                jobs.append(node)
+            else:
+                stats.skipped += 1
+
+        names = [node['file'] for node in jobs]
+        if workers > 1 and len(jobs) > 1:
+            results = get_worker_pool(workers).map(_get_stored_checksum,
+                                                   names)
+        else:
+            results = map(_get_stored_checksum, names)
+
+        now = timezone.now()
+        verified_pks = []
+        for node, result in zip(jobs, results):
+            if not result:
+                stats.missing.append((node['pk'], node['file']))
+                continue
+            checksum, size = result
+            stats.bytes += size
+            if not node['checksum']:
+                FileNode.objects.filter(pk=node['pk']).update(
+                    checksum=checksum, checksum_verified=now)
+                stats.recorded += 1
+            elif checksum == node['checksum']:
+                verified_pks.append(node['pk'])
+            else:
+                stats.mismatched.append((node['pk'], node['file']))
+        if verified_pks:
+            FileNode.objects.filter(pk__in=verified_pks).update(
+                checksum_verified=now)
+            stats.verified += len(verified_pks)
+
+        after = batch[-1]['pk']
+        yield after, stats
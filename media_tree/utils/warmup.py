@@ -0,0 +1,147 @@
+""" Pre-generation of the configured thumbnail sizes for all images in the
+    media tree, for instance after a deployment or after changing
+    ``MEDIA_TREE_THUMBNAIL_SIZES``.
+
+    Images are processed in batches ordered by primary key, so that a run can
+    be resumed after the last node of the previous batch (see the
+    ``mediathumbs`` management command). """
+
+from media_tree import media_types, settings as app_settings
+from media_tree.media_backends import get_source_backend
+from media_tree.models import FileNode
+from media_tree.utils.bulk import get_ranges_q
+from media_tree.utils.filenode import get_selection_ranges
+from media_tree.utils.thumbnail_failures import record_failures
+from django.utils.datastructures import SortedDict
+import time
+
+
+BATCH_SIZE = 50
+
+
+def get_thumbnail_sizes(names=None):
+    """ Returns a dictionary of the configured thumbnail sizes with the given
+        names, or of all sizes if no names are given. Sizes that stand for
+        the original image size are left out. """
+    sizes = SortedDict()
+    for name, size in app_settings.MEDIA_TREE_THUMBNAIL_SIZES.items():
+        if size and (not names or name in names):
+            sizes[name] = size
+    if names:
+        for name in names:
+            if not name in sizes:
+                raise ValueError('There is no thumbnail size "%s".' % name)
+    return sizes
+
+
+def get_image_nodes(queryset=None):
+    """ Returns all image nodes in the media tree, or if ``queryset`` is
+        given, all image nodes among its nodes and their descendants. """
+    nodes = FileNode.objects.filter(node_type=FileNode.FILE,
+                                    media_type=media_types.SUPPORTED_IMAGE)
+    if queryset is not None:
+        ranges = get_selection_ranges(queryset)
+        if not ranges:
+            return nodes.none()
+        nodes = nodes.filter(get_ranges_q(ranges))
+    return nodes
+
+
+class WarmupStats(object):
+    """ Counters describing the progress of :func:`warm_thumbnails`. """
+
+    def __init__(self):
+        self.started = time.time()
+        self.nodes = 0
+        self.generated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.failures = []
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def throughput(self):
+        """ Returns the number of generated thumbnails per second. """
+        elapsed = self.elapsed
+        return self.generated / elapsed if elapsed else 0.0
+
+
+def get_thumbnail_bytes(thumbnail, storage):
+    """ Returns the size of ``thumbnail``, which is read from its own storage
+        if it has one, or else from ``storage``. """
+    storage = getattr(thumbnail, 'storage', None) or storage
+    try:
+        return storage.size(thumbnail.name)
+    except (NotImplementedError, EnvironmentError):
+        return 0
+
+
+def run_jobs(backend, jobs, stats, workers=None):
+    """ Generates the thumbnails for a list of ``(node, size_name, options)``
+        tuples using ``backend``, and updates ``stats`` accordingly. """
+    storage = backend.get_thumbnail_storage()
+    error = None
+    try:
+        thumbnails = backend.run_thumbnail_jobs(
+            [(node.file, options) for node, name, options in jobs], workers)
+    except Exception as inst:
+        error = inst
+        thumbnails = [None] * len(jobs)
+    failures = []
+    for (node, name, options), thumbnail in zip(jobs, thumbnails):
+        if thumbnail:
+            stats.generated += 1
+            stats.bytes += get_thumbnail_bytes(thumbnail, storage)
+        else:
+            stats.failed += 1
+            stats.failures.append((node.pk, node.file.name, name))
+            failures.append((node.file,
+                backend.get_source_options(node.file, options)))
+    record_failures(backend, failures, error)
+
+
+def warm_thumbnails(nodes, sizes, after=None, batch_size=BATCH_SIZE,
+                    workers=None):
+    """ Generates a thumbnail of each size in the ``sizes`` dictionary for
+        all nodes in the ``nodes`` queryset whose primary key is greater
+        than ``after``. Thumbnails that are already up to date are
+        skipped. If generating the thumbnails of a batch raises an
+        exception, all of them are recorded as failures (see
+        :mod:`media_tree.utils.thumbnail_failures`), and the next batch is
+        processed.
+
+        Yields a ``(last_pk, stats)`` tuple after each batch, where
+        ``last_pk`` is the primary key that a later call can pass as
+        ``after`` in order to resume, and ``stats`` is a
+        :class:`WarmupStats` instance. """
+    stats = WarmupStats()
+    nodes = nodes.order_by('pk')
+    while True:
+        batch = nodes
+        if after is not None:
+            batch = batch.filter(pk__gt=after)
+        batch = list(batch[:batch_size])
+        if not batch:
+            break
+
+        backend_jobs = SortedDict()
+        for node in batch:
+            stats.nodes += 1
+            backend = get_source_backend(node.file, fail_silently=False)
+            for name, size in sizes.items():
+                options = {'size': size}
+                if backend.thumbnail_exists(node.file, options):
+                    stats.skipped += 1
+                else:
+                    backend_jobs.setdefault(backend, []).append(
+                        (node, name, options))
+
+        for backend, jobs in backend_jobs.items():
+            run_jobs(backend, jobs, stats, workers)
+
+        after = batch[-1].pk
+        yield after, stats
@@ -7,9 +7,9 @@ from django.template.loader import render_to_string
 from django.utils.html import escape, format_html
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
-from media_tree import settings as app_settings, media_types
+from media_tree import settings as app_settings
 from media_tree.models import FileNode
-from media_tree.media_backends import get_media_backend, ThumbnailError
+from media_tree.media_backends import get_source_backend, ThumbnailError
 
 THUMBNAIL_EXTENSIONS = app_settings.MEDIA_TREE_THUMBNAIL_EXTENSIONS
 THUMBNAIL_SIZE = app_settings.MEDIA_TREE_THUMBNAIL_SIZES['default']
@@ -43,10 +43,8 @@ class ThumbnailMixin(object):
 
     def render(self, name, value, attrs=None):
         output = super(ThumbnailMixin, self).render(name, value, attrs)
-        media_backend = get_media_backend(
-            fail_silently=True, handles_media_types=(
-                media_types.SUPPORTED_IMAGE,))
         value = self.get_thumbnail_source(value)
+        media_backend = value and get_source_backend(value)
 
         if media_backend and value:
             try: